@@ -58,3 +58,7 @@ class TaskIndentDuplicate(DSSException):
 
 class StorageImageFileNotExist(DSSException):
     pass
+
+
+class DatabaseBusy(DSSException):
+    pass
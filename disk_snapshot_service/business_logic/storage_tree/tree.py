@@ -2,7 +2,7 @@ from anytree import LevelOrderIter
 from anytree import Node
 from anytree import find
 
-from data_access import db_query as db
+from data_access.db_operation import storage as db
 from business_logic import locker_manager as lm
 
 _locker = lm.LockWithTrace()
@@ -50,7 +50,7 @@ class DiskSnapshotStorageTree(object):
             self.node_dict[obj['ident']] = NodeOfDiskSnapshotStorage(obj)
 
         for ident, node in self.node_dict.items():
-            parent_ident = node.storage_obj['parent_ident']
+            parent_ident = node.storage['parent_ident']
             if parent_ident:
                 node.parent = self.node_dict[parent_ident]
             else:
@@ -58,11 +58,15 @@ class DiskSnapshotStorageTree(object):
                 self.root_node = node
 
     @staticmethod
-    def create_tree_inst(tree_ident):
-        """tree_ident所关联的有效快照存储节点，生成树"""
+    def create_tree_inst(tree_ident, s=None):
+        """tree_ident所关联的有效快照存储节点，生成树
+
+        :param s:
+            工作单元的session，为 None 时使用独立的session
+        """
 
         storage_tree = DiskSnapshotStorageTree()
-        storage_objs = db.SnapshotStorageTreeQuery(tree_ident).valid_obj_dicts()
+        storage_objs = db.SnapshotStorageTreeQuery(tree_ident, s).valid_obj_dicts()
         storage_tree.init_root(storage_objs)
         return storage_tree
 
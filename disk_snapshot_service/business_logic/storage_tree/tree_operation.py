@@ -8,16 +8,18 @@ from data_access import models as m
 class CreateTree(object):
     """创建完整树(虚拟节点+真实节点)"""
 
-    def __init__(self, tree_ident):
+    def __init__(self, tree_ident, s=None):
         self.tree_ident = tree_ident
+        self.session = s
 
     @property
     def storage_tree(self):
-        return tree.DiskSnapshotStorageTree.create_tree_inst(self.tree_ident)
+        return tree.DiskSnapshotStorageTree.create_tree_inst(self.tree_ident, self.session)
 
     @property
     def unconsumed_create_insts(self):
-        return journal.UnconsumedJournalsQuery(self.tree_ident, m.Journal.JOURNAL_CREATE_TYPES).query_insts()
+        return journal.UnconsumedJournalsQuery(
+            self.tree_ident, m.Journal.JOURNAL_CREATE_TYPES, self.session).query_insts()
 
     @property
     def complete_tree(self):
@@ -69,22 +71,19 @@ class GetStorageFromNode(object):
         self.nodes = nodes
 
     def get(self):
-        for node in self.nodes:
-            if isinstance(node, tree.NodeFromJournal):
-                self.nodes.remove(node)
-
-        return [node.storage for node in self.nodes]
+        return [node.storage for node in self.nodes if not isinstance(node, tree.NodeFromJournal)]
 
 
 class FetchStorageForChain(object):
     """获取生成chain的node"""
-    def __init__(self, tree_ident, ident):
+    def __init__(self, tree_ident, ident, s=None):
         self.tree_ident = tree_ident
         self.ident = ident
+        self.session = s
 
     @property
     def complete_tree(self):
-        return CreateTree(self.tree_ident).complete_tree
+        return CreateTree(self.tree_ident, self.session).complete_tree
 
     @property
     def fetch_nodes_for_chain(self):
@@ -93,4 +92,4 @@ class FetchStorageForChain(object):
 
     def fetch(self):
         """ 获取节点列表中真实存储节点对象"""
-        return GetStorageFromNode(self.fetch_nodes_for_chain).fetch()
+        return GetStorageFromNode(self.fetch_nodes_for_chain).get()
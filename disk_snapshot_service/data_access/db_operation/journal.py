@@ -1,9 +1,33 @@
+import functools
 import json
 
+import sqlalchemy
+from sqlalchemy.ext import baked
+
 from basic_library import xfunctions as xf
 from data_access.db_operation import session
 from data_access import models as m
 
+_bakery = baked.bakery()
+
+_JOURNAL_BY_TOKEN = _bakery(
+    lambda s: s.query(m.Journal).filter(m.Journal.token == sqlalchemy.bindparam('token')))
+"""按 token 查询日志，查询与编译后的 SQL 只构建一次"""
+
+
+@functools.lru_cache(maxsize=None)
+def _unconsumed_journals_query(has_tree_ident, has_journal_types):
+    """未消费日志的查询，按过滤条件的组合各构建一次"""
+
+    baked_query = _bakery(lambda s: s.query(m.Journal).filter(m.Journal.consumed_timestamp.is_(None)))
+    if has_tree_ident:
+        baked_query += lambda q: q.filter(m.Journal.tree_ident == sqlalchemy.bindparam('tree_ident'))
+    if has_journal_types:
+        baked_query += lambda q: q.filter(
+            m.Journal.operation_type.in_(sqlalchemy.bindparam('journal_types', expanding=True)))
+    baked_query += lambda q: q.order_by(m.Journal.id)
+    return baked_query
+
 
 class JournalNotExist(Exception):
     pass
@@ -12,8 +36,9 @@ class JournalNotExist(Exception):
 class JournalQuery(object):
     """获取 Journal"""
 
-    def __init__(self, token):
+    def __init__(self, token, s=None):
         self.token = token
+        self.session = s
 
     def get_obj(self):
         """获取数据
@@ -22,8 +47,8 @@ class JournalQuery(object):
             JournalNotExist
         """
 
-        with session.SessionForRead() as s:
-            obj = s.query(m.Journal).filter(m.Journal.token == self.token).first()
+        with session.session_for_read(self.session) as s:
+            obj = _JOURNAL_BY_TOKEN(s).params(token=self.token).first()
             if not obj:
                     raise JournalNotExist(f'not exist token : {self.token}')
             return obj
@@ -56,48 +81,52 @@ class JournalQuery(object):
 
 
 class UpdateJournal(object):
-    def __init__(self, token, column_name, new_data):
+    def __init__(self, token, column_name, new_data, s=None):
         self.token = token
         self.column_name = column_name  # 更新的字段名
         self.new_data = new_data  # 更新的数据
+        self.session = s
 
     def update(self):
-        with session.SessionForReadWrite() as s:
-            s.query(m.Journal).filter(m.Journal.token == self.token).update({self.column_name: self.new_data})
-            s.commit()
+        with session.session_for_read_write(self.session) as s:
+            (s.query(m.Journal)
+             .filter(m.Journal.token == self.token)
+             .update({self.column_name: self.new_data}, synchronize_session=False))
 
 
 class ConsumeJournalsQuery(object):
     """批量消费Journals"""
 
-    def __init__(self, tokens: list):
+    def __init__(self, tokens: list, s=None):
         self.tokens = tokens
+        self.session = s
 
     def consume(self):
-        with session.SessionWithTrans() as s:
-            for token in self.tokens:
-                s.query(m.Journal).filter(m.Journal.token == token).update(
-                    {"consumed_timestamp": xf.current_timestamp()}
-                )
+        with session.session_for_read_write(self.session) as s:
+            (s.query(m.Journal)
+             .filter(m.Journal.token.in_(self.tokens))
+             .update({"consumed_timestamp": xf.current_timestamp()}, synchronize_session=False))
 
 
 class UnconsumedJournalsQuery(object):
     """获取未消费的Journals"""
 
-    def __init__(self, tree_ident=None, journal_types=None):
+    def __init__(self, tree_ident=None, journal_types=None, s=None):
         self.tree_ident = tree_ident
         self.journal_types = journal_types
+        self.session = s
 
     def query_objs(self):
         """获取创建日志"""
 
-        with session.SessionForRead() as s:
-            q = s.query(m.Journal).filter(m.Journal.consumed_timestamp.is_(None))
-            if self.tree_ident:
-                q = q.filter(m.Journal.tree_ident == self.tree_ident)
-            if self.journal_types:
-                q = q.filter(m.Journal.operation_type.in_(self.journal_types))
-            return q.order_by(m.Journal.id).all()
+        baked_query = _unconsumed_journals_query(bool(self.tree_ident), bool(self.journal_types))
+        params = dict()
+        if self.tree_ident:
+            params['tree_ident'] = self.tree_ident
+        if self.journal_types:
+            params['journal_types'] = list(self.journal_types)
+        with session.session_for_read(self.session) as s:
+            return baked_query(s).params(**params).all()
 
     def journal_objs(self):
         """objs to dicts"""
@@ -122,6 +151,18 @@ def generate_create_inst(journal_obj):
     create_inst = dict(json.loads(journal_obj.operation_str))
     return create_inst
 
+
+def load_children_idents(journal_obj) -> list:
+    """获取日志的 children_idents ，该字段存储为json列表"""
+
+    if not journal_obj.children_idents:
+        return list()
+    return list(json.loads(journal_obj.children_idents))
+
+
+def dump_children_idents(children_idents) -> str:
+    return json.dumps(list(children_idents))
+
 # class CreateInst(object):
 #     """获取操作信息基类"""
 #
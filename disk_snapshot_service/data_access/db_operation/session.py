@@ -1,61 +1,399 @@
+import collections
+import sys
+import threading
+import time
+
 import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy import exc
 from sqlalchemy import orm
+from sqlalchemy import pool
+
+from basic_library import xdata
+from basic_library import xlogging
+
+_logger = xlogging.getLogger(__name__)
 
 db_connect_str = 'postgresql+psycopg2://postgres:f@127.0.0.1:21115/disksnapshotservice'
-create_engine = sqlalchemy.create_engine(db_connect_str, echo=False, pool_size=20, )
+
+POOL_CONFIG = {
+    'pool_size': 20,
+    'max_overflow': 10,
+    'pool_timeout': 1,
+    'pool_recycle': 3600,
+    'pool_pre_ping': True,
+}
+"""连接池参数
+
+:remark:
+    pool_timeout 为连接池饱和时等待空闲连接的秒数，超时后抛出 DatabaseBusy ，避免大量线程阻塞在连接池上
+"""
+
+_current_caller = threading.local()
+
+
+class _LatencyStatistics(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'avg_seconds': self.total / self.count if self.count else 0.0,
+            'max_seconds': self.max,
+        }
+
+
+class PoolStatistics(object):
+    """连接池统计
+
+    :remark:
+        checkout 等待耗时由 _InstrumentedQueuePool 记录
+        使用中的连接数、失效连接数以及各调用者的使用情况由连接池事件记录
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.in_use = 0
+        self.max_in_use = 0
+        self.invalidations = 0
+        self.busy_errors = 0
+        self.checkout_wait = _LatencyStatistics()
+        self.caller_checkouts = collections.Counter()
+        self.caller_hold = collections.defaultdict(_LatencyStatistics)
+        self.locker = threading.Lock()
+
+    def install(self, engine):
+        self.pool = engine.pool
+        engine.pool.statistics = self
+        event.listen(engine, 'checkout', self._on_checkout)
+        event.listen(engine, 'checkin', self._on_checkin)
+        event.listen(engine, 'invalidate', self._on_invalidate)
+
+    def add_checkout_wait(self, seconds, is_busy):
+        with self.locker:
+            self.checkout_wait.add(seconds)
+            if is_busy:
+                self.busy_errors += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        caller = getattr(_current_caller, 'name', None) or 'unknown'
+        connection_record.info['checkout'] = (caller, time.monotonic(),)
+        with self.locker:
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.caller_checkouts[caller] += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        if connection_record is None:
+            return
+        checkout = connection_record.info.pop('checkout', None)
+        if checkout is None:
+            return
+        with self.locker:
+            self.in_use -= 1
+            self.caller_hold[checkout[0]].add(time.monotonic() - checkout[1])
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.locker:
+            self.invalidations += 1
+        _logger.warning(f'db connection invalidated : {exception}')
+
+    def to_dict(self) -> dict:
+        with self.locker:
+            return {
+                'size': self.pool.size(),
+                'checked_in': self.pool.checkedin(),
+                'overflow': self.pool.overflow(),
+                'in_use': self.in_use,
+                'max_in_use': self.max_in_use,
+                'invalidations': self.invalidations,
+                'busy_errors': self.busy_errors,
+                'checkout_wait': self.checkout_wait.to_dict(),
+                'callers': {caller: {
+                    'checkouts': count,
+                    'hold': self.caller_hold[caller].to_dict(),
+                } for caller, count in self.caller_checkouts.items()},
+            }
+
+
+class _InstrumentedQueuePool(pool.QueuePool):
+    """记录 checkout 等待耗时的连接池"""
+
+    statistics = None
+
+    def _do_get(self):
+        start = time.monotonic()
+        is_busy = False
+        try:
+            return super(_InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            is_busy = True
+            raise
+        finally:
+            if self.statistics is not None:
+                self.statistics.add_checkout_wait(time.monotonic() - start, is_busy)
+
+    def recreate(self):
+        new_pool = super(_InstrumentedQueuePool, self).recreate()
+        new_pool.statistics = self.statistics
+        if self.statistics is not None:
+            self.statistics.pool = new_pool
+        return new_pool
+
+
+def _create_engine(connect_str, pool_config):
+    engine = sqlalchemy.create_engine(connect_str, echo=False, poolclass=_InstrumentedQueuePool, **pool_config)
+    PoolStatistics().install(engine)
+    return engine
+
+
+create_engine = _create_engine(db_connect_str, POOL_CONFIG)
 session_maker = orm.sessionmaker(bind=create_engine)
 
 
+def configure_engine(connect_str=None, **pool_config):
+    """使用新的连接串或者连接池参数重建数据库引擎
+
+    :param pool_config:
+        参考 POOL_CONFIG ，未传入的参数使用 POOL_CONFIG 中的值
+    :remark:
+        已创建的session仍使用旧的引擎
+    """
+    global db_connect_str, create_engine
+
+    config = dict(POOL_CONFIG)
+    config.update(pool_config)
+    old_engine = create_engine
+    db_connect_str = db_connect_str if connect_str is None else connect_str
+    create_engine = _create_engine(db_connect_str, config)
+    session_maker.configure(bind=create_engine)
+    old_engine.dispose()
+    return create_engine
+
+
+def get_pool_statistics() -> dict:
+    return create_engine.pool.statistics.to_dict()
+
+
+class ReplicaRouter(object):
+    """只读副本路由
+
+    :remark:
+        调用者声明可以接受过期数据（allow_stale）时，读session使用只读副本
+        副本延迟超过 max_lag_bytes 、副本不可用或者未配置副本时，仍使用主库
+        锁空间内的读取不声明 allow_stale ，始终使用主库
+        检查结果缓存 check_interval 秒，避免每次读取都查询主库与副本
+    """
+
+    def __init__(self, replica_engine, max_lag_bytes=16 * 1024 * 1024, check_interval=1.0, freshness_check=None):
+        """
+        :param freshness_check:
+            返回副本是否足够新的函数；为 None 时比较主库与副本的 WAL LSN
+        """
+        self.engine = replica_engine
+        self.session_maker = orm.sessionmaker(bind=replica_engine)
+        self.max_lag_bytes = max_lag_bytes
+        self.check_interval = check_interval
+        self.freshness_check = self._is_wal_lag_acceptable if freshness_check is None else freshness_check
+        self.is_fresh = False
+        self.check_time = None
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.locker = threading.Lock()
+
+    def _is_wal_lag_acceptable(self) -> bool:
+        with self.engine.connect() as replica_connection:
+            replay_lsn = replica_connection.execute(sqlalchemy.text('SELECT pg_last_wal_replay_lsn()')).scalar()
+        if replay_lsn is None:
+            _logger.warning(f'replica {self.engine.url!r} is not in recovery, skip')
+            return False
+        with create_engine.connect() as primary_connection:
+            lag_bytes = primary_connection.execute(
+                sqlalchemy.text('SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), CAST(:replay_lsn AS pg_lsn))'),
+                {'replay_lsn': replay_lsn}).scalar()
+        return lag_bytes <= self.max_lag_bytes
+
+    def _check_fresh(self) -> bool:
+        now = time.monotonic()
+        with self.locker:
+            if self.check_time is not None and now - self.check_time < self.check_interval:
+                return self.is_fresh
+            self.check_time = now
+
+        try:
+            is_fresh = bool(self.freshness_check())
+        except Exception as e:
+            _logger.warning(f'check replica freshness failed : {e}')
+            is_fresh = False
+
+        with self.locker:
+            self.is_fresh = is_fresh
+        return is_fresh
+
+    def create_session(self):
+        """副本足够新时返回副本的session，否则返回主库的session"""
+
+        is_fresh = self._check_fresh()
+        with self.locker:
+            if is_fresh:
+                self.replica_reads += 1
+            else:
+                self.primary_reads += 1
+        return self.session_maker() if is_fresh else session_maker()
+
+    def to_dict(self) -> dict:
+        return {
+            'is_fresh': self.is_fresh,
+            'replica_reads': self.replica_reads,
+            'primary_reads': self.primary_reads,
+            'pool': self.engine.pool.statistics.to_dict(),
+        }
+
+
+_replica_router = None
+
+
+def configure_replica(connect_str, max_lag_bytes=16 * 1024 * 1024, check_interval=1.0, freshness_check=None,
+                      **pool_config):
+    """配置只读副本，connect_str 为 None 时取消副本
+
+    :param pool_config:
+        参考 POOL_CONFIG ，未传入的参数使用 POOL_CONFIG 中的值
+    """
+    global _replica_router
+
+    old_router = _replica_router
+    if connect_str is None:
+        _replica_router = None
+    else:
+        config = dict(POOL_CONFIG)
+        config.update(pool_config)
+        _replica_router = ReplicaRouter(
+            _create_engine(connect_str, config), max_lag_bytes, check_interval, freshness_check)
+    if old_router is not None:
+        old_router.engine.dispose()
+    return _replica_router
+
+
+def get_replica_router():
+    return _replica_router
+
+
+def _get_caller_name(depth):
+    frame = sys._getframe(depth + 1)
+    instance = frame.f_locals.get('self', None)
+    return type(instance).__name__ if instance is not None else frame.f_code.co_name
+
+
+class _CallerScope(object):
+    """在session使用期间记录调用者，用于统计各调用者使用连接的情况"""
+
+    def __init__(self, caller):
+        self.caller = caller
+        self.previous_caller = None
+
+    def enter(self):
+        self.previous_caller = getattr(_current_caller, 'name', None)
+        _current_caller.name = self.caller
+
+    def exit(self):
+        _current_caller.name = self.previous_caller
+
+
+def _raise_if_busy(exc_val):
+    """连接池饱和时 QueuePool 抛出 TimeoutError ，转换为 DatabaseBusy"""
+
+    if isinstance(exc_val, exc.TimeoutError):
+        xlogging.raise_and_logging_error(
+            '数据库繁忙', f'db connection pool busy : {exc_val}', print_args=False,
+            exception_class=xdata.DatabaseBusy)
+
+
 class SessionForRead(object):
-    """读session"""
+    """读session
 
-    def __init__(self, session=None, close_when_exit=True):
-        if session is None:
-            self.session = session_maker()
-        else:
+    :remark:
+        allow_stale 为 True 时，表示调用者可以接受稍有延迟的数据，可能使用只读副本，参考 ReplicaRouter
+    """
+
+    def __init__(self, session=None, close_when_exit=True, caller=None, allow_stale=False):
+        if session is not None:
             self.session = session
+        elif allow_stale and _replica_router is not None:
+            self.session = _replica_router.create_session()
+        else:
+            self.session = session_maker()
         self.close_when_exit = close_when_exit
+        self.caller_scope = _CallerScope(caller or _get_caller_name(1))
 
     def __enter__(self):
+        self.caller_scope.enter()
         return self.session
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.close_when_exit:
-            self.session.close()
+        try:
+            if self.close_when_exit:
+                self.session.close()
+        finally:
+            self.caller_scope.exit()
+        _raise_if_busy(exc_val)
 
 
 class SessionForReadWrite(object):
-    """读写session"""
+    """读写session
+
+    :remark:
+        传入外部session时（例如 UnitOfWork.session），退出时不提交也不回滚，由session的创建者结束事务
+    """
 
-    def __init__(self, session=None, close_when_exit=True):
+    def __init__(self, session=None, close_when_exit=True, caller=None):
         if session is None:
             self.session = session_maker()
+            self.own_transaction = True
         else:
             self.session = session
+            self.own_transaction = False
         self.close_when_exit = close_when_exit
+        self.caller_scope = _CallerScope(caller or _get_caller_name(1))
 
     def __enter__(self):
+        self.caller_scope.enter()
         return self.session
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         try:
-            if exc_type is None:
+            if not self.own_transaction:
+                pass  # 由session的创建者结束事务
+            elif exc_type is None:
                 self.session.commit()
             else:
                 self.session.rollback()
         finally:
             if self.close_when_exit:
                 self.session.close()
+            self.caller_scope.exit()
+        _raise_if_busy(exc_val)
 
 
 class SessionWithTrans(object):
     """带事务的session"""
 
-    def __init__(self):
+    def __init__(self, caller=None):
         self.session = session_maker()
         self.session_trans = None
+        self.caller_scope = _CallerScope(caller or _get_caller_name(1))
 
     def __enter__(self):
+        self.caller_scope.enter()
         self.session_trans = self.session.begin()
         return self.session_trans.__enter__().session
 
@@ -66,3 +404,44 @@ class SessionWithTrans(object):
                 self.session_trans = None
         finally:
             self.session.close()
+            self.caller_scope.exit()
+        _raise_if_busy(exc_val)
+
+
+class UnitOfWork(object):
+    """请求级工作单元
+
+    :remark:
+        一次请求中的所有数据库操作共用一个session，也就是一个连接与一个事务
+        数据库操作对象通过参数 s=unit_of_work.session 加入工作单元，内部只 flush ，不 commit
+        正常退出时提交，发生异常时回滚，中途失败不会留下部分修改
+    """
+
+    def __init__(self, caller=None):
+        self.session = session_maker()
+        self.caller_scope = _CallerScope(caller or _get_caller_name(1))
+
+    def __enter__(self):
+        self.caller_scope.enter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.session.commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.session.close()
+            self.caller_scope.exit()
+        _raise_if_busy(exc_val)
+
+
+def session_for_read(s=None, allow_stale=False):
+    """使用外部session（工作单元）时不关闭该session"""
+    return SessionForRead(s, close_when_exit=s is None, caller=_get_caller_name(1), allow_stale=allow_stale)
+
+
+def session_for_read_write(s=None):
+    """使用外部session（工作单元）时不提交、不关闭该session"""
+    return SessionForReadWrite(s, close_when_exit=s is None, caller=_get_caller_name(1))
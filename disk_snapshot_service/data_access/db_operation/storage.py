@@ -1,17 +1,54 @@
+import sqlalchemy
+from sqlalchemy.ext import baked
+
 from data_access.db_operation import session
 from data_access import models as m
 
+STORAGE_NODE_COLUMNS = (
+    m.SnapshotStorage.ident,
+    m.SnapshotStorage.parent_ident,
+    m.SnapshotStorage.parent_timestamp,
+    m.SnapshotStorage.type,
+    m.SnapshotStorage.disk_bytes,
+    m.SnapshotStorage.status,
+    m.SnapshotStorage.image_path,
+    m.SnapshotStorage.tree_ident,
+    m.SnapshotStorage.file_level_deduplication,
+)
+"""生成树节点与快照存储链所需的字段"""
+
+STORAGE_NODE_KEYS = tuple(column.key for column in STORAGE_NODE_COLUMNS)
+
+_bakery = baked.bakery()
+
+_VALID_STORAGE_ROWS_BY_TREE = _bakery(
+    lambda s: s.query(*STORAGE_NODE_COLUMNS)
+    .filter(m.SnapshotStorage.tree_ident == sqlalchemy.bindparam('tree_ident'))
+    .filter(m.SnapshotStorage.status.notin_(m.SnapshotStorage.INVALID_STORAGE_STATUS)))
+"""按树查询有效快照存储的投影字段，查询与编译后的 SQL 只构建一次"""
+
+_STORAGE_BY_IDENT = _bakery(
+    lambda s: s.query(m.SnapshotStorage).filter(m.SnapshotStorage.ident == sqlalchemy.bindparam('ident')))
+
 
 class SnapshotStorageTreeQuery(object):
     """获取 SnapshotStorageTree"""
 
-    def __init__(self, tree_ident):
+    def __init__(self, tree_ident, s=None, allow_stale=False):
+        """
+        :param s:
+            工作单元的session，为 None 时使用独立的session
+        :param allow_stale:
+            可以接受稍有延迟的数据，用于不在锁空间内的只读查询（例如预览），参考 session.ReplicaRouter
+        """
         self.tree_ident = tree_ident
+        self.session = s
+        self.allow_stale = allow_stale
 
     def query_valid_objs(self):
         """获取有效的数据"""
 
-        with session.SessionForRead() as s:
+        with session.session_for_read(self.session, self.allow_stale) as s:
             objs = (s.query(m.SnapshotStorage)
                     .filter(m.SnapshotStorage.tree_ident == self.tree_ident)
                     .filter(m.SnapshotStorage.status.notin_(m.SnapshotStorage.INVALID_STORAGE_STATUS))
@@ -19,15 +56,25 @@ class SnapshotStorageTreeQuery(object):
                     )
             return objs
 
+    def query_valid_rows(self):
+        """获取有效的数据，仅查询 STORAGE_NODE_COLUMNS 字段
+
+        :remark:
+            返回元组，不生成ORM对象，没有 identity map 与属性监测的开销
+        """
+
+        with session.session_for_read(self.session, self.allow_stale) as s:
+            return _VALID_STORAGE_ROWS_BY_TREE(s).params(tree_ident=self.tree_ident).all()
+
     def valid_obj_dicts(self):
-        """有效数据字典对象集"""
+        """有效数据字典对象集，key 为 STORAGE_NODE_KEYS"""
 
-        return [obj.to_dict for obj in self.query_valid_objs()]
+        return [dict(zip(STORAGE_NODE_KEYS, row)) for row in self.query_valid_rows()]
 
     def query_all_objs(self):
         """获取所有的数据"""
 
-        with session.SessionForRead() as s:
+        with session.session_for_read(self.session, self.allow_stale) as s:
             objs = (s.query(m.SnapshotStorage)
                     .filter(m.SnapshotStorage.tree_ident == self.tree_ident)
                     .all()
@@ -37,42 +84,44 @@ class SnapshotStorageTreeQuery(object):
     def all_obj_dict(self):
         """所有数据字典对象集"""
 
-        return [obj.to_dict for obj in self.query_all_objs()]
+        return [obj.obj_to_dict() for obj in self.query_all_objs()]
 
 
 class SnapshotStorageAdd(object):
-    def __init__(self, normal_create_inst, image_path, parent_storage_obj, tree_ident):
+    def __init__(self, normal_create_inst, image_path, parent_storage_obj, tree_ident, s=None):
         self.normal_create_inst = normal_create_inst
         self.image_path = image_path
         self.parent_storage_obj = parent_storage_obj
         self.tree_ident = tree_ident
+        self.session = s
 
         self.parent_ident = (
             self.parent_storage_obj['parent_ident'] if self.parent_storage_obj else None)
         self.parent_timestamp = (
             self.parent_storage_obj['parent_timestamp'] if self.parent_storage_obj else None)
 
-    def add(self):
+    def add(self) -> dict:
+        """插入新快照存储，使用 RETURNING 直接返回插入的数据，无需再次查询"""
+
         assert self.normal_create_inst['operation_type'] == m.Journal.TYPE_NORMAL_CREATE
 
-        new_storage_info = m.SnapshotStorage(
-            ident=self.normal_create_inst.new_ident,
-            parent_ident=self.parent_ident,
-            parent_timestamp=self.parent_timestamp,
-            type=self.normal_create_inst.new_type,
-            disk_bytes=self.normal_create_inst.new_disk_bytes,
-            status=m.SnapshotStorage.STATUS_CREATING,
-            image_path=self.image_path,
-            tree_ident=self.tree_ident,
-        )
-
-        with session.SessionForReadWrite() as s:
-            s.add(new_storage_info)
-            s.commit()
-            new_storage_obj = (s.query(m.SnapshotStorage)
-                               .filter(m.SnapshotStorage.ident == self.normal_create_inst.new_ident)
-                               .first())
-            return new_storage_obj.obj_to_dict()
+        table = m.SnapshotStorage.__table__
+        statement = (sqlalchemy.insert(table)
+                     .values(ident=self.normal_create_inst['new_ident'],
+                             parent_ident=self.parent_ident,
+                             parent_timestamp=self.parent_timestamp,
+                             type=self.normal_create_inst['new_type'],
+                             disk_bytes=self.normal_create_inst['new_disk_bytes'],
+                             status=m.SnapshotStorage.STATUS_CREATING,
+                             image_path=self.image_path,
+                             tree_ident=self.tree_ident,
+                             )
+                     .returning(*table.columns)
+                     )
+
+        with session.session_for_read_write(self.session) as s:
+            result = s.execute(statement)
+            return dict(zip(result.keys(), result.first()))
 
 
 class SnapshotStorageQuery(object):
@@ -84,7 +133,7 @@ class SnapshotStorageQuery(object):
         """获取快照对象"""
 
         with session.SessionForRead() as s:
-            return s.query(m.SnapshotStorage).filter(m.SnapshotStorage.ident == self.ident).first()
+            return _STORAGE_BY_IDENT(s).params(ident=self.ident).first()
 
     @property
     def get_obj_dict(self):
@@ -97,19 +146,39 @@ class SnapshotStorageQuery(object):
         """查询某ident是否存在"""
 
         with session.SessionForRead() as s:
-            if s.query(m.SnapshotStorage).filter(m.SnapshotStorage.ident == self.ident).first():
+            if _STORAGE_BY_IDENT(s).params(ident=self.ident).first():
                 return True
             else:
                 return False
 
 
 class UpdateSnapshotStorage(object):
-    def __init__(self, ident, column_name, new_data):
+    def __init__(self, ident, column_name, new_data, s=None):
         self.ident = ident
         self.column_name = column_name  # 更新的字段名
         self.new_data = new_data  # 更新的数据
+        self.session = s
 
     def update(self):
-        with session.SessionForReadWrite() as s:
-            s.query(m.Journal).filter(m.SnapshotStorage.ident == self.ident).update({self.column_name: self.new_data})
-            s.commit()
+        with session.session_for_read_write(self.session) as s:
+            (s.query(m.SnapshotStorage)
+             .filter(m.SnapshotStorage.ident == self.ident)
+             .update({self.column_name: self.new_data}, synchronize_session=False))
+
+
+class UpdateSnapshotStoragesParent(object):
+    """批量更新快照存储的 parent_ident ，一条 UPDATE 语句完成"""
+
+    def __init__(self, idents, parent_ident, s=None):
+        self.idents = list(idents)
+        self.parent_ident = parent_ident
+        self.session = s
+
+    def update(self):
+        if not self.idents:
+            return
+
+        with session.session_for_read_write(self.session) as s:
+            (s.query(m.SnapshotStorage)
+             .filter(m.SnapshotStorage.ident.in_(self.idents))
+             .update({'parent_ident': self.parent_ident}, synchronize_session=False))
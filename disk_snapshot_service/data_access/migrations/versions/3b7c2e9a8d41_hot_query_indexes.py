@@ -0,0 +1,34 @@
+"""hot query indexes
+
+Revision ID: 3b7c2e9a8d41
+Revises: f1d451924f25
+Create Date: 2026-10-19 10:12:43.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7c2e9a8d41'
+down_revision = 'f1d451924f25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 有效快照存储：tree_ident == ? AND status NOT IN (...)
+    op.create_index('ix_snapshot_storage_tree_ident_status', 'snapshot_storage', ['tree_ident', 'status'])
+    # 查找子节点
+    op.create_index('ix_snapshot_storage_parent_ident', 'snapshot_storage', ['parent_ident'])
+    # 未消费的日志：tree_ident == ? AND consumed_timestamp IS NULL ORDER BY id
+    op.create_index('ix_journal_unconsumed_tree_ident_id', 'journal', ['tree_ident', 'id'],
+                    postgresql_where=sa.text('consumed_timestamp IS NULL'))
+    op.create_index('ix_journal_tree_ident_consumed_timestamp', 'journal', ['tree_ident', 'consumed_timestamp'])
+
+
+def downgrade():
+    op.drop_index('ix_journal_tree_ident_consumed_timestamp', table_name='journal')
+    op.drop_index('ix_journal_unconsumed_tree_ident_id', table_name='journal')
+    op.drop_index('ix_snapshot_storage_parent_ident', table_name='snapshot_storage')
+    op.drop_index('ix_snapshot_storage_tree_ident_status', table_name='snapshot_storage')
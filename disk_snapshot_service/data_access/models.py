@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DECIMAL, ForeignKey, BigInteger, Boolean
+from sqlalchemy import Column, String, DECIMAL, ForeignKey, BigInteger, Boolean, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -39,6 +39,12 @@ class Journal(Base):
     operation_type = Column(String(3), nullable=False)  # operation_type 为枚举类型
     children_idents = Column(String(255), nullable=True)
 
+    __table_args__ = (
+        Index('ix_journal_unconsumed_tree_ident_id', 'tree_ident', 'id',
+              postgresql_where=text('consumed_timestamp IS NULL')),
+        Index('ix_journal_tree_ident_consumed_timestamp', 'tree_ident', 'consumed_timestamp'),
+    )
+
 
 class SnapshotStorage(Base):
     __tablename__ = 'snapshot_storage'
@@ -80,6 +86,11 @@ class SnapshotStorage(Base):
     file_level_deduplication = Column(Boolean, nullable=True)
     hash = relationship("Hash")
 
+    __table_args__ = (
+        Index('ix_snapshot_storage_tree_ident_status', 'tree_ident', 'status'),
+        Index('ix_snapshot_storage_parent_ident', 'parent_ident'),
+    )
+
 
 class Hash(Base):
     __tablename__ = 'hash'
@@ -10,6 +10,7 @@ from business_logic.storage_chain import chain_operation
 
 from data_access import models as m
 from data_access.db_operation import journal
+from data_access.db_operation import session
 from data_access.db_operation import storage
 
 storage_reference_manager = storage_reference_manager.StorageReferenceManager()
@@ -18,7 +19,12 @@ handle_manager = handle_pool.HandleManager()
 
 
 class CreateDiskSnapshotStorage(object):
-    """创建磁盘快照存储"""
+    """创建磁盘快照存储
+
+    :remark:
+        创建过程中的数据库操作在同一个工作单元（一个session，一个事务）中完成
+        任何一步失败都会回滚，不会留下已消费的日志或者部分更新的依赖关系
+    """
 
     def __init__(self, handle: str, token: str, trace_debug: str, caller_pid: int):
         self.token = token
@@ -30,8 +36,13 @@ class CreateDiskSnapshotStorage(object):
         self.storage_reference_manager = storage_reference_manager
         self.handle_manager = handle_manager
 
+        self._session = None
+        self._journal_obj_cache = None
+        self._normal_create_inst_cache = None
+        self._storages_for_chain_cache = None
+
     def __str__(self):
-        return f'query chain for creating new snapshot storage : <{self._normal_create_inst.new_ident}>'
+        return f'query chain for creating new snapshot storage : <{self.token}>'
 
     @property
     def caller_name(self):
@@ -39,8 +50,8 @@ class CreateDiskSnapshotStorage(object):
 
     @property
     def _trace_msg(self):
-        params = (self._new_ident, self.caller_pid, self.trace_debug, self.handle)
-        return 'create new_storage:{},PID:{},trace_debug:{},handle:{}'.format(*params)
+        params = (self.token, self.caller_pid, self.trace_debug, self.handle)
+        return 'create new_storage by token:{},PID:{},trace_debug:{},handle:{}'.format(*params)
 
     @property
     def _disk_bytes(self):
@@ -48,15 +59,21 @@ class CreateDiskSnapshotStorage(object):
 
     @property
     def _journal_obj(self):
-        journal_obj = journal.JournalQuery(self.token).get_obj()
-        assert journal_obj['operation_type'] == m.Journal.TYPE_NORMAL_CREATE
+        """日志对象，在工作单元中仅查询并消费一次"""
+
+        if self._journal_obj_cache is None:
+            journal_obj = journal.JournalQuery(self.token, self._session).get_obj()
+            assert journal_obj.operation_type == m.Journal.TYPE_NORMAL_CREATE
 
-        journal.ConsumeJournalsQuery([self.token, ]).consume()
-        return journal_obj
+            journal.ConsumeJournalsQuery([self.token, ], self._session).consume()
+            self._journal_obj_cache = journal_obj
+        return self._journal_obj_cache
 
     @property
     def _normal_create_inst(self):
-        return journal.generate_create_inst(self._journal_obj)
+        if self._normal_create_inst_cache is None:
+            self._normal_create_inst_cache = journal.generate_create_inst(self._journal_obj)
+        return self._normal_create_inst_cache
 
     @property
     def _new_ident(self) -> str:
@@ -76,7 +93,7 @@ class CreateDiskSnapshotStorage(object):
 
     @property
     def _tree_ident(self):
-        return self._journal_obj['tree_ident']
+        return self._journal_obj.tree_ident
 
     @property
     def _parent_ident(self):
@@ -86,15 +103,15 @@ class CreateDiskSnapshotStorage(object):
             return self._normal_create_inst['parent_ident']
 
     @property
-    def _storages_for_chain(self):
+    def _storages_for_chain(self) -> list:
         """生成chain所依赖的真实存储节点"""
 
         if self._is_root_node:
-            return None
-        else:
-            nodes_for_chain = tree_operation.FetchNodes(self._tree_ident, self._parent_ident).fetch()
-            storages_for_chain = tree_operation.GetStorageFromNode(nodes_for_chain).get()
-            return storages_for_chain
+            return list()
+        if self._storages_for_chain_cache is None:
+            self._storages_for_chain_cache = tree_operation.FetchStorageForChain(
+                self._tree_ident, self._parent_ident, self._session).fetch()
+        return self._storages_for_chain_cache
 
     @property
     def _image_path(self):
@@ -113,8 +130,9 @@ class CreateDiskSnapshotStorage(object):
         """未消费的/创建型 日志"""
 
         return journal.UnconsumedJournalsQuery(tree_ident=self._tree_ident,
-                                               journal_types=m.Journal.JOURNAL_CREATE_TYPES
-                                               ).query_insts()
+                                               journal_types=m.Journal.JOURNAL_CREATE_TYPES,
+                                               s=self._session,
+                                               ).query_objs()
 
     @property
     def _relied_storage_obj(self):
@@ -130,51 +148,48 @@ class CreateDiskSnapshotStorage(object):
 
         return parent_storage_obj
 
-    @property
-    def _new_storage_obj(self):
+    def _add_new_storage_obj(self):
         """创建新快照点，返回新创建的快照对象"""
 
-        params = self._normal_create_inst, self._image_path, self._relied_storage_obj, self._tree_ident
+        params = self._normal_create_inst, self._image_path, self._relied_storage_obj, self._tree_ident, self._session
         return storage.SnapshotStorageAdd(*params).add()
 
     def update_children_parent(self):
-        """更新子节点的 parent_ident """
+        """更新子节点的 parent_ident ，一条 UPDATE 语句完成"""
 
-        children_idents = list(self._journal_obj['children_idents'])
-        new_ident = self._new_ident
-        if children_idents:
-            for child_ident in children_idents:
-                storage.UpdateSnapshotStorage(child_ident, 'parent_ident', new_ident)
+        children_idents = journal.load_children_idents(self._journal_obj)
+        storage.UpdateSnapshotStoragesParent(children_idents, self._new_ident, self._session).update()
 
     def update_parent_journal(self):
         """若父节点为虚拟点，则更新父日志表的 children_idents 字段"""
 
-        unconsumed_create_journals = self._unconsumed_create_journals
-        if unconsumed_create_journals:
-            for j in unconsumed_create_journals:
-                # inst = journal.JournalQuery.get_inst_from_journal_obj(j)
-                token = j.token
-                inst = journal.JournalQuery(token).get_inst()
-                inst_ident = inst.new_ident
-                if inst_ident == self._parent_ident:
-                    parent_journal_token = j['token']
-                    children_idents_of_parent_journal = j['children_idents']
-                    new_data = str(list(children_idents_of_parent_journal).append(self._new_ident))
-                    journal.UpdateJournal(parent_journal_token, 'children_idents', new_data)
+        if self._is_root_node:
+            return
 
-    @property
-    def _acquired_chain(self):
-        # new_storage_obj 添加到 storages_for_chain
-        storages = self._storages_for_chain.append(self._new_storage_obj)
+        for j in self._unconsumed_create_journals:
+            if journal.generate_create_inst(j)['new_ident'] != self._parent_ident:
+                continue
+            children_idents = journal.load_children_idents(j) + [self._new_ident, ]
+            journal.UpdateJournal(
+                j.token, 'children_idents', journal.dump_children_idents(children_idents), self._session).update()
+
+    def _acquired_chain(self, new_storage_obj):
+        storages = self._storages_for_chain + [new_storage_obj, ]
         parameter = (self.storage_reference_manager, self.caller_name, storages, chain.StorageChainForRW)
         return chain_operation.GenerateChain(*parameter).acquired_chain
 
     def _generate_handle(self):
         with self.journal_manager.get_locker(self._trace_msg):
             with tree.DiskSnapshotStorageTree.get_locker(self._trace_msg):
-                acquired_chain = self._acquired_chain
-                self.update_parent_journal()  # 更新父日志表的 children_idents 字段
-                self.update_children_parent()  # 如果当前普通创建的父为普通创建，则更新父日志表的children字段
+                with session.UnitOfWork() as unit_of_work:
+                    self._session = unit_of_work.session
+                    try:
+                        new_storage_obj = self._add_new_storage_obj()
+                        self.update_parent_journal()  # 若父节点为虚拟点，则更新父日志表的 children_idents 字段
+                        self.update_children_parent()  # 更新子节点的 parent_ident
+                    finally:
+                        self._session = None
+                acquired_chain = self._acquired_chain(new_storage_obj)
                 return self.handle_manager.generate_write_handle(acquired_chain, self.handle)
 
     def _generate_raw_flag(self) -> str:
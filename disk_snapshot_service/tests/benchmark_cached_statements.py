@@ -0,0 +1,78 @@
+"""对比每次构建查询与 baked query 的单次调用CPU耗时
+
+运行方式（在 disk_snapshot_service 目录下）：
+    python -m tests.benchmark_cached_statements [调用次数]
+
+使用内存 sqlite 数据库与少量数据，耗时主要为查询构建、编译与结果处理
+"""
+
+import sys
+import time
+
+from data_access import models as m
+from data_access.db_operation import journal
+from data_access.db_operation import storage
+from tests import benchmark_tree_loader
+
+TREE_IDENT = benchmark_tree_loader.TREE_IDENT
+
+
+def _create_session():
+    s = benchmark_tree_loader._create_session(200, 50)
+    s.execute(m.Journal.__table__.insert(), [{
+        'produced_timestamp': i,
+        'consumed_timestamp': None if i % 2 else i,
+        'token': f't{i}',
+        'tree_ident': TREE_IDENT,
+        'operation_str': '{}',
+        'operation_type': m.Journal.TYPE_NORMAL_CREATE,
+    } for i in range(100)])
+    s.commit()
+    return s
+
+
+def _query_cases(s):
+    yield ('journal by token',
+           lambda: s.query(m.Journal).filter(m.Journal.token == 't1').first(),
+           lambda: journal.JournalQuery('t1', s).get_obj())
+    yield ('unconsumed journals',
+           lambda: (s.query(m.Journal)
+                    .filter(m.Journal.consumed_timestamp.is_(None))
+                    .filter(m.Journal.tree_ident == TREE_IDENT)
+                    .filter(m.Journal.operation_type.in_(m.Journal.JOURNAL_CREATE_TYPES))
+                    .order_by(m.Journal.id).all()),
+           lambda: journal.UnconsumedJournalsQuery(TREE_IDENT, m.Journal.JOURNAL_CREATE_TYPES, s).query_objs())
+    yield ('valid storages',
+           lambda: (s.query(*storage.STORAGE_NODE_COLUMNS)
+                    .filter(m.SnapshotStorage.tree_ident == TREE_IDENT)
+                    .filter(m.SnapshotStorage.status.notin_(m.SnapshotStorage.INVALID_STORAGE_STATUS))
+                    .all()),
+           lambda: storage.SnapshotStorageTreeQuery(TREE_IDENT, s).query_valid_rows())
+    yield ('storage by ident',
+           lambda: s.query(m.SnapshotStorage).filter(m.SnapshotStorage.ident == 's1').first(),
+           lambda: storage._STORAGE_BY_IDENT(s).params(ident='s1').first())
+
+
+def _cpu_per_call(fn, times) -> float:
+    fn()  # 预热 baked query 缓存
+    start = time.process_time()
+    for _ in range(times):
+        fn()
+    return (time.process_time() - start) / times
+
+
+def main(times=2000):
+    s = _create_session()
+    try:
+        for name, build_each_time, cached in _query_cases(s):
+            assert build_each_time() == cached()
+            build_cost = _cpu_per_call(build_each_time, times)
+            cached_cost = _cpu_per_call(cached, times)
+            print(f'{name:<20} query: {build_cost * 1e6:8.1f} us  cached: {cached_cost * 1e6:8.1f} us  '
+                  f'saved: {(build_cost - cached_cost) * 1e6:8.1f} us')
+    finally:
+        s.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,86 @@
+"""对比 ORM 对象与字段投影两种方式加载快照存储树
+
+运行方式（在 disk_snapshot_service 目录下）：
+    python -m tests.benchmark_tree_loader [行数] [分支长度]
+
+使用内存 sqlite 数据库，仅比较 ORM 与驱动之外的开销
+"""
+
+import sys
+import time
+
+import sqlalchemy
+from sqlalchemy import orm
+
+from business_logic.storage_tree import tree
+from data_access import models as m
+from data_access.db_operation import storage
+
+TREE_IDENT = 'benchmark_tree'
+
+
+def _create_session(row_count, branch_length):
+    """生成 row_count 个快照存储，每 branch_length 个节点从根开出一个新分支"""
+
+    engine = sqlalchemy.create_engine('sqlite://')
+    m.Base.metadata.create_all(engine)
+    s = orm.sessionmaker(bind=engine)()
+
+    rows = list()
+    for i in range(row_count):
+        if i == 0:
+            parent_ident = None
+        elif i % branch_length == 1:
+            parent_ident = 's0'
+        else:
+            parent_ident = f's{i - 1}'
+        rows.append({
+            'ident': f's{i}',
+            'parent_ident': parent_ident,
+            'parent_timestamp': None,
+            'type': m.SnapshotStorage.TYPE_QCOW,
+            'disk_bytes': 1024 ** 3,
+            'status': m.SnapshotStorage.STATUS_STORAGE,
+            'image_path': f'/images/{i // branch_length}.qcow',
+            'tree_ident': TREE_IDENT,
+        })
+    s.execute(m.SnapshotStorage.__table__.insert(), rows)
+    s.commit()
+    return s
+
+
+def _orm_obj_dicts(s):
+    return [obj.obj_to_dict() for obj in storage.SnapshotStorageTreeQuery(TREE_IDENT, s).query_valid_objs()]
+
+
+def _projection_obj_dicts(s):
+    return storage.SnapshotStorageTreeQuery(TREE_IDENT, s).valid_obj_dicts()
+
+
+def _timeit(name, fn, s, times):
+    best = None
+    for _ in range(times):
+        s.expunge_all()
+        start = time.perf_counter()
+        result = fn(s)
+        cost = time.perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    print(f'{name:<12} rows: {len(result):<8} best: {best * 1000:.1f} ms')
+    return result
+
+
+def main(row_count=50000, branch_length=100, times=5):
+    s = _create_session(row_count, branch_length)
+    try:
+        _timeit('orm', _orm_obj_dicts, s, times)
+        storage_objs = _timeit('projection', _projection_obj_dicts, s, times)
+
+        start = time.perf_counter()
+        tree.DiskSnapshotStorageTree().init_root(storage_objs)
+        print(f'{"init_root":<12} nodes: {len(storage_objs):<7} cost: {(time.perf_counter() - start) * 1000:.1f} ms')
+    finally:
+        s.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,62 @@
+import json
+import uuid
+
+import pytest
+
+from basic_library import xfunctions as xf
+from data_access import models as m
+from data_access.db_operation import session
+from disk_snapshot_service import disk_snapshot_service as dss
+
+
+class _FailAfterAdd(Exception):
+    pass
+
+
+@pytest.fixture
+def normal_create_journal():
+    token = uuid.uuid4().hex
+    new_ident = uuid.uuid4().hex
+    tree_ident = uuid.uuid4().hex
+    with session.SessionForReadWrite() as s:
+        s.add(m.Journal(
+            produced_timestamp=xf.current_timestamp(),
+            token=token,
+            tree_ident=tree_ident,
+            operation_type=m.Journal.TYPE_NORMAL_CREATE,
+            operation_str=json.dumps({
+                'operation_type': m.Journal.TYPE_NORMAL_CREATE,
+                'parent_ident': None,
+                'parent_timestamp': None,
+                'new_ident': new_ident,
+                'new_type': m.SnapshotStorage.TYPE_QCOW,
+                'new_storage_folder': '/tmp',
+                'new_disk_bytes': 1024 ** 3,
+                'new_hash_type': None,
+            }),
+        ))
+    yield token, new_ident
+
+    with session.SessionForReadWrite() as s:
+        s.query(m.SnapshotStorage).filter(m.SnapshotStorage.ident == new_ident).delete(synchronize_session=False)
+        s.query(m.Journal).filter(m.Journal.token == token).delete(synchronize_session=False)
+
+
+def test_failure_after_add_rolls_back_unit_of_work(normal_create_journal, monkeypatch):
+    token, new_ident = normal_create_journal
+    added = list()
+
+    def _update_parent_journal(self):
+        added.append(self._new_ident)
+        raise _FailAfterAdd()
+
+    monkeypatch.setattr(dss.CreateDiskSnapshotStorage, '_image_path', property(lambda self: '/tmp/new.qcow'))
+    monkeypatch.setattr(dss.CreateDiskSnapshotStorage, 'update_parent_journal', _update_parent_journal)
+
+    with pytest.raises(_FailAfterAdd):
+        dss.CreateDiskSnapshotStorage('h1', token, 'test', 1).execute()
+
+    assert added == [new_ident, ]
+    with session.SessionForRead() as s:
+        assert s.query(m.Journal).filter(m.Journal.token == token).one().consumed_timestamp is None
+        assert s.query(m.SnapshotStorage).filter(m.SnapshotStorage.ident == new_ident).first() is None
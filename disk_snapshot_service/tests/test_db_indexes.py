@@ -0,0 +1,54 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from data_access import models as m
+from data_access.db_operation import session
+
+
+def _explain(s, query) -> str:
+    """禁用顺序扫描后获取执行计划；没有可用索引时，执行计划中仍然是 Seq Scan"""
+
+    statement = query.statement.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+    s.execute(text('SET LOCAL enable_seqscan = off'))
+    return '\n'.join(row[0] for row in s.execute(text(f'EXPLAIN {statement}')))
+
+
+@pytest.fixture
+def s():
+    s = session.session_maker()
+    try:
+        yield s
+    finally:
+        s.rollback()
+        s.close()
+
+
+def _hot_queries(s):
+    yield 'valid storages by tree', (
+        s.query(m.SnapshotStorage)
+        .filter(m.SnapshotStorage.tree_ident == 'ti1')
+        .filter(m.SnapshotStorage.status.notin_(m.SnapshotStorage.INVALID_STORAGE_STATUS)))
+    yield 'storages by parent', s.query(m.SnapshotStorage).filter(m.SnapshotStorage.parent_ident == 'p1')
+    yield 'storage by ident', s.query(m.SnapshotStorage).filter(m.SnapshotStorage.ident == 's1')
+    yield 'journal by token', s.query(m.Journal).filter(m.Journal.token == 't1')
+    yield 'unconsumed journals by tree', (
+        s.query(m.Journal)
+        .filter(m.Journal.consumed_timestamp.is_(None))
+        .filter(m.Journal.tree_ident == 'ti1')
+        .filter(m.Journal.operation_type.in_(m.Journal.JOURNAL_CREATE_TYPES))
+        .order_by(m.Journal.id))
+
+
+def test_hot_queries_use_index(s):
+    for name, query in _hot_queries(s):
+        plan = _explain(s, query)
+        assert 'Seq Scan' not in plan, f'{name} :\n{plan}'
+
+
+def test_unconsumed_journals_use_partial_index(s):
+    query = (s.query(m.Journal)
+             .filter(m.Journal.consumed_timestamp.is_(None))
+             .filter(m.Journal.tree_ident == 'ti1')
+             .order_by(m.Journal.id))
+    assert 'ix_journal_unconsumed_tree_ident_id' in _explain(s, query)
@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import text
+
+from basic_library import xdata
+from data_access.db_operation import session
+
+
+@pytest.fixture
+def small_pool(tmp_path):
+    connect_str = session.db_connect_str
+    yield session.configure_engine(
+        f'sqlite:///{tmp_path / "pool.db"}', pool_size=1, max_overflow=0, pool_timeout=0.1, pool_pre_ping=False)
+    session.configure_engine(connect_str)
+
+
+class PoolUser(object):
+
+    def hold(self, s):
+        with session.session_for_read(s) as s:
+            s.execute(text('SELECT 1'))
+
+
+def test_saturated_pool_raises_busy(small_pool):
+    with session.SessionForRead() as s:
+        PoolUser().hold(s)
+        with pytest.raises(xdata.DatabaseBusy):
+            PoolUser().hold(None)
+
+    statistics = session.get_pool_statistics()
+    assert statistics['busy_errors'] == 1
+    assert statistics['in_use'] == 0
+    assert statistics['max_in_use'] == 1
+    assert statistics['checkout_wait']['max_seconds'] >= 0.1
+
+
+def test_usage_by_caller(small_pool):
+    PoolUser().hold(None)
+    PoolUser().hold(None)
+
+    callers = session.get_pool_statistics()['callers']
+    assert callers['PoolUser']['checkouts'] == 2
+    assert callers['PoolUser']['hold']['count'] == 2
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import text
+
+from data_access.db_operation import session
+
+
+@pytest.fixture
+def replica_state(tmp_path):
+    connect_str = session.db_connect_str
+    session.configure_engine(f'sqlite:///{tmp_path / "primary.db"}', pool_pre_ping=False)
+    state = {'is_fresh': True}
+    yield session.configure_replica(
+        f'sqlite:///{tmp_path / "replica.db"}', check_interval=0, freshness_check=lambda: state['is_fresh'],
+        pool_pre_ping=False), state
+    session.configure_replica(None)
+    session.configure_engine(connect_str)
+
+
+def _database_file(allow_stale):
+    with session.session_for_read(allow_stale=allow_stale) as s:
+        return s.execute(text('PRAGMA database_list')).fetchone()[2]
+
+
+def test_stale_read_uses_fresh_replica(replica_state):
+    router, _ = replica_state
+    assert _database_file(True).endswith('replica.db')
+    assert router.to_dict()['replica_reads'] == 1
+
+
+def test_default_read_uses_primary(replica_state):
+    assert _database_file(False).endswith('primary.db')
+
+
+def test_stale_replica_falls_back_to_primary(replica_state):
+    router, state = replica_state
+    state['is_fresh'] = False
+    assert _database_file(True).endswith('primary.db')
+    assert router.to_dict()['primary_reads'] == 1
+
+
+def test_failed_freshness_check_falls_back_to_primary(replica_state):
+    router, _ = replica_state
+    router.freshness_check = lambda: 1 / 0
+    assert _database_file(True).endswith('primary.db')
@@ -1,3 +1,9 @@
+import uuid
+
+from django.db import transaction
+from django.db.models import Q
+
+from basic_library import xfunctions
 from basic_library import xlogging
 from storage_manager import models as m
 from storage_manager import storage_action as action
@@ -8,6 +14,28 @@ from task_manager import task_item_abc
 
 _logger = xlogging.getLogger(__name__)
 
+HASHING_CLAIM_SECONDS = 30 * 60
+"""领取hash处理的有效时长，领取者异常退出未释放时，到期后可被重新领取"""
+
+HASHING_CLAIM_RENEW_SECONDS = 5 * 60
+"""处理期间续期领取的间隔，参考 FetchHashingStorage.renew_claim"""
+
+_PROCESS_CLAIM_IDENT = uuid.uuid4().hex
+"""本进程的领取者标识，用于区分不同进程中相同 task_ident 的领取"""
+
+
+def _claim_expire():
+    return xfunctions.current_timestamp() + HASHING_CLAIM_SECONDS
+
+
+def _unclaimed_hashing_storage_objs():
+    """需要进行hash处理，且没有被领取（或者领取已到期）的storage"""
+    return (m.DiskSnapshotStorage.objects
+            .filter(storage_type=m.DiskSnapshotStorage.QCOW,
+                    storage_status=m.DiskSnapshotStorage.HASHING)
+            .filter(Q(hashing_claim_expire__isnull=True)
+                    | Q(hashing_claim_expire__lt=xfunctions.current_timestamp())))
+
 
 class StorageStatusNotHashing(Exception):
     pass
@@ -23,6 +51,7 @@ class HashingTask(task_item_abc.TaskItem):
         self.storage_locker_manager = storage_locker_manager
         self.storage_reference_manager = storage_reference_manager
         self.chain = None
+        self.claim_owner = None
 
     @property
     def name(self):
@@ -37,6 +66,10 @@ class HashingTask(task_item_abc.TaskItem):
     def __eq__(self, other):
         return isinstance(other, HashingTask) and self.storage_ident == other.storage_ident
 
+    @property
+    def identity_key(self):
+        return self.storage_ident
+
     def warn(self, msg, exc_info=False):
         _logger.warning(f'{self} - failed : {msg}', exc_info=exc_info)
 
@@ -54,25 +87,81 @@ class HashingTask(task_item_abc.TaskItem):
         super(HashingTask, self).acquire()
         try:
             with self.storage_locker_manager.get_locker(self.storage_root_obj.root_ident, self.name):
-                storage_obj = m.DiskSnapshotStorage.objects.get(disk_snapshot_storage_ident=self.storage_ident)
-                self._check_storage(storage_obj)
-
                 storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(self.storage_root_obj)
-                assert not storage_tree.is_empty()
+                return self._acquire_chain(storage_tree)
+        except Exception:
+            self.release()
+            raise
 
-                self.chain = query.StorageChainQueryByDiskSnapshotStorage(
-                    chain.StorageChainForRead, storage_tree, self.storage_reference_manager,
-                    storage_obj, None, self.name).get_storage_chain()
+    def acquire_in_tree(self, storage_tree):
+        """使用已生成的快照存储树获取chain对象
 
-                return self.chain.acquire()
+        :remark:
+            需在锁空间内调用，且 storage_tree 在该锁空间内生成
+        """
+        super(HashingTask, self).acquire()
+        try:
+            return self._acquire_chain(storage_tree)
         except Exception:
             self.release()
             raise
 
+    def _acquire_chain(self, storage_tree):
+        assert not storage_tree.is_empty()
+        node = storage_tree.get_node_by_storage_ident(self.storage_ident)
+        if node is None:
+            xlogging.raise_and_logging_error(
+                '存储状态不为hashing', f'{self} not in storage tree, maybe recycled',
+                print_args=False, exception_class=StorageStatusNotHashing, logger_level='info')
+        storage_obj = node.storage_obj
+        self._check_storage(storage_obj)
+
+        self.chain = query.StorageChainQueryByDiskSnapshotStorage(
+            chain.StorageChainForRead, storage_tree, self.storage_reference_manager,
+            storage_obj, None, self.name).get_storage_chain()
+
+        return self.chain.acquire()
+
     def release(self):
-        if super(HashingTask).release() and self.chain:
+        if super(HashingTask, self).release() and self.chain:
             self.chain.release()
             self.chain = None
+        self._release_claim()
+
+    def take_claim(self, claim_owner) -> bool:
+        """在数据库中领取该storage
+
+        :return:
+            已被其他领取者领取且未到期，或者不再需要hash处理时返回 False
+        """
+        assert self.claim_owner is None
+        if not (_unclaimed_hashing_storage_objs()
+                .filter(disk_snapshot_storage_ident=self.storage_ident)
+                .update(hashing_claim_owner=claim_owner, hashing_claim_expire=_claim_expire())):
+            return False
+        self.claim_owner = claim_owner
+        return True
+
+    def renew_claim(self) -> bool:
+        """延长自身持有的领取
+
+        :return:
+            领取已被清除或者已被其他领取者接管时返回 False，调用者应停止处理
+        """
+        if self.claim_owner is None:
+            return False
+        return bool(m.DiskSnapshotStorage.objects
+                    .filter(disk_snapshot_storage_ident=self.storage_ident, hashing_claim_owner=self.claim_owner)
+                    .update(hashing_claim_expire=_claim_expire()))
+
+    def _release_claim(self):
+        """释放数据库中的领取记录，仅释放自身持有的领取"""
+        if self.claim_owner is None:
+            return
+        (m.DiskSnapshotStorage.objects
+         .filter(disk_snapshot_storage_ident=self.storage_ident, hashing_claim_owner=self.claim_owner)
+         .update(hashing_claim_owner=None, hashing_claim_expire=None))
+        self.claim_owner = None
 
 
 class FetchHashingStorage(object):
@@ -83,11 +172,15 @@ class FetchHashingStorage(object):
         self.storage_locker_manager = storage_locker_manager
         self.task_container = task_container
         self.task_ident = task_ident
+        self.claim_owner = f'{_PROCESS_CLAIM_IDENT}|{task_ident}'
 
     def fetch(self):
-        for storage_obj in m.DiskSnapshotStorage.objects.filter(
-                storage_type=m.DiskSnapshotStorage.QCOW,
-                storage_status=m.DiskSnapshotStorage.HASHING).all():
+        """获取一个需要进行hash处理的storage
+
+        :remark:
+            领取记录写入数据库，参考 claim
+        """
+        for storage_obj in _unclaimed_hashing_storage_objs().all():
 
             hashing_task = HashingTask(
                 storage_obj.disk_snapshot_storage_ident,
@@ -95,6 +188,9 @@ class FetchHashingStorage(object):
                 self.storage_locker_manager, self.storage_reference_manager)
             if not self.task_container.add_task(HashingTask.TASK_TYPE, self.task_ident, hashing_task):
                 continue
+            if not hashing_task.take_claim(self.claim_owner):
+                self.task_container.remove_task(HashingTask.TASK_TYPE, self.task_ident, True)
+                continue
 
             try:
                 _chain = hashing_task.acquire()
@@ -106,6 +202,103 @@ class FetchHashingStorage(object):
         else:
             return None
 
+    def claim(self, max_count: int) -> list:
+        """一次领取多个需要进行hash处理的storage
+
+        :remark:
+            使用 SELECT ... FOR UPDATE SKIP LOCKED 选取候选，并在同一事务中写入领取者与到期时刻，
+                并发领取时不会选到相同的记录；领取记录在任务释放时清除，到期前其他进程的领取会排除这些storage
+            处理期间需每隔 HASHING_CLAIM_RENEW_SECONDS 调用 renew_claim 续期
+            每个 root 仅生成一次快照存储树，数据库访问次数与领取数量无关
+            每个storage对应的任务标识为 f'{task_ident}|{storage_ident}'，处理完毕后需要逐一移除
+        :return:
+            [
+                {
+                    'task_ident': str,  任务标识
+                    ... 参考 _fetch_hashing_and_parent_which_in_same_file
+                },
+                ...
+            ]
+        """
+        hashing_tasks = self._claim_hashing_tasks(max_count)
+
+        root_tasks_dict = dict()
+        for task_ident, hashing_task in hashing_tasks:
+            root_tasks_dict.setdefault(hashing_task.storage_root_obj.id, list()).append((task_ident, hashing_task))
+
+        result = list()
+        for root_tasks in root_tasks_dict.values():
+            storage_root_obj = root_tasks[0][1].storage_root_obj
+            with self.storage_locker_manager.get_locker(storage_root_obj.root_ident, self.name):
+                storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(storage_root_obj)
+                chains = list()
+                for task_ident, hashing_task in root_tasks:
+                    try:
+                        chains.append((task_ident, hashing_task.acquire_in_tree(storage_tree)))
+                    except Exception as e:
+                        if not isinstance(e, StorageStatusNotHashing):
+                            hashing_task.warn(f'hashing_task.acquire_in_tree failed : {e}', True)
+                        self.task_container.remove_task(HashingTask.TASK_TYPE, task_ident, True)
+
+            for task_ident, _chain in chains:
+                try:
+                    info = self._fetch_hashing_and_parent_which_in_same_file(_chain)
+                except Exception as e:
+                    _logger.warning(f'{self.name} claim {task_ident} failed : {e}')
+                    self.task_container.remove_task(HashingTask.TASK_TYPE, task_ident, True)
+                    continue
+                info['task_ident'] = task_ident
+                result.append(info)
+
+        return result
+
+    @property
+    def name(self):
+        return f'fetch hashing storage {self.task_ident}'
+
+    def renew_claim(self, task_ident) -> bool:
+        """延长领取的有效时长，处理期间需每隔 HASHING_CLAIM_RENEW_SECONDS 调用
+
+        :param task_ident:
+            fetch 时为 self.task_ident ； claim 时参考 claim 的返回值
+        :return:
+            任务不存在或者领取已失效时返回 False，调用者应停止处理
+        """
+        hashing_task = self.task_container.get_task(HashingTask.TASK_TYPE, task_ident)
+        if hashing_task is None:
+            return False
+        return hashing_task.renew_claim()
+
+    def _claim_hashing_tasks(self, max_count) -> list:
+        claimed_storage_idents = [
+            hashing_task.storage_ident for hashing_task in self.task_container.get_task_items(HashingTask.TASK_TYPE)]
+
+        with transaction.atomic():
+            storage_objs = list(_unclaimed_hashing_storage_objs()
+                                .select_for_update(skip_locked=True)
+                                .exclude(disk_snapshot_storage_ident__in=claimed_storage_idents)
+                                .order_by('id')[:max_count])
+            (m.DiskSnapshotStorage.objects
+             .filter(id__in=[storage_obj.id for storage_obj in storage_objs])
+             .update(hashing_claim_owner=self.claim_owner, hashing_claim_expire=_claim_expire()))
+            storage_root_objs = m.DiskSnapshotStorageRoot.objects.in_bulk(
+                {storage_obj.storage_root_id for storage_obj in storage_objs})
+
+        hashing_tasks = list()
+        for storage_obj in storage_objs:
+            hashing_task = HashingTask(
+                storage_obj.disk_snapshot_storage_ident,
+                storage_root_objs[storage_obj.storage_root_id],
+                self.storage_locker_manager, self.storage_reference_manager)
+            hashing_task.claim_owner = self.claim_owner
+            task_ident = f'{self.task_ident}|{storage_obj.disk_snapshot_storage_ident}'
+            if self.task_container.add_task(HashingTask.TASK_TYPE, task_ident, hashing_task):
+                hashing_tasks.append((task_ident, hashing_task))
+            else:
+                hashing_task.release()
+
+        return hashing_tasks
+
     @staticmethod
     def _fetch_hashing_and_parent_which_in_same_file(_chain) -> dict:
         """获取需要hashing的快照点，以及在同一个文件中前一个快照点
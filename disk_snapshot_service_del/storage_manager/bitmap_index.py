@@ -0,0 +1,161 @@
+import collections
+import heapq
+import os
+import re
+import threading
+
+from basic_library import xlogging
+
+_logger = xlogging.getLogger(__name__)
+
+BITMAP_BLOCK_BYTES = 64 * 1024
+"""位图中每一位描述的磁盘数据块大小"""
+
+BITMAP_CACHE_MAX_COUNT = 4096
+"""内存中缓存的快照点压缩位图数量"""
+
+_NOT_EMPTY_BYTE = re.compile(rb'\xff+|[^\x00\xff]')
+
+_bitmap_cache = collections.OrderedDict()
+_bitmap_cache_locker = threading.Lock()
+
+
+class RunLengthBitmap(object):
+    """游程编码的压缩位图
+
+    :remark:
+        位图由按位置排序、互不相邻的游程 (首位序号, 位数) 组成
+        并集、交集与计数均直接在游程上计算，无需展开为普通位图
+    """
+
+    def __init__(self, runs=None):
+        """
+        :param runs:
+            已排序、互不重叠且互不相邻的游程列表
+        """
+        self.runs = list() if runs is None else runs
+
+    def __eq__(self, other):
+        return isinstance(other, RunLengthBitmap) and self.runs == other.runs
+
+    def __str__(self):
+        return f'run_length_bitmap:<{len(self.runs)} runs, {self.popcount()} bits>'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def popcount(self) -> int:
+        return sum(length for _, length in self.runs)
+
+    @staticmethod
+    def _join(sorted_runs):
+        """合并已按首位排序的游程中重叠或相邻的部分"""
+        runs = list()
+        for start, length in sorted_runs:
+            if runs and start <= runs[-1][0] + runs[-1][1]:
+                last_start, last_length = runs[-1]
+                runs[-1] = (last_start, max(last_start + last_length, start + length) - last_start)
+            else:
+                runs.append((start, length))
+        return runs
+
+    @staticmethod
+    def union(bitmaps):
+        """多个位图的并集"""
+        return RunLengthBitmap(RunLengthBitmap._join(heapq.merge(*[bitmap.runs for bitmap in bitmaps])))
+
+    def intersection(self, other):
+        runs = list()
+        i, j = 0, 0
+        while i < len(self.runs) and j < len(other.runs):
+            a_start, a_length = self.runs[i]
+            b_start, b_length = other.runs[j]
+            a_end, b_end = a_start + a_length, b_start + b_length
+            start, end = max(a_start, b_start), min(a_end, b_end)
+            if start < end:
+                runs.append((start, end - start))
+            if a_end <= b_end:
+                i += 1
+            else:
+                j += 1
+        return RunLengthBitmap(runs)
+
+    @staticmethod
+    def from_plain_bitmap(data: bytes):
+        """从普通位图转换，位序为字节内低位在前"""
+        runs = list()
+        for match in _NOT_EMPTY_BYTE.finditer(data):
+            byte_index = match.start()
+            if data[byte_index] == 0xff:
+                runs.append((byte_index * 8, (match.end() - byte_index) * 8))
+                continue
+            value = data[byte_index]
+            for bit in range(8):
+                if value & (1 << bit):
+                    runs.append((byte_index * 8 + bit, 1))
+        return RunLengthBitmap(RunLengthBitmap._join(runs))
+
+    def to_plain_bitmap(self, bits) -> bytes:
+        data = bytearray((bits + 7) // 8)
+        for start, length in self.runs:
+            for bit in range(start, min(start + length, bits)):
+                data[bit >> 3] |= 1 << (bit & 7)
+        return bytes(data)
+
+
+def load_snapshot_bitmap(image_path, snapshot_name) -> RunLengthBitmap:
+    """获取快照点写入数据块的压缩位图
+
+    :remark:
+        从 binmap 转换，转换结果仅缓存在内存中，查询不写入任何文件
+        缓存以 binmap 的 inode 、修改时间与大小校验，binmap 被改写（例如合并）后重新转换
+    """
+    binmap_path = f'{image_path}_{snapshot_name}.binmap'
+    key = (image_path, snapshot_name,)
+    binmap_stat = os.stat(binmap_path)
+    stamp = (binmap_stat.st_ino, binmap_stat.st_mtime_ns, binmap_stat.st_size,)
+
+    with _bitmap_cache_locker:
+        entry = _bitmap_cache.get(key, None)
+        if entry is not None and entry[0] == stamp:
+            _bitmap_cache.move_to_end(key)
+            return entry[1]
+
+    with open(binmap_path, 'rb') as f:
+        bitmap = RunLengthBitmap.from_plain_bitmap(f.read())
+
+    with _bitmap_cache_locker:
+        _bitmap_cache[key] = (stamp, bitmap,)
+        _bitmap_cache.move_to_end(key)
+        while len(_bitmap_cache) > BITMAP_CACHE_MAX_COUNT:
+            _bitmap_cache.popitem(last=False)
+    return bitmap
+
+
+def _iter_chain_bitmaps(storage_info_list):
+    for storage_info in storage_info_list:
+        yield load_snapshot_bitmap(storage_info['image_path'], storage_info['disk_snapshot_storage_ident'])
+
+
+def chain_allocated_bytes(storage_info_list) -> int:
+    """快照存储链描述的磁盘中已分配的数据量
+
+    :param storage_info_list:
+        快照存储链中的快照存储信息，参考 StorageChain.storage_info_list；仅支持qcow类型的快照存储
+    """
+    return RunLengthBitmap.union(_iter_chain_bitmaps(storage_info_list)).popcount() * BITMAP_BLOCK_BYTES
+
+
+def written_bitmap_since(storage_info_list, since_storage_ident) -> RunLengthBitmap:
+    """快照存储链中，指定快照存储之后写入过的数据块
+
+    :param storage_info_list:
+        快照存储链中的快照存储信息，从根到末端排序
+    :param since_storage_ident:
+        起始快照存储标识，不包含该快照存储本身写入的数据块
+    """
+    for index, storage_info in enumerate(storage_info_list):
+        if storage_info['disk_snapshot_storage_ident'] == since_storage_ident:
+            return RunLengthBitmap.union(_iter_chain_bitmaps(storage_info_list[index + 1:]))
+    xlogging.raise_and_logging_error(
+        '内部异常，快照存储不在快照存储链中', f'{since_storage_ident} not in chain', print_args=False)
@@ -0,0 +1,78 @@
+import collections
+import threading
+
+from django.db import transaction
+
+from basic_library import xlogging
+from storage_manager import models as m
+
+_logger = xlogging.getLogger(__name__)
+
+_chain_layout_cache = None
+_chain_layout_cache_locker = threading.Lock()
+
+
+class ChainLayoutCache(object):
+    """快照存储链布局缓存
+
+    :remark:
+        key 为 (树标识, 树变更代数, 快照存储标识, 时刻)，value 为 StorageChainLayout
+        树变更代数存储在 root 的数据库对象中，参考 DiskSnapshotStorageRoot.storage_generation
+        快照存储的状态或依赖关系变更后，树变更代数增加，旧的缓存不再被命中，最终被淘汰
+        按最近最少使用淘汰，最多缓存 max_size 个布局
+    """
+
+    @staticmethod
+    def get_chain_layout_cache():
+        global _chain_layout_cache
+
+        if _chain_layout_cache is None:
+            with _chain_layout_cache_locker:
+                if _chain_layout_cache is None:
+                    _chain_layout_cache = ChainLayoutCache()
+        return _chain_layout_cache
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.layouts = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.locker = threading.Lock()
+
+    def get(self, tree_ident, storage_ident, timestamp):
+        """获取树当前变更代数下的布局
+
+        :return:
+            StorageChainLayout ；没有缓存时返回 None
+        """
+        generation = m.DiskSnapshotStorageRoot.get_storage_generation(tree_ident)
+        if generation is None:
+            return None
+        key = (tree_ident, generation, storage_ident, timestamp,)
+        with self.locker:
+            layout = self.layouts.get(key, None)
+            if layout is None:
+                self.misses += 1
+                return None
+            self.layouts.move_to_end(key)
+            self.hits += 1
+            return layout
+
+    def put(self, storage_tree, storage_ident, timestamp, layout):
+        """缓存由 storage_tree 计算的布局
+
+        :param storage_tree: DiskSnapshotStorageTree
+            树标识或者变更代数为 None 时不缓存
+        :remark:
+            在事务中时不缓存，因为事务回滚后变更代数也回滚，同一代数可能再次对应不同的数据
+        """
+        if storage_tree.tree_ident is None or storage_tree.generation is None:
+            return
+        if transaction.get_connection().in_atomic_block:
+            return
+        key = (storage_tree.tree_ident, storage_tree.generation, storage_ident, timestamp,)
+        with self.locker:
+            self.layouts[key] = layout
+            self.layouts.move_to_end(key)
+            while len(self.layouts) > self.max_size:
+                self.layouts.popitem(last=False)
@@ -0,0 +1,172 @@
+import contextlib
+import mmap
+import os
+
+from basic_library import xdata
+from basic_library import xlogging
+
+_logger = xlogging.getLogger(__name__)
+
+HASH_BLOCK_BYTES = 64 * 1024
+"""每条hash记录描述的磁盘数据块大小"""
+
+HASH_RECORD_BYTES = 16 + 4
+"""每条hash记录的大小：MD4（16字节） + CRC32（4字节），全零意为该数据块没有写入"""
+
+HASH_FILE_FORMAT_VERIFIED = False
+"""本模块的hash文件布局是否已与逻辑服务生成的hash文件逐字节核对一致
+
+:remark:
+    核对前，使用本模块读写实际快照存储hash文件的功能均不可用，参考 check_format_verified
+"""
+
+_CHUNK_RECORDS = 64 * 1024
+"""每次处理的记录条数"""
+
+_SUB_CHUNK_BYTES = HASH_RECORD_BYTES * 256
+"""写入区域通常连续分布，分段后大部分子段可整体跳过或整体计入"""
+
+_EMPTY_RECORD = bytes(HASH_RECORD_BYTES)
+_EMPTY_CHUNK = bytes(HASH_RECORD_BYTES * _CHUNK_RECORDS)
+
+
+def check_format_verified(debug, exception_class=xdata.DSSException):
+    """hash文件布局未经核对时抛出异常"""
+    if not HASH_FILE_FORMAT_VERIFIED:
+        xlogging.raise_and_logging_error(
+            'hash文件格式未经核对，不支持该操作', f'{debug} : hash file format not verified',
+            print_args=False, exception_class=exception_class)
+
+
+def hash_file_bytes(disk_bytes) -> int:
+    """虚拟磁盘对应的hash文件大小"""
+    return (disk_bytes + HASH_BLOCK_BYTES - 1) // HASH_BLOCK_BYTES * HASH_RECORD_BYTES
+
+
+class _HashFileReader(object):
+    """只读映射hash文件，超出文件长度的部分视为没有写入"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.mmap = None
+        self.size = 0
+
+    def __enter__(self):
+        self.file = open(self.path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.mmap:
+            self.mmap.close()
+        self.file.close()
+
+    def read(self, offset, length) -> bytes:
+        if offset >= self.size:
+            return _EMPTY_CHUNK[:length]
+        data = self.mmap[offset:offset + length]
+        if len(data) < length:
+            data += bytes(length - len(data))
+        return data
+
+
+def _iter_mask_runs(mask, first_record):
+    """将子段的变更标记转换为连续区间 (首条记录序号, 记录条数)"""
+    index = mask.find(1)
+    while index != -1:
+        end = mask.find(0, index)
+        if end == -1:
+            end = len(mask)
+        yield first_record + index, end - index
+        index = mask.find(1, end)
+
+
+def _iter_joined_runs(runs):
+    """合并相邻的区间"""
+    current_first, current_count = None, 0
+    for first, count in runs:
+        if current_first is not None and current_first + current_count == first:
+            current_count += count
+            continue
+        if current_first is not None:
+            yield current_first, current_count
+        current_first, current_count = first, count
+    if current_first is not None:
+        yield current_first, current_count
+
+
+def _iter_sub_chunks(readers, total_bytes):
+    """按子段读取多个hash文件，返回 (首条记录序号, [各文件子段数据])"""
+    chunk_bytes = HASH_RECORD_BYTES * _CHUNK_RECORDS
+    for offset in range(0, total_bytes, chunk_bytes):
+        length = min(chunk_bytes, total_bytes - offset)
+        chunks = [reader.read(offset, length) for reader in readers]
+        for sub_offset in range(0, length, _SUB_CHUNK_BYTES):
+            yield ((offset + sub_offset) // HASH_RECORD_BYTES,
+                   [chunk[sub_offset:sub_offset + _SUB_CHUNK_BYTES] for chunk in chunks])
+
+
+def _iter_record_runs_of_full_hash_diff(path_a, path_b, total_bytes):
+    with _HashFileReader(path_a) as reader_a, _HashFileReader(path_b) as reader_b:
+        for first_record, (data_a, data_b) in _iter_sub_chunks([reader_a, reader_b], total_bytes):
+            if data_a == data_b:
+                continue
+            records = len(data_a) // HASH_RECORD_BYTES
+            mask = bytearray(records)
+            for index in range(records):
+                begin = index * HASH_RECORD_BYTES
+                if data_a[begin:begin + HASH_RECORD_BYTES] != data_b[begin:begin + HASH_RECORD_BYTES]:
+                    mask[index] = 1
+            yield from _iter_mask_runs(mask, first_record)
+
+
+def _iter_record_runs_of_written(paths, total_bytes):
+    if not paths:
+        return  # 没有增量hash，意为没有写入
+    with contextlib.ExitStack() as stack:
+        readers = [stack.enter_context(_HashFileReader(path)) for path in paths]
+        empty_sub_chunk = _EMPTY_CHUNK[:_SUB_CHUNK_BYTES]
+        for first_record, datas in _iter_sub_chunks(readers, total_bytes):
+            records = len(datas[0]) // HASH_RECORD_BYTES
+            mask = bytearray(records)
+            for data in datas:
+                if data == empty_sub_chunk[:len(data)]:
+                    continue
+                if _EMPTY_RECORD not in data:
+                    mask = bytearray(b'\x01') * records
+                    break
+                for index in range(records):
+                    begin = index * HASH_RECORD_BYTES
+                    if data[begin:begin + HASH_RECORD_BYTES] != _EMPTY_RECORD:
+                        mask[index] = 1
+            yield from _iter_mask_runs(mask, first_record)
+
+
+def _records_to_byte_ranges(record_runs, disk_bytes):
+    for first, count in _iter_joined_runs(record_runs):
+        offset = first * HASH_BLOCK_BYTES
+        yield offset, min(count * HASH_BLOCK_BYTES, disk_bytes - offset)
+
+
+def iter_changed_ranges_by_full_hash(full_hash_path_a, full_hash_path_b, disk_bytes):
+    """比较两个全量hash文件，按顺序流式返回内容不同的磁盘区间
+
+    :return:
+        生成器，元素为 (字节偏移, 字节长度)，相邻区间已合并
+    """
+    return _records_to_byte_ranges(
+        _iter_record_runs_of_full_hash_diff(full_hash_path_a, full_hash_path_b, hash_file_bytes(disk_bytes)),
+        disk_bytes)
+
+
+def iter_written_ranges(hash_paths, disk_bytes):
+    """合并（或运算）多个增量hash文件，按顺序流式返回写入过的磁盘区间
+
+    :return:
+        生成器，元素为 (字节偏移, 字节长度)，相邻区间已合并
+    """
+    return _records_to_byte_ranges(
+        _iter_record_runs_of_written(hash_paths, hash_file_bytes(disk_bytes)), disk_bytes)
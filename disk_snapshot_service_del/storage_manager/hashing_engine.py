@@ -0,0 +1,256 @@
+import abc
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import struct
+import time
+import zlib
+
+from basic_library import xdata
+from basic_library import xlogging
+from storage_manager import hash_file
+
+_logger = xlogging.getLogger(__name__)
+
+_BATCH_BYTES = 64 * 1024 * 1024
+"""每次顺序读取的数据量"""
+
+
+def _md4_pure_python(data: bytes) -> bytes:
+    """MD4（RFC 1320），OpenSSL 3 默认不再提供 MD4 时使用"""
+
+    def _rotate_left(x, n):
+        x &= 0xffffffff
+        return ((x << n) | (x >> (32 - n))) & 0xffffffff
+
+    message = data + b'\x80' + bytes((55 - len(data)) % 64) + struct.pack('<Q', (len(data) * 8) & 0xffffffffffffffff)
+    h = [0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476]
+
+    for offset in range(0, len(message), 64):
+        x = struct.unpack('<16I', message[offset:offset + 64])
+        a, b, c, d = h
+
+        for i in range(16):
+            k, s = i, (3, 7, 11, 19)[i % 4]
+            a, b, c, d = d, _rotate_left(a + ((b & c) | (~b & d)) + x[k], s), b, c
+        for i in range(16):
+            k, s = (i % 4) * 4 + i // 4, (3, 5, 9, 13)[i % 4]
+            a, b, c, d = d, _rotate_left(a + ((b & c) | (b & d) | (c & d)) + x[k] + 0x5a827999, s), b, c
+        for i in range(16):
+            k, s = (0, 8, 4, 12, 2, 10, 6, 14, 1, 9, 5, 13, 3, 11, 7, 15)[i], (3, 9, 11, 15)[i % 4]
+            a, b, c, d = d, _rotate_left(a + (b ^ c ^ d) + x[k] + 0x6ed9eba1, s), b, c
+
+        h = [(v + n) & 0xffffffff for v, n in zip(h, (a, b, c, d))]
+
+    return struct.pack('<4I', *h)
+
+
+def _md4_hashlib(data: bytes) -> bytes:
+    return hashlib.new('md4', data).digest()
+
+
+def _select_md4():
+    try:
+        hashlib.new('md4', b'')
+        return _md4_hashlib
+    except ValueError:
+        _logger.warning('hashlib md4 unavailable (OpenSSL 3 without the legacy provider), '
+                        'fall back to pure python md4 which is too slow for real disks')
+        return _md4_pure_python
+
+
+md4 = _select_md4()
+
+
+def block_hash_record(block: bytes) -> bytes:
+    """计算数据块的 MD4+CRC32 记录，参考 hash_file.HASH_RECORD_BYTES"""
+    return md4(block) + struct.pack('<I', zlib.crc32(block))
+
+
+def _hash_blocks(blocks) -> list:
+    return [block_hash_record(block) for block in blocks]
+
+
+class HashingClaimLost(Exception):
+    pass
+
+
+class ImageReader(abc.ABC):
+    """快照存储链的镜像读取器"""
+
+    def __init__(self, disk_bytes):
+        self.disk_bytes = disk_bytes
+
+    @abc.abstractmethod
+    def read(self, offset, length) -> bytes:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def iter_ranges(self, full: bool):
+        """需要计算hash的磁盘区间
+
+        :param full:
+            为 True 时，返回快照存储链中有数据的区间；否则返回末端快照存储写入的区间
+        :return:
+            生成器，元素为 (字节偏移, 字节长度)，按偏移排序
+        """
+        raise NotImplementedError()
+
+
+class RawImageReader(ImageReader):
+    """读取 raw 格式镜像文件
+
+    :remark:
+        作为本地替代实现，用于测试与离线计算
+    """
+
+    def __init__(self, path, disk_bytes=None, written_bitmap=None):
+        """
+        :param path:
+            raw 镜像文件路径
+        :param written_bitmap: bitmap_index.RunLengthBitmap
+            末端快照存储写入的数据块，为 None 时视为写入了全部数据块
+        """
+        super(RawImageReader, self).__init__(os.path.getsize(path) if disk_bytes is None else disk_bytes)
+        self.path = path
+        self.written_bitmap = written_bitmap
+
+    def read(self, offset, length) -> bytes:
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return data + bytes(length - len(data))
+
+    def iter_ranges(self, full: bool):
+        if full or self.written_bitmap is None:
+            yield 0, self.disk_bytes
+            return
+        for start, count in self.written_bitmap.runs:
+            offset = start * hash_file.HASH_BLOCK_BYTES
+            if offset >= self.disk_bytes:
+                break
+            yield offset, min(count * hash_file.HASH_BLOCK_BYTES, self.disk_bytes - offset)
+
+
+class HashingWorker(object):
+    """计算快照存储的hash文件
+
+    remark：
+        按批次顺序读取镜像数据，使用进程池计算每个数据块的 MD4+CRC32
+        hash文件布局参考 hash_file，先写入临时文件，完成后原子替换
+    """
+
+    def __init__(self, max_workers=None, batch_bytes=_BATCH_BYTES, allow_slow_md4=False):
+        """
+        :param max_workers:
+            进程池大小，为 0 时在当前进程中计算
+        :param batch_bytes:
+            每次顺序读取的数据量，对齐到数据块大小
+        :param allow_slow_md4:
+            hashlib 不支持 md4 时，是否允许使用纯 python 实现；不允许时抛出异常
+        """
+        if md4 is _md4_pure_python and not allow_slow_md4:
+            xlogging.raise_and_logging_error(
+                'hash计算不可用', 'hashlib md4 unavailable, enable the OpenSSL legacy provider',
+                print_args=False, exception_class=xdata.DSSException)
+        self.max_workers = max_workers
+        self.batch_bytes = max(batch_bytes // hash_file.HASH_BLOCK_BYTES, 1) * hash_file.HASH_BLOCK_BYTES
+
+    def _iter_batches(self, reader, full):
+        """将需要计算的区间按数据块对齐并切分为批次，返回 (字节偏移, 数据块列表)"""
+        block_bytes = hash_file.HASH_BLOCK_BYTES
+        for offset, length in reader.iter_ranges(full):
+            begin = offset // block_bytes * block_bytes
+            end = min((offset + length + block_bytes - 1) // block_bytes * block_bytes, reader.disk_bytes)
+            for batch_offset in range(begin, end, self.batch_bytes):
+                data = reader.read(batch_offset, min(self.batch_bytes, end - batch_offset))
+                yield batch_offset, [data[i:i + block_bytes] for i in range(0, len(data), block_bytes)]
+
+    def hash_image(self, reader, hash_path, full: bool, renew_claim=None, renew_seconds=60):
+        """计算镜像的hash文件
+
+        :param reader: ImageReader
+        :param hash_path:
+            hash文件路径
+        :param full:
+            为 True 时生成全量hash（.full_hash），否则生成增量hash（.hash）
+        :param renew_claim:
+            续期hash处理领取的函数，参考 FetchHashingStorage.renew_claim ；返回 False 时中止处理
+        :param renew_seconds:
+            调用 renew_claim 的间隔
+        :raises:
+            HashingClaimLost 领取已失效，hash文件不会被替换
+        """
+        last_renew = time.monotonic()
+        tmp_path = f'{hash_path}.hashing'
+        try:
+            with contextlib.ExitStack() as stack:
+                f = stack.enter_context(open(tmp_path, 'wb'))
+                f.truncate(hash_file.hash_file_bytes(reader.disk_bytes))
+
+                if self.max_workers == 0:
+                    results = (
+                        (offset, _hash_blocks(blocks)) for offset, blocks in self._iter_batches(reader, full))
+                else:
+                    executor = stack.enter_context(
+                        concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers))
+                    results = self._hash_in_pool(executor, reader, full)
+
+                for offset, records in results:
+                    if renew_claim is not None and time.monotonic() - last_renew >= renew_seconds:
+                        if not renew_claim():
+                            raise HashingClaimLost(f'claim lost while hashing {hash_path}')
+                        last_renew = time.monotonic()
+                    f.seek(offset // hash_file.HASH_BLOCK_BYTES * hash_file.HASH_RECORD_BYTES)
+                    f.write(b''.join(records))
+
+                f.flush()
+                os.fsync(f.fileno())
+
+            if renew_claim is not None and not renew_claim():  # 替换前确认仍持有领取
+                raise HashingClaimLost(f'claim lost while hashing {hash_path}')
+        except Exception:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+        os.replace(tmp_path, hash_path)
+        _logger.info(f'hash image to {hash_path} , full {full} disk_bytes {reader.disk_bytes}')
+
+    def _hash_in_pool(self, executor, reader, full):
+        """读取下一批数据的同时，计算已读取的批次，最多保持 2 倍进程数的批次在计算中"""
+        pending = list()
+        max_pending = 2 * (self.max_workers or os.cpu_count() or 1)
+        for offset, blocks in self._iter_batches(reader, full):
+            pending.append((offset, executor.submit(_hash_blocks, blocks)))
+            if len(pending) >= max_pending:
+                offset, future = pending.pop(0)
+                yield offset, future.result()
+        for offset, future in pending:
+            yield offset, future.result()
+
+    def hash_storage(self, hashing_info: dict, reader, full: bool = False, renew_claim=None, renew_seconds=60):
+        """计算 FetchHashingStorage.fetch 返回的待处理快照存储的hash文件
+
+        :param hashing_info:
+            参考 FetchHashingStorage._fetch_hashing_and_parent_which_in_same_file
+        :param reader: ImageReader
+            读取 hashing_info['read_storages'] 的镜像读取器
+        :param full:
+            参考 hash_image
+        :param renew_claim:
+            参考 hash_image
+        :param renew_seconds:
+            参考 hash_image
+        :return:
+            hash文件路径，命名规则与快照存储的 inc_hash_path 、 full_hash_path 一致
+        :remark:
+            生成的文件将替代逻辑服务生成的hash文件，hash文件布局核对前不可用，参考 hash_file.HASH_FILE_FORMAT_VERIFIED
+        """
+        assert reader.disk_bytes == hashing_info['disk_bytes']
+        storage = hashing_info['storages'][-1]
+        hash_file.check_format_verified(f'hash storage {storage["storage_ident"]}')
+        hash_path = f"{storage['image_path']}_{storage['storage_ident']}.{'full_hash' if full else 'hash'}"
+        self.hash_image(reader, hash_path, full, renew_claim, renew_seconds)
+        return hash_path
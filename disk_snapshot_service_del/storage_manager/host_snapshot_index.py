@@ -0,0 +1,70 @@
+import bisect
+
+
+class HostSnapshotIntervalIndex(object):
+    """主机快照时间范围索引
+
+    :remark:
+        仅索引有效的主机快照，主机快照失效时调用 remove 增量更新
+        开始时刻与结束时刻分别存放为有序数组。对于 begin <= end 的区间，与 [b, e] 不重叠的区间要么 begin > e，
+        要么 end < b，且两者互斥；所以重叠数量 = count(begin <= e) - count(end < b)，两次二分查找即可得出
+    """
+
+    def __init__(self, items=None):
+        """
+        :param items:
+            [(host_snapshot_id, begin_timestamp, end_timestamp, is_cdp), ...]
+        """
+        self._items = dict()  # key 为主机快照 id，value 为 (begin_timestamp, end_timestamp, is_cdp)
+        self._cdp_count = 0
+        for host_snapshot_id, begin_timestamp, end_timestamp, is_cdp in (items if items else list()):
+            self._add_item(host_snapshot_id, begin_timestamp, end_timestamp, is_cdp)
+        self._begin_timestamps = sorted(item[0] for item in self._items.values())
+        self._end_timestamps = sorted(item[1] for item in self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, host_snapshot_id):
+        return host_snapshot_id in self._items
+
+    def _add_item(self, host_snapshot_id, begin_timestamp, end_timestamp, is_cdp) -> bool:
+        assert begin_timestamp <= end_timestamp
+        if host_snapshot_id in self._items:
+            return False
+        self._items[host_snapshot_id] = (begin_timestamp, end_timestamp, is_cdp)
+        if is_cdp:
+            self._cdp_count += 1
+        return True
+
+    def add(self, host_snapshot_id, begin_timestamp, end_timestamp, is_cdp=False):
+        if self._add_item(host_snapshot_id, begin_timestamp, end_timestamp, is_cdp):
+            bisect.insort(self._begin_timestamps, begin_timestamp)
+            bisect.insort(self._end_timestamps, end_timestamp)
+
+    def remove(self, host_snapshot_id) -> bool:
+        item = self._items.pop(host_snapshot_id, None)
+        if item is None:
+            return False
+        begin_timestamp, end_timestamp, is_cdp = item
+        self._remove_one(self._begin_timestamps, begin_timestamp)
+        self._remove_one(self._end_timestamps, end_timestamp)
+        if is_cdp:
+            self._cdp_count -= 1
+        return True
+
+    @staticmethod
+    def _remove_one(array, value):
+        i = bisect.bisect_left(array, value)
+        assert i < len(array) and array[i] == value
+        del array[i]
+
+    def is_any_overlap(self, begin_timestamp, end_timestamp) -> bool:
+        """是否有主机快照与 [begin_timestamp, end_timestamp] 有重叠"""
+        assert begin_timestamp <= end_timestamp
+        return (bisect.bisect_right(self._begin_timestamps, end_timestamp)
+                > bisect.bisect_left(self._end_timestamps, begin_timestamp))
+
+    @property
+    def has_cdp(self) -> bool:
+        return self._cdp_count > 0
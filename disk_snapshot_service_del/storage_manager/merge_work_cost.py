@@ -0,0 +1,119 @@
+from basic_library import xlogging
+
+_logger = xlogging.getLogger(__name__)
+
+
+class MergeWorkCost(object):
+    """合并作业的代价估算
+
+    :remark:
+        moving_bytes 为合并过程中需要搬迁（写入）的数据量
+        reclaimed_bytes 为合并完成后可释放的存储空间
+        估算在回收的锁空间内进行，仅使用数据库字段，不访问文件
+    """
+
+    def __init__(self, moving_bytes, reclaimed_bytes):
+        assert moving_bytes >= 0
+        assert reclaimed_bytes >= 0
+        self.moving_bytes = moving_bytes
+        self.reclaimed_bytes = reclaimed_bytes
+
+    def __str__(self):
+        return f'merge_work_cost:<moving:{self.moving_bytes} reclaimed:{self.reclaimed_bytes}>'
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def efficiency(self) -> float:
+        """每搬迁一个字节可释放的空间，不需要搬迁数据时为无穷大"""
+        if self.moving_bytes == 0:
+            return float('inf')
+        return self.reclaimed_bytes / self.moving_bytes
+
+
+def _get_storage_data_bytes(storage_obj) -> int:
+    """快照存储中的实体数据量，未统计时（inc_raw_data_bytes 为 -1）按虚拟磁盘大小估算"""
+    if storage_obj.inc_raw_data_bytes >= 0:
+        return storage_obj.inc_raw_data_bytes
+    return storage_obj.disk_bytes
+
+
+def estimate_merge_qcow_snapshot_type_a(merge_storage_obj) -> MergeWorkCost:
+    """qcow文件内合并快照：不搬迁数据，被子快照覆盖的数据可释放"""
+    return MergeWorkCost(0, max(merge_storage_obj.inc_raw_data_bytes, 0))
+
+
+def estimate_merge_qcow_snapshot_type_b(merge_storage_obj) -> MergeWorkCost:
+    """跨qcow文件合并快照：实体数据搬迁到父快照的文件中，源文件可释放"""
+    moving_bytes = _get_storage_data_bytes(merge_storage_obj)
+    return MergeWorkCost(moving_bytes, moving_bytes)
+
+
+def estimate_merge_cdp(parent_storage_obj, merge_cdp_snapshot_storage_objs) -> MergeWorkCost:
+    """合并CDP文件到新qcow：写入的数据量不超过虚拟磁盘大小，CDP文件可释放"""
+    cdp_bytes = sum(_get_storage_data_bytes(storage_obj) for storage_obj in merge_cdp_snapshot_storage_objs)
+    return MergeWorkCost(min(cdp_bytes, parent_storage_obj.disk_bytes), cdp_bytes)
+
+
+class MergeCandidate(object):
+    """可生成合并作业的候选项
+
+    :remark:
+        storage_ids 与 image_paths 为作业涉及（读取或改写）的快照存储与文件，用于判断作业之间是否冲突
+        create_work 仅在候选项被调度时调用，负责标记快照存储状态并生成作业
+    """
+
+    def __init__(self, name, cost, storage_ids, image_paths, create_work):
+        self.name = name
+        self.cost = cost
+        self.storage_ids = frozenset(storage_ids)
+        self.image_paths = frozenset(image_paths)
+        self.create_work = create_work
+
+    def __str__(self):
+        return f'merge_candidate:<{self.name} {self.cost}>'
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class MergeWorkScheduler(object):
+    """合并作业调度
+
+    按“可释放空间/搬迁数据量”从高到低选择互不冲突的候选项，累计搬迁数据量达到预算后停止
+    remark：
+        效率最高的候选项总是被选中，避免大数据量的合并永远无法执行
+        预算为 0 时，每轮仅选择一个候选项
+    """
+
+    def __init__(self, io_budget_bytes=0):
+        assert io_budget_bytes >= 0
+        self.io_budget_bytes = io_budget_bytes
+
+    def select(self, candidates) -> list:
+        # sorted 为稳定排序，效率相同时保持广度优先遍历的顺序
+        ordered = sorted(candidates, key=lambda c: (-c.cost.efficiency, -c.cost.reclaimed_bytes))
+
+        selected = list()
+        used_bytes = 0
+        used_storage_ids = set()
+        used_image_paths = set()
+
+        for candidate in ordered:
+            if selected:
+                if used_bytes >= self.io_budget_bytes:
+                    break  # 预算已经用完
+                if used_bytes + candidate.cost.moving_bytes > self.io_budget_bytes:
+                    continue  # 超出剩余预算，尝试数据量更小的候选项
+                if (not used_storage_ids.isdisjoint(candidate.storage_ids)
+                        or not used_image_paths.isdisjoint(candidate.image_paths)):
+                    continue  # 与已选择的作业冲突
+
+            selected.append(candidate)
+            used_bytes += candidate.cost.moving_bytes
+            used_storage_ids.update(candidate.storage_ids)
+            used_image_paths.update(candidate.image_paths)
+
+        _logger.debug(f'select {selected} from {len(ordered)} candidates, moving {used_bytes} bytes')
+        return selected
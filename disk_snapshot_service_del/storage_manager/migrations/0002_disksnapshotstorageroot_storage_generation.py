@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disksnapshotstorageroot',
+            name='storage_generation',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
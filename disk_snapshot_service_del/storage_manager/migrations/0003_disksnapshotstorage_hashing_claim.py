@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import basic_library.xfield
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage_manager', '0002_disksnapshotstorageroot_storage_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='disksnapshotstorage',
+            name='hashing_claim_owner',
+            field=models.CharField(max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='disksnapshotstorage',
+            name='hashing_claim_expire',
+            field=basic_library.xfield.TimestampField(decimal_places=6, max_digits=20, null=True),
+        ),
+    ]
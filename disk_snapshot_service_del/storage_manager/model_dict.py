@@ -0,0 +1,52 @@
+import decimal
+import operator
+import threading
+
+from django.db import models
+
+_converters = dict()
+_converters_locker = threading.Lock()
+
+
+class ModelDictConverter(object):
+    """将数据库对象转换为字典
+
+    :remark:
+        根据模型的字段元数据一次性生成转换规则，转换时仅按属性名取值
+        输出与 rest_framework.serializers.ModelSerializer（fields = '__all__'）一致：
+            外键使用字段名，值为关联对象主键
+            DecimalField 按小数位数格式化为字符串
+    """
+
+    def __init__(self, model):
+        fields = model._meta.concrete_fields
+        self.model = model
+        self.keys = tuple(field.name for field in fields)
+        self._getter = operator.attrgetter(*(field.attname for field in fields))
+        self._decimal_fields = tuple(
+            (field.name, decimal.Decimal(1).scaleb(-field.decimal_places))
+            for field in fields if isinstance(field, models.DecimalField))
+
+    def convert(self, obj) -> dict:
+        values = self._getter(obj)
+        result = dict(zip(self.keys, values if len(self.keys) > 1 else (values,)))
+        for key, quantum in self._decimal_fields:
+            value = result[key]
+            if value is not None:
+                result[key] = format(decimal.Decimal(value).quantize(quantum, rounding=decimal.ROUND_HALF_UP), 'f')
+        return result
+
+
+def get_model_dict_converter(model) -> ModelDictConverter:
+    converter = _converters.get(model, None)
+    if converter is None:
+        with _converters_locker:
+            converter = _converters.get(model, None)
+            if converter is None:
+                converter = ModelDictConverter(model)
+                _converters[model] = converter
+    return converter
+
+
+def to_dict(obj) -> dict:
+    return get_model_dict_converter(type(obj)).convert(obj)
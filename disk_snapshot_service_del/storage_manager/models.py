@@ -1,6 +1,7 @@
 import uuid
 
 from django.db import models
+from django.db.models import F
 
 from basic_library import xfield
 from basic_library import xfunctions
@@ -79,6 +80,10 @@ class HostSnapshot(models.Model):
     def is_cdp_host_snapshot(self):
         return self.host_snapshot_type == HostSnapshot.CDP
 
+    def set_invalid(self):
+        self.host_snapshot_valid = False
+        self.save(update_fields=['host_snapshot_valid', ])
+
     @staticmethod
     def create(host_obj: Host, host_snapshot_ident: str, host_snapshot_type):
         if isinstance(host_snapshot_type, str):
@@ -192,6 +197,8 @@ class DiskSnapshotStorageRoot(models.Model):
     root_uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     hash_type = models.PositiveSmallIntegerField(choices=ROOT_HASH_TYPE_CHOICES)
     root_valid = models.BooleanField(default=True)
+    # 快照存储变更代数：关联的快照存储对象每次保存后，在同一事务中增加
+    storage_generation = models.BigIntegerField(default=0)
 
     @property
     def root_ident(self):
@@ -235,6 +242,20 @@ class DiskSnapshotStorageRoot(models.Model):
     def get_valid_objs():
         return DiskSnapshotStorageRoot.objects.filter(root_valid=True)
 
+    @staticmethod
+    def increase_storage_generation(storage_root_id):
+        DiskSnapshotStorageRoot.objects.filter(id=storage_root_id).update(storage_generation=F('storage_generation') + 1)
+
+    @staticmethod
+    def get_storage_generation(storage_root_id):
+        """快照存储变更代数，用于判断快照存储树是否变更
+
+        :return:
+            root 不存在时返回 None
+        """
+        return (DiskSnapshotStorageRoot.objects.filter(id=storage_root_id)
+                .values_list('storage_generation', flat=True).first())
+
 
 class DiskSnapshot(models.Model):
     """
@@ -313,6 +334,9 @@ class DiskSnapshotStorage(models.Model):
     parent_timestamp = xfield.TimestampField(null=True)
     inc_raw_data_bytes = models.BigIntegerField(default=-1)
     file_level_deduplication = models.BooleanField()
+    # hash处理的领取者与领取到期时刻，到期前其他领取者不可领取
+    hashing_claim_owner = models.CharField(max_length=128, null=True)
+    hashing_claim_expire = xfield.TimestampField(null=True)
 
     class Meta:
         indexes = [
@@ -339,6 +363,26 @@ class DiskSnapshotStorage(models.Model):
                 .exclude(storage_status=DiskSnapshotStorage.RECYCLED)
                 )
 
+    @staticmethod
+    def live_storage_count_by_image_paths(image_paths) -> dict:
+        """统计每个文件中未回收的快照存储数量
+
+        :remark:
+            使用一次分组聚合查询完成统计，未出现在返回值中的文件路径，其数量为0
+        :return:
+            {image_path: count, ...}
+        """
+        if not image_paths:
+            return dict()
+
+        return dict(DiskSnapshotStorage.objects
+                    .filter(image_path__in=set(image_paths))
+                    .exclude(storage_status__in=DiskSnapshotStorage.STATUS_RECYCLE)
+                    .order_by()
+                    .values_list('image_path')
+                    .annotate(models.Count('id'))
+                    )
+
     def set_storage_status(self, storage_status):
         if self.storage_status != storage_status:
             if self.storage_status in (self.STORAGE, self.EXCEPTION,):
@@ -0,0 +1,152 @@
+import threading
+import uuid
+
+from basic_library import xlogging
+from storage_manager import storage_reference_manager as srm
+
+_logger = xlogging.getLogger(__name__)
+
+_shared_storage_chain_registry = None
+_shared_storage_chain_registry_locker = threading.Lock()
+
+
+class SharedStorageChainRegistry(object):
+    """共享读取链注册表
+
+    :remark:
+        同一时刻打开同一快照存储的多个业务，共用一个已 acquire 的读取链（规范链）
+        首次打开时生成规范链并添加读取引用，之后的打开仅增加计数，最后一次释放时移除读取引用
+    """
+
+    @staticmethod
+    def get_shared_storage_chain_registry():
+        global _shared_storage_chain_registry
+
+        if _shared_storage_chain_registry is None:
+            with _shared_storage_chain_registry_locker:
+                if _shared_storage_chain_registry is None:
+                    _shared_storage_chain_registry = SharedStorageChainRegistry(
+                        srm.StorageReferenceManager.get_storage_reference_manager())
+        return _shared_storage_chain_registry
+
+    def __init__(self, storage_reference_manager):
+        """
+        :param storage_reference_manager: StorageReferenceManager
+            规范链使用的快照存储引用管理器
+        :var self.entries
+            key为 (快照存储标识, 时刻)
+            value为 [规范链, 引用计数]
+        :var self.pendings
+            正在生成规范链的key
+            key为 (快照存储标识, 时刻)
+            value为 threading.Event ，生成结束（成功或失败）后置位
+        :var self.locker
+            锁对象，访问/修改 self.entries 与 self.pendings 前必须进入该锁的临界区
+            生成规范链需要查询数据库，不在该锁的临界区内进行，仅同一key的打开者等待生成结束
+        """
+        self.storage_reference_manager = storage_reference_manager
+        self.entries = dict()
+        self.pendings = dict()
+        self.locker = threading.Lock()
+
+    def create_view(self, storage_ident, timestamp, generate_chain, caller_name: str):
+        """创建共享读取链视图
+
+        :param generate_chain:
+            生成规范链的函数，返回未 acquire 的 StorageChainForRead ；仅在没有可共用的规范链时调用
+        """
+        return SharedStorageChainForRead(self, storage_ident, timestamp, generate_chain, caller_name)
+
+    def ref_count(self, storage_ident, timestamp) -> int:
+        with self.locker:
+            entry = self.entries.get((storage_ident, timestamp,), None)
+            return entry[1] if entry else 0
+
+    def acquire(self, key, generate_chain):
+        while True:
+            with self.locker:
+                entry = self.entries.get(key, None)
+                if entry:
+                    entry[1] += 1
+                    return entry[0]
+
+                pending = self.pendings.get(key, None)
+                if pending is None:
+                    pending = threading.Event()
+                    self.pendings[key] = pending
+                    break
+
+            pending.wait()  # 生成失败时，由等待者重新生成
+
+        try:
+            storage_chain = generate_chain()
+            assert storage_chain.storage_reference_manager is self.storage_reference_manager
+            storage_chain.acquire()
+        except Exception:
+            with self.locker:
+                self.pendings.pop(key)
+            pending.set()
+            raise
+
+        with self.locker:
+            self.entries[key] = [storage_chain, 1]
+            self.pendings.pop(key)
+        pending.set()
+        return storage_chain
+
+    def release(self, key):
+        with self.locker:
+            entry = self.entries[key]
+            entry[1] -= 1
+            if entry[1]:
+                return
+            self.entries.pop(key)
+
+        entry[0].release()
+
+
+class SharedStorageChainForRead(object):
+    """共享读取链视图
+
+    :remark:
+        接口与 StorageChainForRead 一致，数据来自注册表中的规范链
+        acquire方法与release方法配对使用
+        acquire方法调用后，在调用release方法之前，不可重入
+        acquire方法需在快照存储锁空间内调用
+    """
+
+    def __init__(self, registry, storage_ident, timestamp, generate_chain, caller_name: str):
+        self.registry = registry
+        self.key = (storage_ident, timestamp,)
+        self.timestamp = timestamp
+        self.name = f'shared r | {uuid.uuid4().hex} | {caller_name}'
+        self._generate_chain = generate_chain
+        self._chain = None
+
+    def __del__(self):
+        if self._chain:
+            _logger.warning(f'{self.name} NOT call release')
+            self.release()
+
+    def acquire(self):
+        assert self._chain is None
+        self._chain = self.registry.acquire(self.key, self._generate_chain)
+        return self
+
+    def release(self):
+        if self._chain:
+            self._chain = None
+            self.registry.release(self.key)
+
+    def is_empty(self):
+        return False
+
+    @property
+    def storage_info_list(self) -> list:
+        assert self._chain
+        return self._chain.storage_info_list
+
+    @property
+    def storages(self) -> list:
+        assert self._chain
+        return self._chain.storages
@@ -0,0 +1,60 @@
+import time
+
+from django.db import transaction
+from rest_framework import serializers
+
+from storage_manager import model_dict
+from storage_manager import models as m
+from storage_manager import storage_chain as chain
+from storage_manager import storage_reference_manager as srm
+from storage_manager import storage_tree as tree
+from storage_manager.simulation import tree_generator
+
+
+class DiskSnapshotStorageSerializer(serializers.ModelSerializer):
+    """快照存储链原先使用的序列化器，用于对比"""
+
+    class Meta:
+        model = m.DiskSnapshotStorage
+        fields = '__all__'
+
+
+def _build_chain_by_serializer(storage_objs):
+    storage_info_list = list()
+    for storage_obj in storage_objs:
+        storage_info_list.insert(0, DiskSnapshotStorageSerializer(storage_obj).data)
+    return storage_info_list
+
+
+def _build_chain_by_converter(storage_objs):
+    storage_chain = chain.StorageChainForRead(None, srm.StorageReferenceManager(), 'benchmark')
+    for storage_obj in storage_objs:
+        storage_chain.insert_head(storage_obj)
+    return storage_chain
+
+
+def _elapsed(fn, storage_objs, repeat):
+    begin = time.monotonic()
+    for _ in range(repeat):
+        fn(storage_objs)
+    return (time.monotonic() - begin) / repeat
+
+
+def run(depth=500, repeat=20, seed=0):
+    """比较构建快照存储链时，序列化器与字段元数据转换器的耗时，模拟数据在结束后回滚"""
+    with transaction.atomic():
+        storage_root_obj = tree_generator.SyntheticTreeGenerator(seed).create_qcow_chain_root(depth)
+        storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(storage_root_obj)
+        leaf_storage_obj = max(m.DiskSnapshotStorage.objects.filter(storage_root=storage_root_obj), key=lambda o: o.id)
+        storage_objs = [node.storage_obj for node in
+                        tree.dfs_to_root(storage_tree.get_node_by_storage_obj(leaf_storage_obj))]
+        transaction.set_rollback(True)
+
+    assert ([dict(info) for info in _build_chain_by_serializer(storage_objs)]
+            == list(_build_chain_by_converter(storage_objs)._storage_info_list))
+
+    serializer_seconds = _elapsed(_build_chain_by_serializer, storage_objs, repeat)
+    converter_seconds = _elapsed(_build_chain_by_converter, storage_objs, repeat)
+    print(f'chain depth {len(storage_objs)} : serializer {serializer_seconds * 1000:.2f}ms , '
+          f'converter {converter_seconds * 1000:.2f}ms , {serializer_seconds / converter_seconds:.1f}x')
+    return serializer_seconds, converter_seconds
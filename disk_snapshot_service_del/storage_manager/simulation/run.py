@@ -0,0 +1,26 @@
+from django.db import transaction
+
+from storage_manager.simulation import simulator
+from storage_manager.simulation import tree_generator
+
+GiB = tree_generator.GiB
+
+_CONFIGS = (
+    ('full_scan', lambda: {}),
+    ('change_tracker', lambda: {'track_changes': True}),
+    ('change_tracker_with_budget', lambda: {'track_changes': True, 'merge_io_budget_bytes': 64 * GiB}),
+)
+
+
+def run(seed=0, scale=1):
+    """在相同的合成数据上，分别使用不同的回收配置运行模拟，模拟数据在结束后回滚"""
+    for name, create_kwargs in _CONFIGS:
+        with transaction.atomic():
+            storage_root_objs = tree_generator.SyntheticTreeGenerator(seed).create_default_roots(scale)
+            live_storage_count = simulator.RecyclingSimulator.live_storage_count(storage_root_objs)
+            report = simulator.RecyclingSimulator(storage_root_objs, **create_kwargs()).run()
+            print(f'==== {name} ====')
+            print(f'live storages     : {live_storage_count} -> '
+                  f'{simulator.RecyclingSimulator.live_storage_count(storage_root_objs)}')
+            print(report)
+            transaction.set_rollback(True)
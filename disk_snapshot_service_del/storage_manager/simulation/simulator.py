@@ -0,0 +1,191 @@
+import collections
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from basic_library import xlogging
+from storage_manager import merge_work_cost as mwc
+from storage_manager import models as m
+from storage_manager import storage_change_tracker as sct
+from storage_manager import storage_collection as sc
+from storage_manager import storage_locker_manager as slm
+from storage_manager import storage_reference_manager as srm
+
+_logger = xlogging.getLogger(__name__)
+
+
+class SimulationReport(object):
+    """模拟回收的统计结果"""
+
+    def __init__(self):
+        self.passes = 0
+        self.converged = False
+        self.queries = 0
+        self.lock_hold_seconds = 0.0
+        self.moving_bytes = 0
+        self.elapsed_seconds = 0.0
+        self.action_count_dict = collections.Counter()
+
+    def __str__(self):
+        lines = [
+            f'passes            : {self.passes}',
+            f'converged         : {self.converged}',
+            f'queries           : {self.queries}',
+            f'lock_hold_seconds : {self.lock_hold_seconds:.3f}',
+            f'moving_bytes      : {self.moving_bytes}',
+            f'elapsed_seconds   : {self.elapsed_seconds:.3f}',
+        ]
+        for name, count in sorted(self.action_count_dict.items()):
+            lines.append(f'  {name:<32}: {count}')
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class _TimingStorageLocker(object):
+
+    def __init__(self, locker, report):
+        self.locker = locker
+        self.report = report
+        self.begin = None
+
+    def __enter__(self):
+        self.locker.__enter__()
+        self.begin = time.monotonic()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.report.lock_hold_seconds += time.monotonic() - self.begin
+        return self.locker.__exit__(exc_type, exc_val, exc_tb)
+
+
+class _TimingStorageLockerManager(slm.StorageLockerManager):
+    """统计锁空间持有时间的锁管理器"""
+
+    def __init__(self, report):
+        super(_TimingStorageLockerManager, self).__init__()
+        self.report = report
+
+    def get_locker(self, storage_root_ident: str, caller_ident: str):
+        return _TimingStorageLocker(super(_TimingStorageLockerManager, self).get_locker(
+            storage_root_ident, caller_ident), self.report)
+
+
+class SimulatedStorageAction(object):
+    """替代 storage_action 模块的回收IO：不访问文件，仅统计调用次数与搬迁数据量
+
+    remark：
+        搬迁数据量按 merge_work_cost 的估算累计
+    """
+
+    def __init__(self, report):
+        self.report = report
+
+    def _count_action(self, name, moving_bytes=0):
+        self.report.action_count_dict[name] += 1
+        self.report.moving_bytes += moving_bytes
+
+    def remove_cdp_file(self, file_path):
+        _ = file_path
+        self._count_action('remove_cdp_file')
+
+    def remove_qcow_file(self, file_path):
+        _ = file_path
+        self._count_action('remove_qcow_file')
+
+    def delete_qcow_snapshot(self, file_path, snapshot_name):
+        _ = file_path
+        _ = snapshot_name
+        self._count_action('delete_qcow_snapshot')
+
+    def merge_cdp_to_qcow(self, hash_type, rw_chain, merge_cdp_snapshot_storage_objs):
+        _ = hash_type
+        _ = rw_chain
+        # CDP文件与父快照的虚拟磁盘大小一致，使用首个CDP文件代替父快照
+        cost = mwc.estimate_merge_cdp(merge_cdp_snapshot_storage_objs[0], merge_cdp_snapshot_storage_objs)
+        self._count_action('merge_cdp_to_qcow', cost.moving_bytes)
+
+    def merge_qcow_snapshot_type_a(self, hash_type, children_snapshot_storage_objs, merge_storage_obj):
+        _ = hash_type
+        _ = children_snapshot_storage_objs
+        cost = mwc.estimate_merge_qcow_snapshot_type_a(merge_storage_obj)
+        self._count_action('merge_qcow_snapshot_type_a', cost.moving_bytes)
+
+    def merge_qcow_snapshot_type_b(self, hash_type, write_chain, merge_storage_obj):
+        _ = hash_type
+        _ = write_chain
+        cost = mwc.estimate_merge_qcow_snapshot_type_b(merge_storage_obj)
+        self._count_action('merge_qcow_snapshot_type_b', cost.moving_bytes)
+
+
+class RecyclingSimulator(object):
+    """离线模拟回收逻辑
+
+    对指定的 root 循环执行 StorageCollection.collect()，直到所有 root 都没有可回收的快照存储
+    remark：
+        回收作业使用 SimulatedStorageAction ，不访问文件
+        模拟过程中没有外部的快照存储引用，每个 root 使用独立的引用管理器
+        应在事务中使用，模拟结束后回滚，避免修改本地数据库
+    """
+
+    def __init__(self, storage_root_objs, max_passes=100000, track_changes=False, merge_io_budget_bytes=0):
+        """
+        :param storage_root_objs:
+            参与模拟的 root
+        :param max_passes:
+            最多执行的轮数，超过后视为不收敛
+        :param track_changes:
+            参考 StorageCollection ；模拟开始前重置全局的变更跟踪器
+        :param merge_io_budget_bytes:
+            参考 StorageCollection
+        """
+        self.storage_root_objs = storage_root_objs
+        self.max_passes = max_passes
+        self.track_changes = track_changes
+        self.merge_io_budget_bytes = merge_io_budget_bytes
+        self.report = SimulationReport()
+        self.storage_action = SimulatedStorageAction(self.report)
+
+    def run(self) -> SimulationReport:
+        if self.track_changes:
+            sct.StorageChangeTracker.get_storage_change_tracker().reset()
+
+        begin = time.monotonic()
+        self._run()
+        self.report.elapsed_seconds = time.monotonic() - begin
+
+        _logger.info(f'recycling simulation finished :\n{self.report}')
+        return self.report
+
+    def _run(self):
+        storage_locker_manager = _TimingStorageLockerManager(self.report)
+        collections_list = [
+            sc.StorageCollection(storage_root_obj, srm.StorageReferenceManager(), storage_locker_manager,
+                                 self.track_changes, self.merge_io_budget_bytes, self.storage_action)
+            for storage_root_obj in self.storage_root_objs
+        ]
+
+        while self.report.passes < self.max_passes:
+            self.report.passes += 1
+            any_work = False
+
+            for collection in collections_list:
+                collection.storage_root_obj.refresh_from_db()
+                if not collection.storage_root_obj.root_valid:
+                    continue
+                with CaptureQueriesContext(connection) as queries:
+                    if collection.collect():
+                        any_work = True
+                self.report.queries += len(queries.captured_queries)
+
+            if not any_work:
+                self.report.converged = True
+                break
+
+    @staticmethod
+    def live_storage_count(storage_root_objs) -> int:
+        return (m.DiskSnapshotStorage.objects
+                .filter(storage_root__in=storage_root_objs)
+                .exclude(storage_status__in=m.DiskSnapshotStorage.STATUS_RECYCLE)
+                .count())
@@ -0,0 +1,160 @@
+import decimal
+import random
+import uuid
+
+from storage_manager import models as m
+
+GiB = 1024 ** 3
+
+
+class SyntheticTreeGenerator(object):
+    """在本地数据库中生成合成的快照存储依赖树
+
+    remark：
+        使用固定的随机种子，生成的数据可重复
+        生成的文件路径并不存在，回收作业的实际IO由模拟器替换
+    """
+
+    def __init__(self, seed=0, disk_bytes=100 * GiB, invalid_ratio=0.7, directory='/simulation'):
+        """
+        :param seed:
+            随机种子
+        :param disk_bytes:
+            虚拟磁盘大小
+        :param invalid_ratio:
+            主机快照失效的比例，最新的主机快照总是有效
+        :param directory:
+            合成的快照存储文件所在目录
+        """
+        self.random = random.Random(seed)
+        self.disk_bytes = disk_bytes
+        self.invalid_ratio = invalid_ratio
+        self.directory = directory
+        self.timestamp = decimal.Decimal('1500000000.000000')
+        self.host_obj = m.Host.objects.create(host_ident=self._new_ident())
+        self.source_disk_obj = m.SourceDisk.objects.create(
+            host=self.host_obj, disk_native_guid=self._new_ident(), agent_disk_ident=self._new_ident(),
+            disk_display_name='simulation', disk_bytes=disk_bytes, boot_device=True, os_device=True,
+            bmf_device=False, partition_type=m.SourceDisk.GPT)
+
+    @staticmethod
+    def _new_ident():
+        return uuid.uuid4().hex
+
+    def _next_timestamp(self, seconds=60):
+        self.timestamp += seconds
+        return self.timestamp
+
+    def _new_inc_raw_data_bytes(self):
+        return int(self.disk_bytes * self.random.uniform(0.01, 0.2))
+
+    def _is_valid(self, is_last):
+        return is_last or self.random.random() >= self.invalid_ratio
+
+    def _create_locator_with_host_snapshot(self, host_snapshot_type, begin_timestamp, end_timestamp, valid):
+        locator_obj = m.DiskSnapshotLocator.objects.create(locator_ident=self._new_ident())
+        host_snapshot_obj = m.HostSnapshot.objects.create(
+            host=self.host_obj, host_snapshot_ident=self._new_ident(), host_snapshot_valid=valid,
+            host_snapshot_type=host_snapshot_type, host_snapshot_begin_timestamp=begin_timestamp,
+            host_snapshot_end_timestamp=end_timestamp)
+        m.DiskSnapshot.objects.create(
+            source_disk=self.source_disk_obj, host_snapshot=host_snapshot_obj, locator=locator_obj, disk_index=0)
+        return locator_obj
+
+    def _create_storage(self, root_obj, parent_storage_obj, locator_obj, image_path, is_cdp, begin_timestamp,
+                        end_timestamp, file_level_deduplication=False):
+        return m.DiskSnapshotStorage.objects.create(
+            storage_root=root_obj,
+            source_disk=self.source_disk_obj,
+            locator=locator_obj,
+            storage_type=m.DiskSnapshotStorage.CDP if is_cdp else m.DiskSnapshotStorage.QCOW,
+            storage_status=m.DiskSnapshotStorage.STORAGE,
+            disk_snapshot_storage_ident=self._new_ident(),
+            disk_bytes=self.disk_bytes,
+            image_path=image_path,
+            full_hash_path=None,
+            inc_hash_path=None,
+            storage_begin_timestamp=begin_timestamp,
+            storage_end_timestamp=end_timestamp,
+            parent_snapshot=parent_storage_obj,
+            parent_timestamp=None,
+            inc_raw_data_bytes=self._new_inc_raw_data_bytes(),
+            file_level_deduplication=file_level_deduplication,
+        )
+
+    def _create_qcow_snapshots(self, root_obj, parent_storage_obj, count, snapshots_per_file=1,
+                               file_level_deduplication=False):
+        image_path = None
+        storage_obj = parent_storage_obj
+        for index in range(count):
+            if index % snapshots_per_file == 0:
+                image_path = self.new_image_path(root_obj)
+            storage_obj = self.create_qcow_snapshot(
+                root_obj, storage_obj, image_path, self._is_valid(index == count - 1), file_level_deduplication)
+        return storage_obj
+
+    def create_root(self, hash_type=m.DiskSnapshotStorageRoot.ROOT_HASH_TYPE_NONE):
+        """创建不含快照存储的依赖树"""
+        return m.DiskSnapshotStorageRoot.objects.create(hash_type=hash_type)
+
+    def new_image_path(self, root_obj, is_cdp=False):
+        """生成依赖树中新的快照存储文件路径，文件并不存在"""
+        return f'{self.directory}/{root_obj.root_ident}/{self._new_ident()}.{"cdp" if is_cdp else "qcow"}'
+
+    def create_qcow_snapshot(self, root_obj, parent_storage_obj, image_path, valid=True,
+                             file_level_deduplication=False):
+        """在 image_path 中创建一个qcow快照存储，以及其所属的主机快照
+
+        :param valid:
+            主机快照是否有效
+        """
+        timestamp = self._next_timestamp()
+        locator_obj = self._create_locator_with_host_snapshot(m.HostSnapshot.NORMAL, timestamp, timestamp, valid)
+        return self._create_storage(
+            root_obj, parent_storage_obj, locator_obj, image_path, False, timestamp, timestamp,
+            file_level_deduplication)
+
+    def create_qcow_chain_root(self, count):
+        """每个快照一个qcow文件的依赖链，回收时走跨文件合并"""
+        root_obj = self.create_root()
+        self._create_qcow_snapshots(root_obj, None, count)
+        return root_obj
+
+    def create_shared_file_root(self, count, snapshots_per_file=8):
+        """多个快照共用一个qcow文件的依赖链，回收时走文件内合并"""
+        root_obj = self.create_root()
+        self._create_qcow_snapshots(root_obj, None, count, snapshots_per_file)
+        return root_obj
+
+    def create_file_level_deduplication_root(self, count):
+        """带有文件级去重的依赖链，不可合并"""
+        root_obj = self.create_root()
+        self._create_qcow_snapshots(root_obj, None, count, file_level_deduplication=True)
+        return root_obj
+
+    def create_cdp_root(self, runs, cdp_files_per_run=4):
+        """多段CDP：每段为一个基础qcow快照加上连续的CDP文件"""
+        root_obj = self.create_root()
+        storage_obj = None
+        for run_index in range(runs):
+            storage_obj = self._create_qcow_snapshots(root_obj, storage_obj, 1)
+            begin_timestamp = storage_obj.storage_end_timestamp
+            end_timestamp = begin_timestamp + 60 * cdp_files_per_run
+            locator_obj = self._create_locator_with_host_snapshot(
+                m.HostSnapshot.CDP, begin_timestamp, end_timestamp, self._is_valid(run_index == runs - 1))
+            for _ in range(cdp_files_per_run):
+                timestamp = self.timestamp
+                storage_obj = self._create_storage(
+                    root_obj, storage_obj, locator_obj, self.new_image_path(root_obj, True), True,
+                    timestamp, self._next_timestamp())
+        return root_obj
+
+    def create_default_roots(self, scale=1) -> list:
+        """生成各种形态的依赖树，scale 为规模倍数"""
+        return [
+            self.create_qcow_chain_root(50 * scale),
+            self.create_shared_file_root(64 * scale),
+            self.create_file_level_deduplication_root(20 * scale),
+            self.create_cdp_root(10 * scale),
+            self.create_qcow_chain_root(2000 * scale),  # 数千个定位标记
+        ]
@@ -1,7 +1,10 @@
+import concurrent.futures
 import decimal
 import functools
 import glob
 import os
+import threading
+import time
 
 from basic_library import xdata
 from basic_library import xlogging
@@ -38,6 +41,7 @@ def remove_cdp_file(file_path):
 
     @vsd_check_path(file_path)
     def _remove_cdp_file():
+        _file_exist_cache.discard(file_path)
         if os.path.isfile(file_path):
             os.remove(file_path)
         _remove_glob([
@@ -53,6 +57,7 @@ def remove_qcow_file(file_path):
 
     @vsd_check_path(file_path)
     def _remove_qcow_file():
+        _file_exist_cache.discard(file_path)
         if os.path.isfile(file_path):
             os.remove(file_path)
         _remove_glob([
@@ -262,12 +267,16 @@ def merge_qcow_snapshot_type_b(hash_type, write_chain, merge_storage_obj):
 def is_file_exist(file_path: str, raise_exception=False) -> bool:
     r = vsd.check_path(file_path, raise_exception) and os.path.isfile(file_path)
     if (not r) and raise_exception:
-        xlogging.raise_and_logging_error(
-            '存储文件不存在', f'file [{file_path}] not exist', print_args=False,
-            exception_class=xdata.StorageImageFileNotExist, logger_level='info')
+        _raise_file_not_exist(file_path)
     return r
 
 
+def _raise_file_not_exist(file_path):
+    xlogging.raise_and_logging_error(
+        '存储文件不存在', f'file [{file_path}] not exist', print_args=False,
+        exception_class=xdata.StorageImageFileNotExist, logger_level='info')
+
+
 def is_all_files_exist(files: list, raise_exception=False) -> bool:
     """检查所有文件是否都存在
 
@@ -284,11 +293,116 @@ def is_all_files_exist(files: list, raise_exception=False) -> bool:
         return True
 
 
+_FILE_EXIST_CACHE_SECONDS = 10
+"""已封存文件存在性结果的缓存时长"""
+
+_FILE_EXIST_CHECK_WORKERS = 8
+"""并发检查文件存在性的线程数"""
+
+
+class _FileExistCache(object):
+    """文件存在性缓存
+
+    :remark:
+        仅缓存已封存（不再写入）文件的存在结果，过期后重新检查
+        文件被删除时需调用 discard
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.expire_times = dict()
+        self.locker = threading.Lock()
+
+    def is_exist(self, file_path) -> bool:
+        with self.locker:
+            expire_time = self.expire_times.get(file_path, None)
+            if expire_time is None:
+                return False
+            if expire_time < time.monotonic():
+                self.expire_times.pop(file_path)
+                return False
+            return True
+
+    def add(self, file_path):
+        with self.locker:
+            self.expire_times[file_path] = time.monotonic() + self.ttl_seconds
+
+    def discard(self, file_path):
+        with self.locker:
+            self.expire_times.pop(file_path, None)
+
+
+_file_exist_cache = _FileExistCache(_FILE_EXIST_CACHE_SECONDS)
+
+_file_exist_check_executor = None
+_file_exist_check_executor_locker = threading.Lock()
+
+
+def _get_file_exist_check_executor():
+    global _file_exist_check_executor
+
+    if _file_exist_check_executor is None:
+        with _file_exist_check_executor_locker:
+            if _file_exist_check_executor is None:
+                _file_exist_check_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=_FILE_EXIST_CHECK_WORKERS, thread_name_prefix='file_exist_check')
+    return _file_exist_check_executor
+
+
+def is_all_files_exist_concurrently(files: list, raise_exception=False, sealed_files=()) -> bool:
+    """并发检查所有文件是否都存在
+
+    :param files:
+        [file_path: str, ...]
+    :param raise_exception
+    :param sealed_files:
+        已封存的文件，其存在结果会被短时缓存
+    :remark:
+        快照存储目录检查在当前线程中逐一完成，仅 stat 操作并发执行
+        发现不存在的文件后立即返回，取消尚未开始的检查
+    """
+    need_stat_files = list()
+    for file_path in set(files):
+        if not vsd.check_path(file_path, raise_exception):
+            return False
+        if file_path not in sealed_files or not _file_exist_cache.is_exist(file_path):
+            need_stat_files.append(file_path)
+
+    if len(need_stat_files) <= 1:
+        results = ((file_path, os.path.isfile(file_path)) for file_path in need_stat_files)
+        return _check_file_exist_results(results, raise_exception, sealed_files)
+
+    executor = _get_file_exist_check_executor()
+    futures = {executor.submit(os.path.isfile, file_path): file_path for file_path in need_stat_files}
+    try:
+        results = ((futures[future], future.result()) for future in concurrent.futures.as_completed(futures))
+        return _check_file_exist_results(results, raise_exception, sealed_files)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _check_file_exist_results(results, raise_exception, sealed_files) -> bool:
+    for file_path, is_exist in results:
+        if not is_exist:
+            if raise_exception:
+                _raise_file_not_exist(file_path)
+            return False
+        if file_path in sealed_files:
+            _file_exist_cache.add(file_path)
+    return True
+
+
 def is_all_images_in_storage_info_exist(storage_info_list: list, raise_exception=False) -> bool:
     """检查所有 storage_info 的 image_path 文件是否都存在
 
     :param storage_info_list:
         参考 StorageChain 注释
     :param raise_exception
+    :remark:
+        没有快照存储正在写入的文件视为已封存
     """
-    return is_all_files_exist([info['image_path'] for info in storage_info_list], raise_exception)
+    files = [info['image_path'] for info in storage_info_list]
+    writing_files = {info['image_path'] for info in storage_info_list
+                     if info['storage_status'] in m.DiskSnapshotStorage.STATUS_WRITING}
+    return is_all_files_exist_concurrently(files, raise_exception, set(files) - writing_files)
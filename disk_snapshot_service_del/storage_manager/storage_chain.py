@@ -1,19 +1,25 @@
 import abc
+import collections
 import decimal
 import uuid
 
-from rest_framework import serializers
-
 from basic_library import xlogging
+from storage_manager import model_dict
 from storage_manager import models as m
 
 _logger = xlogging.getLogger(__name__)
 
 
-class DiskSnapshotStorageSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = m.DiskSnapshotStorage
-        fields = '__all__'
+class StorageChainLayout(object):
+    """快照存储链布局
+
+    :remark:
+        不含引用记录的计算结果，可在多个快照存储链之间共用，不可修改
+    """
+
+    def __init__(self, storage_info_list: list, key_storage_info_list: list):
+        self.storage_info_list = storage_info_list
+        self.key_storage_info_list = key_storage_info_list
 
 
 class StorageChain(abc.ABC):
@@ -30,9 +36,10 @@ class StorageChain(abc.ABC):
         self.timestamp = timestamp
         self.storage_reference_manager = storage_reference_manager
         self.name = f'{name_prefix} | {uuid.uuid4().hex} | {caller_name}'
-        self._storage_info_list = list()
+        self._storage_info_list = collections.deque()  # 构建时从头部逐一插入祖先节点
         self._valid = False
         self._key_storage_info_list = None  # 关键快照存储链
+        self._layout = None
 
     def __del__(self):
         if self._valid:
@@ -47,45 +54,89 @@ class StorageChain(abc.ABC):
         assert not self._valid
         assert not self.is_empty()
         try:
-            self._key_storage_info_list = self._query_key_storage_info_list()
+            self._key_storage_info_list = self.get_layout().key_storage_info_list
             self._valid = True
         except Exception:
             self.release()
             raise
 
+    @staticmethod
+    def _is_key_storage_info(i, storage_info, next_storage_info) -> bool:
+        """判断链中第 i 个节点是否为“关键”storage
+
+        :param next_storage_info:
+            链中的下一个节点，为 None 时意为最后一个节点
+        """
+        if next_storage_info is None:
+            return True  # 最后一个节点
+        if i == 0 and storage_info['file_level_deduplication']:
+            assert storage_info['parent_snapshot'] is None
+            return True  # 根节点且有文件级去重
+        if storage_info['image_path'] != next_storage_info['image_path']:
+            return True  # 与下一个节点不在同一个文件中
+        if next_storage_info['storage_status'] in m.DiskSnapshotStorage.STATUS_WRITING:
+            return True  # 下一个节点正在写入数据中
+        return False
+
     def _query_key_storage_info_list(self):
         """获取“关键”storage列表"""
         array = list()
-        storage_info_list_len = len(self._storage_info_list)
-        storage_info_list_max_i = storage_info_list_len - 1
+        storage_info_list = list(self._storage_info_list)
+        storage_info_list_len = len(storage_info_list)
 
         for i in range(storage_info_list_len):
-            storage_info = self._storage_info_list[i]
+            storage_info = storage_info_list[i]
             assert storage_info['storage_status'] != m.DiskSnapshotStorage.RECYCLED
 
-            if i == storage_info_list_max_i:
-                array.append(storage_info)  # 最后一个节点
-                continue
-            if i == 0 and storage_info['file_level_deduplication']:
-                assert storage_info['parent_snapshot'] is None
-                array.append(storage_info)  # 根节点且有文件级去重
-                continue
-            if storage_info['image_path'] != self._storage_info_list[i + 1]['image_path']:
-                array.append(storage_info)  # 与下一个节点不在同一个文件中
-                continue
-            if self._storage_info_list[i + 1]['storage_status'] in m.DiskSnapshotStorage.STATUS_WRITING:
-                array.append(storage_info)  # 下一个节点正在写入数据中
-                continue
+            next_storage_info = storage_info_list[i + 1] if i + 1 < storage_info_list_len else None
+            if self._is_key_storage_info(i, storage_info, next_storage_info):
+                array.append(storage_info)
 
         return array
 
+    def _append_tail_to_layout(self, storage_info) -> StorageChainLayout:
+        """在已计算的布局末尾追加节点
+
+        :remark:
+            追加节点仅影响原末端节点是否为“关键”storage，耗时与链的深度无关
+        """
+        assert storage_info['storage_status'] != m.DiskSnapshotStorage.RECYCLED
+        storage_info_list = self._layout.storage_info_list
+        key_storage_info_list = self._layout.key_storage_info_list[:-1]  # 原末端节点必然为关键storage
+        tail_i = len(storage_info_list) - 1
+        if self._is_key_storage_info(tail_i, storage_info_list[tail_i], storage_info):
+            key_storage_info_list.append(storage_info_list[tail_i])
+        key_storage_info_list.append(storage_info)
+        return StorageChainLayout(storage_info_list + [storage_info], key_storage_info_list)
+
+    def get_layout(self) -> StorageChainLayout:
+        """获取快照存储链布局
+
+        :remark:
+            结果会内部缓存，直到快照存储链发生变更；acquire 时直接使用该结果
+        """
+        if self._layout is None:
+            self._layout = StorageChainLayout(list(self._storage_info_list), self._query_key_storage_info_list())
+        return self._layout
+
+    def set_layout(self, layout: StorageChainLayout):
+        """使用已计算的快照存储链布局，无需再逐一插入快照存储"""
+        assert not self._valid
+        assert self.is_empty()
+        self._storage_info_list = collections.deque(layout.storage_info_list)
+        self._layout = layout
+
     def insert_head(self, storage_obj):
         assert not self._valid
-        self._storage_info_list.insert(0, DiskSnapshotStorageSerializer(storage_obj).data)
+        self._storage_info_list.appendleft(model_dict.to_dict(storage_obj))
+        self._layout = None
 
     def insert_tail(self, storage_obj):
         assert not self._valid
-        self._storage_info_list.append(DiskSnapshotStorageSerializer(storage_obj).data)
+        storage_info = model_dict.to_dict(storage_obj)
+        if self._layout is not None:
+            self._layout = self._append_tail_to_layout(storage_info)
+        self._storage_info_list.append(storage_info)
 
     def is_empty(self):
         return len(self._storage_info_list) == 0
@@ -95,7 +146,7 @@ class StorageChain(abc.ABC):
         """获取所有快照存储节点数组"""
         assert self._valid
         assert self._storage_info_list
-        return self._storage_info_list.copy()
+        return list(self._storage_info_list)
 
     @property
     @abc.abstractmethod
@@ -0,0 +1,116 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from basic_library import xlogging
+from storage_manager import models as m
+
+_logger = xlogging.getLogger(__name__)
+
+_storage_change_tracker = None
+_storage_change_tracker_locker = threading.Lock()
+
+
+class StorageChangeTracker(object):
+    """快照存储变更跟踪器
+
+    按 root 记录发生变更的快照存储（脏节点），回收逻辑据此跳过没有变更的 root，并仅分析 root 中受影响的子树
+    remark：
+        尚未被回收逻辑分析过的 root 视为全部变更
+        变更来源：快照存储数据库对象的保存（状态、依赖关系等）、主机快照失效、快照存储引用释放
+    """
+
+    @staticmethod
+    def get_storage_change_tracker():
+        global _storage_change_tracker
+
+        if _storage_change_tracker is None:
+            with _storage_change_tracker_locker:
+                if _storage_change_tracker is None:
+                    _storage_change_tracker = StorageChangeTracker()
+        return _storage_change_tracker
+
+    def __init__(self):
+        """
+        :var self.dirty_storage_ids_dict
+            key 为 root 的数据库 id，value 为发生变更的快照存储数据库 id 集合；value 为 None 时意为全部变更
+        :var self.tracked_root_ids
+            已经被回收逻辑分析过的 root
+        """
+        self.dirty_storage_ids_dict = dict()
+        self.tracked_root_ids = set()
+        self.locker = threading.Lock()
+
+    def reset(self):
+        """清除所有记录，所有 root 重新视为尚未被分析过"""
+        with self.locker:
+            self.dirty_storage_ids_dict.clear()
+            self.tracked_root_ids.clear()
+
+    def mark_root_dirty(self, storage_root_id):
+        with self.locker:
+            self.dirty_storage_ids_dict[storage_root_id] = None
+
+    def mark_storages_dirty(self, storage_root_id, storage_ids):
+        with self.locker:
+            if storage_root_id not in self.dirty_storage_ids_dict:
+                self.dirty_storage_ids_dict[storage_root_id] = set()
+            dirty_storage_ids = self.dirty_storage_ids_dict[storage_root_id]
+            if dirty_storage_ids is not None:
+                dirty_storage_ids.update(storage_id for storage_id in storage_ids if storage_id)
+
+    def is_root_dirty(self, storage_root_id) -> bool:
+        with self.locker:
+            return (storage_root_id not in self.tracked_root_ids) or (storage_root_id in self.dirty_storage_ids_dict)
+
+    def pop_dirty_storage_ids(self, storage_root_id):
+        """取出 root 中发生变更的快照存储
+
+        :remark:
+            取出后，root 被视为没有变更，直到有新的变更被记录
+        :return:
+            快照存储数据库 id 集合；返回 None 时意为全部变更
+        """
+        with self.locker:
+            dirty_storage_ids = self.dirty_storage_ids_dict.pop(storage_root_id, set())
+            if storage_root_id not in self.tracked_root_ids:
+                self.tracked_root_ids.add(storage_root_id)
+                return None
+            return dirty_storage_ids
+
+
+@receiver(post_save, sender=m.DiskSnapshotStorage)
+def storage_post_save(sender, instance, **kwargs):
+    _ = sender
+    _ = kwargs
+    storage_obj = instance
+    tracker = StorageChangeTracker.get_storage_change_tracker()
+    # 父节点的可回收性依赖子节点的状态，所以一并标记
+    storage_ids = (storage_obj.id, storage_obj.parent_snapshot_id,)
+    tracker.mark_storages_dirty(storage_obj.storage_root_id, storage_ids)
+    # 提交前被取出的变更，分析时读取不到未提交的数据，所以提交后再次标记
+    transaction.on_commit(lambda: tracker.mark_storages_dirty(storage_obj.storage_root_id, storage_ids))
+    # 变更代数与快照存储在同一事务中更新，提交后对所有进程可见
+    m.DiskSnapshotStorageRoot.increase_storage_generation(storage_obj.storage_root_id)
+
+
+@receiver(post_save, sender=m.HostSnapshot)
+def host_snapshot_post_save(sender, instance, **kwargs):
+    _ = sender
+    _ = kwargs
+    host_snapshot_obj = instance
+    if host_snapshot_obj.host_snapshot_valid:
+        return
+
+    storage_ids_dict = dict()
+    for storage_root_id, storage_id in (m.DiskSnapshotStorage.objects
+                                        .filter(locator__disk_snapshots__host_snapshot=host_snapshot_obj)
+                                        .exclude(storage_status=m.DiskSnapshotStorage.RECYCLED)
+                                        .values_list('storage_root_id', 'id')):
+        storage_ids_dict.setdefault(storage_root_id, set()).add(storage_id)
+
+    tracker = StorageChangeTracker.get_storage_change_tracker()
+    for storage_root_id, storage_ids in storage_ids_dict.items():
+        tracker.mark_storages_dirty(storage_root_id, storage_ids)
@@ -1,24 +1,40 @@
 import abc
 import os
+import threading
 import uuid
-from functools import lru_cache
+import weakref
 
 from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 
 from basic_library import xfunctions
 from basic_library import xlogging
+from storage_manager import chain_layout_cache as clc
+from storage_manager import host_snapshot_index as hsi
+from storage_manager import merge_work_cost as mwc
 from storage_manager import models as m
 from storage_manager import storage_action as action
 from storage_manager import storage_chain as chain
+from storage_manager import storage_change_tracker as sct
 from storage_manager import storage_query as query
 from storage_manager import storage_reference_manager as srm
 from storage_manager import storage_tree as tree
 
 _logger = xlogging.getLogger(__name__)
 
+_active_host_snapshot_caches = weakref.WeakSet()
+_active_host_snapshot_caches_locker = threading.Lock()
+
 
 class RecyclingWorkBase(abc.ABC):
-    """回收作业基类"""
+    """回收作业基类
+
+    remark：
+        storage_action 为执行实际IO的模块，由 StorageCollection 指定
+    """
+
+    storage_action = action
 
     def __init__(self):
         super(RecyclingWorkBase, self).__init__()
@@ -73,12 +89,16 @@ class DeleteFileWork(DeleteWork):
         支持删除 qcow 与 cdp 文件
     """
 
-    def __init__(self, storage_obj):
+    def __init__(self, storage_obj, live_storage_count):
+        """
+        :param live_storage_count:
+            该文件中未回收的快照存储数量，由调用者通过 live_storage_count_by_image_paths 批量获取
+        """
         super(DeleteFileWork, self).__init__(storage_obj)
+        assert live_storage_count == 0
         self.storage_objs = (m.DiskSnapshotStorage.objects
                              .filter(image_path=self.file_path)
                              .exclude(storage_status=m.DiskSnapshotStorage.RECYCLED))
-        assert self.storage_objs.exclude(storage_status=m.DiskSnapshotStorage.RECYCLING).count() == 0
 
     def __str__(self):
         return f'delete_file_work:<{self.file_path}>'
@@ -94,9 +114,9 @@ class DeleteFileWork(DeleteWork):
         @xfunctions.convert_exception_to_value(False, self.warn)
         def _work():
             if self.storage_obj.is_cdp_file:
-                action.remove_cdp_file(self.file_path)
+                self.storage_action.remove_cdp_file(self.file_path)
             else:
-                action.remove_qcow_file(self.file_path)
+                self.storage_action.remove_qcow_file(self.file_path)
             return True
 
         self.work_successful = _work()
@@ -139,7 +159,7 @@ class DeleteQcowSnapshotWork(DeleteWork):
     def work(self):
         @xfunctions.convert_exception_to_value(False, self.warn)
         def _work():
-            action.delete_qcow_snapshot(self.file_path, self.snapshot_name)
+            self.storage_action.delete_qcow_snapshot(self.file_path, self.snapshot_name)
             return True
 
         self.work_successful = _work()
@@ -227,8 +247,8 @@ class MergeCdpWork(MergeWork):
     def _create_rw_chain(self, storage_tree):
         rw_chain = query.StorageChainQueryByDiskSnapshotStorage(
             chain.StorageChainForRW, storage_tree, srm.StorageReferenceManager.get_storage_reference_manager(),
-            self.parent_storage_obj, None, str(self)
-        ).get_storage_chain()
+            self.parent_storage_obj, None, str(self), clc.ChainLayoutCache.get_chain_layout_cache()
+        ).get_storage_chain()  # 复用父节点已缓存的布局，追加新节点时增量计算
         rw_chain.insert_tail(self.new_storage_obj)
         return rw_chain.acquire()
 
@@ -289,7 +309,7 @@ class MergeCdpWork(MergeWork):
     def work(self):
         @xfunctions.convert_exception_to_value(False, self.warn)
         def _work():
-            action.merge_cdp_to_qcow(
+            self.storage_action.merge_cdp_to_qcow(
                 self.parent_storage_obj.storage_root.hash_type, self.rw_chain, self.merge_cdp_snapshot_storage_objs)
             self.new_storage_obj.set_storage_status(m.DiskSnapshotStorage.STORAGE)
             return True
@@ -351,8 +371,9 @@ class MergeQcowSnapshotTypeAWork(MergeWork):
     def work(self):
         @xfunctions.convert_exception_to_value(False, self.warn)
         def _work():
-            action.merge_qcow_snapshot_type_a(self.merge_storage_obj.storage_root.hash_type,
-                                              self.children_snapshot_storage_objs, self.merge_storage_obj)
+            self.storage_action.merge_qcow_snapshot_type_a(
+                self.merge_storage_obj.storage_root.hash_type, self.children_snapshot_storage_objs,
+                self.merge_storage_obj)
             return True
 
         self.work_successful = _work()
@@ -390,8 +411,8 @@ class MergeQcowSnapshotTypeBWork(MergeWork):
     def _create_write_chain(self, storage_tree):
         write_chain = query.StorageChainQueryByDiskSnapshotStorage(
             chain.StorageChainForWrite, storage_tree, srm.StorageReferenceManager.get_storage_reference_manager(),
-            self.parent_storage_obj, None, str(self)
-        ).get_storage_chain()
+            self.parent_storage_obj, None, str(self), clc.ChainLayoutCache.get_chain_layout_cache()
+        ).get_storage_chain()  # 复用父节点已缓存的布局，追加新节点时增量计算
         write_chain.insert_tail(self.new_storage_obj)
         return write_chain.acquire()
 
@@ -446,7 +467,7 @@ class MergeQcowSnapshotTypeBWork(MergeWork):
     def work(self):
         @xfunctions.convert_exception_to_value(False, self.warn)
         def _work():
-            action.merge_qcow_snapshot_type_b(
+            self.storage_action.merge_qcow_snapshot_type_b(
                 self.merge_storage_obj.storage_root.hash_type, self.write_chain, self.merge_storage_obj)
             self.new_storage_obj.set_storage_status(m.DiskSnapshotStorage.STORAGE)
             return True
@@ -469,10 +490,47 @@ class MergeQcowSnapshotTypeBWork(MergeWork):
         info_list.append(f'  merge_storage_obj  : {self.merge_storage_obj}')
 
 
+class LocatorHostSnapshots(object):
+    """某 locator 关联的主机快照
+
+    :remark:
+        有效的主机快照存放在时间范围索引中，主机快照失效时增量更新索引
+    """
+
+    def __init__(self, host_snapshot_objs):
+        self.host_snapshot_objs = list(host_snapshot_objs)
+        self._index = hsi.HostSnapshotIntervalIndex(
+            (o.id, o.host_snapshot_begin_timestamp, o.host_snapshot_end_timestamp, o.is_cdp_host_snapshot)
+            for o in self.host_snapshot_objs if o.host_snapshot_valid
+        )
+
+    def invalidate(self, host_snapshot_id) -> bool:
+        return self._index.remove(host_snapshot_id)
+
+    @property
+    def has_valid_cdp(self) -> bool:
+        return self._index.has_cdp
+
+    def is_any_valid_overlap(self, begin_timestamp, end_timestamp) -> bool:
+        """是否有有效的主机快照与 [begin_timestamp, end_timestamp] 有重叠"""
+        return self._index.is_any_overlap(begin_timestamp, end_timestamp)
+
+
 class QueryHostSnapshotObjsByLocatorWithCache(object):
+    """通过 locator 查询主机快照（带缓存）
+
+    :remark:
+        进入上下文时，使用一次关联查询预取该 root 中所有 locator 的主机快照，之后的判断均在内存中完成
+        预取后才出现的 locator 会单独查询一次，并加入缓存
+        上下文有效期间，主机快照通过 HostSnapshot.set_invalid 失效时，缓存会被增量更新
+    """
+
     def __init__(self, storage_root_ident):
         self.name = f'QueryHostSnapshotsByLocatorWithCache:{storage_root_ident}'
+        self.storage_root_ident = storage_root_ident
         self._valid = False
+        self._locator_cache = dict()
+        self._locator_cache_locker = threading.Lock()
 
     def __str__(self):  # pragma: no cover
         return self.name
@@ -482,25 +540,64 @@ class QueryHostSnapshotObjsByLocatorWithCache(object):
 
     def __enter__(self):
         self._valid = True
+        with _active_host_snapshot_caches_locker:
+            _active_host_snapshot_caches.add(self)
+        self._prefetch()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         _ = exc_type
         _ = exc_val
         _ = exc_tb
+        with _active_host_snapshot_caches_locker:
+            _active_host_snapshot_caches.discard(self)
         self._valid = False
-        self.query.cache_clear()
+        self._locator_cache = dict()
+
+    def _prefetch(self):
+        locator_ids = (m.DiskSnapshotStorage.objects
+                       .filter(storage_root__root_uuid=self.storage_root_ident, locator__isnull=False)
+                       .exclude(storage_status=m.DiskSnapshotStorage.RECYCLED)
+                       .values('locator_id'))
+
+        host_snapshot_objs_dict = dict()
+        for disk_snapshot_obj in (m.DiskSnapshot.objects
+                                  .filter(locator_id__in=locator_ids)
+                                  .select_related('host_snapshot')):
+            host_snapshot_obj = disk_snapshot_obj.host_snapshot
+            host_snapshot_objs_dict.setdefault(disk_snapshot_obj.locator_id, dict())[host_snapshot_obj.id] = (
+                host_snapshot_obj)
+
+        with self._locator_cache_locker:
+            self._locator_cache = {
+                locator_id: LocatorHostSnapshots(objs.values()) for locator_id, objs in host_snapshot_objs_dict.items()
+            }
+
+    def get(self, locator_id) -> LocatorHostSnapshots:
+        assert self._valid
+        with self._locator_cache_locker:
+            locator_host_snapshots = self._locator_cache.get(locator_id, None)
+        if locator_host_snapshots is None:
+            locator_host_snapshots = LocatorHostSnapshots(
+                m.HostSnapshot.objects.filter(disk_snapshots__locator_id=locator_id).distinct())
+            with self._locator_cache_locker:
+                locator_host_snapshots = self._locator_cache.setdefault(locator_id, locator_host_snapshots)
+        return locator_host_snapshots
+
+    def invalidate_host_snapshot(self, host_snapshot_id):
+        with self._locator_cache_locker:
+            for locator_host_snapshots in self._locator_cache.values():
+                locator_host_snapshots.invalidate(host_snapshot_id)
 
-    @lru_cache()
     def query(self, locator_id):
-        assert self._valid
-        return m.HostSnapshot.objects.filter(disk_snapshots__locator_id=locator_id).all()
+        return self.get(locator_id).host_snapshot_objs
 
 
 class StorageCollection(object):
     """快照存储回收逻辑"""
 
-    def __init__(self, storage_root_obj, storage_reference_manager, storage_locker_manager):
+    def __init__(self, storage_root_obj, storage_reference_manager, storage_locker_manager,
+                 track_changes=False, merge_io_budget_bytes=0, storage_action=action):
         """
         :param storage_root_obj:
             存储镜像依赖树标识
@@ -508,11 +605,21 @@ class StorageCollection(object):
             引用管理器
         :param storage_locker_manager: StorageLockerManager
             存储镜像锁管理器
+        :param track_changes:
+            是否使用快照存储变更跟踪器（全局单例，接收所有变更事件），为 False 时每轮回收都分析整棵树
+        :param merge_io_budget_bytes:
+            每轮回收中合并作业可搬迁的数据量，为 0 时每轮仅执行一个合并作业
+        :param storage_action:
+            回收作业执行实际IO时使用的对象，接口参考 storage_action 模块，默认为该模块
         """
         self.name = f'storage_collection:[{storage_root_obj.root_ident}]'
         self.storage_root_obj = storage_root_obj
         self.storage_reference_manager = storage_reference_manager
         self.storage_locker_manager = storage_locker_manager
+        self.storage_change_tracker = (
+            sct.StorageChangeTracker.get_storage_change_tracker() if track_changes else None)
+        self.merge_work_scheduler = mwc.MergeWorkScheduler(merge_io_budget_bytes)
+        self.storage_action = storage_action
 
     def __str__(self):
         return self.name
@@ -532,6 +639,9 @@ class StorageCollection(object):
         assert self.storage_root_obj.root_valid
         assert self.storage_root_obj.hash_type != m.DiskSnapshotStorageRoot.ROOT_HASH_TYPE_UNKNOWN
 
+        if self.storage_change_tracker and not self.storage_change_tracker.is_root_dirty(self.storage_root_obj.id):
+            return False  # 自上一轮分析以来没有变更
+
         if self.storage_root_obj.is_recycle_root:
             works = self._analyze_recycle_root()
         else:
@@ -540,6 +650,7 @@ class StorageCollection(object):
 
         if works:
             for work in works:
+                work.storage_action = self.storage_action
                 work.work()
             return self._save_works_result(works)
         else:
@@ -553,8 +664,24 @@ class StorageCollection(object):
                     work_successful = True
         return work_successful
 
+    def _pop_dirty_storage_ids(self):
+        """取出本轮需要分析的变更快照存储，返回 None 时意为分析整棵树"""
+        if self.storage_change_tracker:
+            return self.storage_change_tracker.pop_dirty_storage_ids(self.storage_root_obj.id)
+        return None
+
+    def _restore_dirty_storage_ids(self, dirty_storage_ids):
+        """将取出的变更快照存储放回，下一轮继续分析"""
+        if not self.storage_change_tracker:
+            return
+        if dirty_storage_ids is None:
+            self.storage_change_tracker.mark_root_dirty(self.storage_root_obj.id)
+        else:
+            self.storage_change_tracker.mark_storages_dirty(self.storage_root_obj.id, dirty_storage_ids)
+
     def _analyze_recycle_root(self) -> list:
         with self.storage_locker_manager.get_locker(self.storage_root_obj.root_ident, self.name), transaction.atomic():
+            self._pop_dirty_storage_ids()  # 回收 root 中的快照存储都需要删除，总是分析全部
             delete_storage_objs = list()
 
             for storage_obj in m.DiskSnapshotStorage.valid_storage_objs(self.storage_root_obj).all():
@@ -568,81 +695,157 @@ class StorageCollection(object):
 
         :remark:
             为了优化性能，禁止使用ORM对象去查找父与子，改为使用Node对象查找
+            使用变更跟踪器时，仅分析受变更影响的节点
         """
         with self.storage_locker_manager.get_locker(self.storage_root_obj.root_ident, self.name), transaction.atomic():
-            storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(self.storage_root_obj)
-            if storage_tree.is_empty():
-                self.storage_root_obj.set_invalid()
-                return list()
+            dirty_storage_ids = self._pop_dirty_storage_ids()
+            try:
+                works = self._analyze_storage_tree(query_host_snapshots, dirty_storage_ids)
+            except Exception:
+                self._restore_dirty_storage_ids(None)
+                raise
+            if works:
+                # 每轮仅生成部分作业，未分析到的节点需要下一轮继续分析
+                self._restore_dirty_storage_ids(dirty_storage_ids)
+            return works
+
+    def _analyze_storage_tree(self, query_host_snapshots, dirty_storage_ids) -> list:
+        storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(self.storage_root_obj)
+        if storage_tree.is_empty():
+            self.storage_root_obj.set_invalid()
+            return list()
+
+        if dirty_storage_ids is None:
+            affected_nodes = None  # 分析整棵树
+        else:
+            affected_nodes = storage_tree.get_affected_nodes(dirty_storage_ids)
 
-            delete_storage_objs = self._fetch_and_mark_delete_storage_objs(storage_tree, query_host_snapshots)
-            if delete_storage_objs:
-                return self._create_delete_works(delete_storage_objs)  # 生成删除作业
+        delete_storage_objs = self._fetch_and_mark_delete_storage_objs(
+            storage_tree, query_host_snapshots, affected_nodes)
+        if delete_storage_objs:
+            return self._create_delete_works(delete_storage_objs)  # 生成删除作业
 
-            for node in storage_tree.nodes_by_bfs:
-                # 从根向叶子做广度优先遍历，找到可回收的快照存储
-                if node.is_root and len(node.children) > 1:
-                    continue  # 不支持：此时如果合并，那么快照树会分裂为两棵树
+        candidates = self._fetch_merge_candidates(storage_tree, query_host_snapshots, affected_nodes)
+        return [candidate.create_work() for candidate in self.merge_work_scheduler.select(candidates)]
 
-                if node.is_leaf:
-                    continue  # 不支持：当前节点为叶子，应该走删除逻辑，而非回收逻辑
+    def _fetch_merge_candidates(self, storage_tree, query_host_snapshots, affected_nodes) -> list:
+        """获取所有可生成合并作业的候选项
 
-                storage_obj = node.storage_obj
+        :remark:
+            此时不修改快照存储的状态，候选项被调度后才标记为回收中
+        """
+        candidates = list()
 
-                if storage_obj.file_level_deduplication:
-                    # 逻辑为 not storage_obj.is_cdp_file and storage_obj.file_level_deduplication
-                    # 不支持：带有文件级去重
-                    continue
+        for node in storage_tree.nodes_by_bfs:
+            # 从根向叶子做广度优先遍历，找到可回收的快照存储
+            if affected_nodes is not None and node not in affected_nodes:
+                continue  # 自上一轮分析以来没有受到变更影响
 
-                if not self._can_disk_snapshot_storage_merge(
-                        storage_obj, query_host_snapshots, node, self._get_parent_storage_obj_by_node(node)):
-                    continue
+            if node.is_root and len(node.children) > 1:
+                continue  # 不支持：此时如果合并，那么快照树会分裂为两棵树
+
+            if node.is_leaf:
+                continue  # 不支持：当前节点为叶子，应该走删除逻辑，而非回收逻辑
+
+            storage_obj = node.storage_obj
 
-                if storage_obj.is_cdp_file:
-                    merge_cdp_snapshot_storage_objs = self._fetch_and_mark_merge_cdp_snapshot_storage_objs(
-                        query_host_snapshots, node)
-                    if merge_cdp_snapshot_storage_objs:
-                        return [
-                            MergeCdpWork(
-                                node.parent.storage_obj, merge_cdp_snapshot_storage_objs,
-                                [n.storage_obj for n in node.children], storage_tree),
-                        ]
-                elif self._is_children_in_other_file(node):
-                    if node.is_root:
-                        continue  # 不支持：没有父快照
-                    elif node.parent.storage_obj.is_cdp_file:
-                        continue  # 不支持：父快照是CDP文件
-                    elif node.parent.storage_obj.disk_bytes != storage_obj.disk_bytes:
-                        continue  # 不支持：虚拟磁盘大小不一致
-                    elif node.parent.storage_obj.storage_status != m.DiskSnapshotStorage.STORAGE:
-                        continue  # 不支持：父快照处于改写中的状态
-                    elif self._is_multi_snapshot_in_the_qcow(node):
-                        continue  # 不支持：还有其他快照点在该qcow
-                    elif self.storage_reference_manager.is_storage_writing(node.parent.storage_obj.image_path):
-                        continue  # 不支持：父快照的文件正在写入中
-                    else:
-                        self._set_status_to_recycling(storage_obj)
-                        return [
-                            MergeQcowSnapshotTypeBWork(
-                                node.parent.storage_obj, storage_obj, [n.storage_obj for n in node.children],
-                                storage_tree),
-                        ]
-                elif self.storage_reference_manager.is_storage_writing(node.storage_obj.image_path):
-                    continue  # 不支持：该快照的文件正在写入中
+            if storage_obj.file_level_deduplication:
+                # 逻辑为 not storage_obj.is_cdp_file and storage_obj.file_level_deduplication
+                # 不支持：带有文件级去重
+                continue
+
+            if not self._can_disk_snapshot_storage_merge(
+                    storage_obj, query_host_snapshots, node, self._get_parent_storage_obj_by_node(node)):
+                continue
+
+            if storage_obj.is_cdp_file:
+                merge_cdp_nodes = self._fetch_merge_cdp_snapshot_storage_nodes(query_host_snapshots, node)
+                if merge_cdp_nodes:
+                    candidates.append(self._create_merge_cdp_candidate(storage_tree, node, merge_cdp_nodes))
+            elif self._is_children_in_other_file(node):
+                if node.is_root:
+                    continue  # 不支持：没有父快照
+                elif node.parent.storage_obj.is_cdp_file:
+                    continue  # 不支持：父快照是CDP文件
+                elif node.parent.storage_obj.disk_bytes != storage_obj.disk_bytes:
+                    continue  # 不支持：虚拟磁盘大小不一致
+                elif node.parent.storage_obj.storage_status != m.DiskSnapshotStorage.STORAGE:
+                    continue  # 不支持：父快照处于改写中的状态
+                elif self._is_multi_snapshot_in_the_qcow(node):
+                    continue  # 不支持：还有其他快照点在该qcow
+                elif self.storage_reference_manager.is_storage_writing(node.parent.storage_obj.image_path):
+                    continue  # 不支持：父快照的文件正在写入中
                 else:
-                    self._set_status_to_recycling(storage_obj)
-                    return [
-                        MergeQcowSnapshotTypeAWork(
-                            self._get_parent_storage_obj_by_node(node),
-                            storage_obj,
-                            [n.storage_obj for n in node.children]),
-                    ]
+                    candidates.append(self._create_merge_qcow_snapshot_type_b_candidate(storage_tree, node))
+            elif self.storage_reference_manager.is_storage_writing(node.storage_obj.image_path):
+                continue  # 不支持：该快照的文件正在写入中
+            else:
+                candidates.append(self._create_merge_qcow_snapshot_type_a_candidate(node))
+
+        return candidates
+
+    def _create_merge_cdp_candidate(self, storage_tree, node, merge_cdp_nodes):
+        merge_cdp_snapshot_storage_objs = [n.storage_obj for n in merge_cdp_nodes]
+        parent_storage_obj = node.parent.storage_obj
+        children_snapshot_storage_objs = [n.storage_obj for n in node.children]
+
+        def _create_work():
+            for merge_storage_obj in merge_cdp_snapshot_storage_objs:
+                self._set_status_to_recycling(merge_storage_obj)
+            return MergeCdpWork(
+                parent_storage_obj, merge_cdp_snapshot_storage_objs, children_snapshot_storage_objs, storage_tree)
+
+        related_nodes = [*merge_cdp_nodes, *node.ancestors, *merge_cdp_nodes[-1].children]
+        return mwc.MergeCandidate(
+            f'merge_cdp:{node.storage_obj}',
+            mwc.estimate_merge_cdp(parent_storage_obj, merge_cdp_snapshot_storage_objs),
+            [n.storage_obj.id for n in related_nodes],
+            [parent_storage_obj.image_path, *[obj.image_path for obj in merge_cdp_snapshot_storage_objs]],
+            _create_work,
+        )
+
+    def _create_merge_qcow_snapshot_type_b_candidate(self, storage_tree, node):
+        storage_obj = node.storage_obj
+        parent_storage_obj = node.parent.storage_obj
+        children_snapshot_storage_objs = [n.storage_obj for n in node.children]
 
-        return list()
+        def _create_work():
+            self._set_status_to_recycling(storage_obj)
+            return MergeQcowSnapshotTypeBWork(
+                parent_storage_obj, storage_obj, children_snapshot_storage_objs, storage_tree)
+
+        related_nodes = [node, *node.ancestors, *node.children]
+        return mwc.MergeCandidate(
+            f'merge_qcow_type_b:{storage_obj}',
+            mwc.estimate_merge_qcow_snapshot_type_b(storage_obj),
+            [n.storage_obj.id for n in related_nodes],
+            [storage_obj.image_path, parent_storage_obj.image_path],
+            _create_work,
+        )
+
+    def _create_merge_qcow_snapshot_type_a_candidate(self, node):
+        storage_obj = node.storage_obj
+        parent_storage_obj = self._get_parent_storage_obj_by_node(node)
+        children_snapshot_storage_objs = [n.storage_obj for n in node.children]
 
-    def _fetch_and_mark_delete_storage_objs(self, storage_tree, query_host_snapshots) -> list:
+        def _create_work():
+            self._set_status_to_recycling(storage_obj)
+            return MergeQcowSnapshotTypeAWork(parent_storage_obj, storage_obj, children_snapshot_storage_objs)
+
+        related_nodes = [node, *node.children] if node.is_root else [node, node.parent, *node.children]
+        return mwc.MergeCandidate(
+            f'merge_qcow_type_a:{storage_obj}',
+            mwc.estimate_merge_qcow_snapshot_type_a(storage_obj),
+            [n.storage_obj.id for n in related_nodes],
+            [storage_obj.image_path],
+            _create_work,
+        )
+
+    def _fetch_and_mark_delete_storage_objs(self, storage_tree, query_host_snapshots, affected_nodes=None) -> list:
         delete_storage_objs = list()
         for leaf in storage_tree.leaves:
+            if affected_nodes is not None and leaf not in affected_nodes:
+                continue  # 自上一轮分析以来没有受到变更影响
             # 从叶子向根深度优先遍历，找到可以直接删除的快照存储
             for node in tree.dfs_to_root(leaf):
                 storage_obj = node.storage_obj
@@ -653,8 +856,8 @@ class StorageCollection(object):
                     break
         return delete_storage_objs
 
-    def _fetch_and_mark_merge_cdp_snapshot_storage_objs(self, query_host_snapshots, node) -> list:
-        merge_cdp_snapshot_storage_objs = list()
+    def _fetch_merge_cdp_snapshot_storage_nodes(self, query_host_snapshots, node) -> list:
+        merge_cdp_nodes = list()
         current_node = node
 
         while True:
@@ -671,8 +874,7 @@ class StorageCollection(object):
                     and self.storage_reference_manager.is_storage_writing(parent_storage_obj.image_path)):
                 break  # 如果父快照存储正在写入中，那么就不进入回收流程
 
-            self._set_status_to_recycling(storage_obj)
-            merge_cdp_snapshot_storage_objs.append(storage_obj)
+            merge_cdp_nodes.append(current_node)
 
             current_node = self._get_child_node_with_cdp_disk_snapshot_storage(current_node)
             if current_node is None:
@@ -682,7 +884,7 @@ class StorageCollection(object):
             if not self._can_disk_snapshot_storage_merge(current_node.storage_obj, query_host_snapshots, node):
                 break
 
-        return merge_cdp_snapshot_storage_objs
+        return merge_cdp_nodes
 
     @staticmethod
     def _set_status_to_recycling(storage_obj):
@@ -695,25 +897,23 @@ class StorageCollection(object):
         if not storage_obj.locator_id:
             return True
 
-        for host_snapshot_obj in query_host_snapshots.query(storage_obj.locator_id):
-            if not host_snapshot_obj.host_snapshot_valid:
-                continue
+        locator_host_snapshots = query_host_snapshots.get(storage_obj.locator_id)
+
+        # 判断storage是否在有效的host snapshot的描述范围内
+        if locator_host_snapshots.is_any_valid_overlap(
+                storage_obj.storage_begin_timestamp, storage_obj.storage_end_timestamp):
+            return False
 
-            # 判断storage是否在host snapshot的描述范围内
-            if not (storage_obj.storage_begin_timestamp > host_snapshot_obj.host_snapshot_end_timestamp
-                    or storage_obj.storage_end_timestamp < host_snapshot_obj.host_snapshot_begin_timestamp):
+        # 这里特别处理 cdp host snapshot 描述范围不包含 storage， 但 storage 又没有同 locator 的子。
+        # 在CDP备份时，目标机多块磁盘，其中某块磁盘几乎没有写入的情况下，可能出现
+        if locator_host_snapshots.has_valid_cdp:
+            for child_node in node.children:
+                if child_node.storage_obj.locator_id == storage_obj.locator_id:
+                    break
+            else:
                 return False
 
-            # 这里特别处理 cdp host snapshot 描述范围不包含 storage， 但 storage 又没有同 locator 的子。
-            # 在CDP备份时，目标机多块磁盘，其中某块磁盘几乎没有写入的情况下，可能出现
-            if host_snapshot_obj.host_snapshot_type == m.HostSnapshot.CDP:
-                for child_node in node.children:
-                    if child_node.storage_obj.locator_id == storage_obj.locator_id:
-                        break
-                else:
-                    return False
-        else:
-            return True
+        return True
 
     def _can_disk_snapshot_storage_delete(self, storage_obj, node, query_host_snapshots) -> bool:
         if storage_obj.storage_status not in m.DiskSnapshotStorage.STATUS_CAN_DELETE:
@@ -750,26 +950,26 @@ class StorageCollection(object):
 
     @staticmethod
     def _create_delete_works(deleting_storage_obj_list) -> list:
-        works = list()
+        """生成删除作业
+
+        :remark:
+            各文件中未回收的快照存储数量通过一次分组查询获取，避免在锁空间内逐个文件查询数据库
+        """
+        works = dict()  # key 为 worker_ident，用于去除重复作业
 
         def insert_work(_work):
-            if _work not in works:
-                works.append(_work)
+            works.setdefault(_work.worker_ident, _work)
+
+        live_storage_count_dict = m.DiskSnapshotStorage.live_storage_count_by_image_paths(
+            [storage_obj.image_path for storage_obj in deleting_storage_obj_list])
 
         for storage_obj in deleting_storage_obj_list:
-            if storage_obj.is_cdp_file:
-                insert_work(DeleteFileWork(storage_obj))
+            live_storage_count = live_storage_count_dict.get(storage_obj.image_path, 0)
+            if (not storage_obj.is_cdp_file) and live_storage_count:
+                insert_work(DeleteQcowSnapshotWork(storage_obj))
             else:
-                image_path = storage_obj.image_path
-                valid_snapshot_cnt = (m.DiskSnapshotStorage.objects
-                                      .filter(image_path=image_path)
-                                      .exclude(storage_status__in=m.DiskSnapshotStorage.STATUS_RECYCLE).count()
-                                      )
-                if valid_snapshot_cnt:
-                    insert_work(DeleteQcowSnapshotWork(storage_obj))
-                else:
-                    insert_work(DeleteFileWork(storage_obj))
-        return works
+                insert_work(DeleteFileWork(storage_obj, live_storage_count))
+        return list(works.values())
 
     def _can_disk_snapshot_storage_merge(
             self, storage_obj, query_host_snapshots, node, parent_storage_obj=None) -> bool:
@@ -817,3 +1017,17 @@ class StorageCollection(object):
     @staticmethod
     def _get_parent_storage_obj_by_node(node):
         return None if node.is_root else node.parent.storage_obj
+
+
+@receiver(post_save, sender=m.HostSnapshot)
+def host_snapshot_post_save(sender, instance, **kwargs):
+    _ = sender
+    _ = kwargs
+    host_snapshot_obj = instance
+    if host_snapshot_obj.host_snapshot_valid:
+        return
+
+    with _active_host_snapshot_caches_locker:
+        caches = list(_active_host_snapshot_caches)
+    for cache in caches:
+        cache.invalidate_host_snapshot(host_snapshot_obj.id)
@@ -0,0 +1,130 @@
+import uuid
+
+from basic_library import xdata
+from basic_library import xlogging
+from storage_manager import hash_file
+from storage_manager import models as m
+from storage_manager import storage_chain as chain
+from storage_manager import storage_query as query
+from storage_manager import storage_tree as tree
+
+_logger = xlogging.getLogger(__name__)
+
+
+class StorageBlockDiffQuery(object):
+    """查询同一快照存储树中两个快照存储之间发生变更的磁盘区间
+
+    :remark:
+        支持增量复制、数据校验等业务，无需读取整个镜像
+        两者都有全量hash时，比较全量hash；否则合并两者之间依赖路径上所有快照存储的增量hash
+        查询期间持有两个快照存储的读取链，保证依赖路径上的文件不被回收
+        hash文件布局核对前不可用，参考 hash_file.HASH_FILE_FORMAT_VERIFIED
+    """
+
+    def __init__(self, storage_locker_manager, storage_reference_manager, src_storage_ident: str,
+                 dst_storage_ident: str):
+        """
+        :param storage_locker_manager: StorageLockerManager
+            快照存储锁管理器
+        :param storage_reference_manager: StorageReferenceManager
+            快照存储引用管理器
+        :param src_storage_ident:
+            源快照存储标识
+        :param dst_storage_ident:
+            目标快照存储标识
+        """
+        self.storage_locker_manager = storage_locker_manager
+        self.storage_reference_manager = storage_reference_manager
+        self.src_storage_ident = src_storage_ident
+        self.dst_storage_ident = dst_storage_ident
+        self._uuid_hex = uuid.uuid4().hex  # 对象唯一标识
+        self.name = f'{self} {self._uuid_hex}'
+
+    def __str__(self):
+        return f'query block diff : <{self.src_storage_ident}|{self.dst_storage_ident}>'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def iter_changed_ranges(self):
+        """流式返回发生变更的磁盘区间
+
+        :return:
+            生成器，元素为 (字节偏移, 字节长度)，按偏移排序，相邻区间已合并
+        :raises:
+            xdata.DiskSnapshotStorageInvalid
+                快照存储不可用，或者不支持比较，或者hash文件布局未经核对
+        """
+        hash_file.check_format_verified(f'{self}', xdata.DiskSnapshotStorageInvalid)
+        chains = list()
+        try:
+            disk_bytes, plan = self._prepare(chains)
+            if plan[0] == 'full_hash':
+                yield from hash_file.iter_changed_ranges_by_full_hash(plan[1], plan[2], disk_bytes)
+            else:
+                yield from hash_file.iter_written_ranges(plan[1], disk_bytes)
+        finally:
+            for _chain in chains:
+                _chain.release()
+
+    def _prepare(self, chains):
+        src_storage_obj = self._get_storage_obj(self.src_storage_ident)
+        dst_storage_obj = self._get_storage_obj(self.dst_storage_ident)
+        if src_storage_obj.storage_root_id != dst_storage_obj.storage_root_id:
+            self._raise_invalid(f'not in same root : {src_storage_obj} {dst_storage_obj}')
+        if src_storage_obj.disk_bytes != dst_storage_obj.disk_bytes:
+            self._raise_invalid(f'disk_bytes not equal : {src_storage_obj} {dst_storage_obj}')
+        storage_root_obj = src_storage_obj.storage_root
+        if storage_root_obj.hash_type == m.DiskSnapshotStorageRoot.ROOT_HASH_TYPE_NONE:
+            self._raise_invalid(f'{storage_root_obj} without hash')
+
+        with self.storage_locker_manager.get_locker(storage_root_obj.root_ident, self.name):
+            src_storage_obj.refresh_from_db()  # 进入锁空间后更新数据库对象
+            dst_storage_obj.refresh_from_db()
+
+            storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(storage_root_obj)
+            assert not storage_tree.is_empty()
+
+            for storage_obj in (src_storage_obj, dst_storage_obj,):
+                chains.append(query.StorageChainQueryByDiskSnapshotStorage(
+                    chain.StorageChainForRead, storage_tree, self.storage_reference_manager,
+                    storage_obj, None, self.name).get_storage_chain())
+                chains[-1].acquire()
+
+            src_node = storage_tree.get_node_by_storage_obj(src_storage_obj)
+            dst_node = storage_tree.get_node_by_storage_obj(dst_storage_obj)
+
+        if src_storage_obj.full_hash_path and dst_storage_obj.full_hash_path:
+            return src_storage_obj.disk_bytes, ('full_hash', src_storage_obj.full_hash_path,
+                                                dst_storage_obj.full_hash_path)
+        return src_storage_obj.disk_bytes, ('inc_hash', self._get_inc_hash_paths_between(src_node, dst_node))
+
+    @staticmethod
+    def _get_storage_obj(storage_ident):
+        try:
+            return m.DiskSnapshotStorage.objects.get(disk_snapshot_storage_ident=storage_ident)
+        except m.DiskSnapshotStorage.DoesNotExist:
+            xlogging.raise_and_logging_error(
+                '指定的备份已被标识为不可用', f'invalid DiskSnapshotStorage {storage_ident}',
+                print_args=False, exception_class=xdata.DiskSnapshotStorageInvalid)
+
+    def _raise_invalid(self, debug):
+        xlogging.raise_and_logging_error(
+            '不支持比较指定的备份', f'{self} {debug}', print_args=False,
+            exception_class=xdata.DiskSnapshotStorageInvalid)
+
+    def _get_inc_hash_paths_between(self, src_node, dst_node) -> list:
+        """两个节点到最近公共祖先的路径上（不含公共祖先）所有快照存储的增量hash"""
+        src_path = list(tree.dfs_to_root(src_node))
+        dst_path = list(tree.dfs_to_root(dst_node))
+        common_nodes = set(src_path) & set(dst_path)
+
+        inc_hash_paths = list()
+        for node in src_path + dst_path:
+            if node in common_nodes:
+                continue
+            storage_obj = node.storage_obj
+            if storage_obj.is_cdp_file or not storage_obj.inc_hash_path:
+                self._raise_invalid(f'{storage_obj} without inc hash')
+            inc_hash_paths.append(storage_obj.inc_hash_path)
+        return inc_hash_paths
@@ -19,7 +19,8 @@ class StorageChainQueryByHostSnapshot(object):
     """
 
     def __init__(self, storage_locker_manager, storage_reference_manager,
-                 host_snapshot_ident: str, timestamp: decimal.Decimal = None):
+                 host_snapshot_ident: str, timestamp: decimal.Decimal = None, shared_storage_chain_registry=None,
+                 chain_layout_cache=None):
         """
         :param storage_locker_manager: StorageLockerManager
             快照存储锁管理器
@@ -29,11 +30,19 @@ class StorageChainQueryByHostSnapshot(object):
             主机快照标识字符串
         :param timestamp:
             CDP型主机快照有效，指定时刻，当为None时，意为该HostSnapshot最新时刻
+        :param shared_storage_chain_registry: SharedStorageChainRegistry
+            不为None时，返回共享读取链视图，同一快照存储同一时刻的打开共用一个读取链
+        :param chain_layout_cache: ChainLayoutCache
+            不为None时，复用已计算的快照存储链布局，命中时不生成快照存储树
         """
+        assert (shared_storage_chain_registry is None
+                or shared_storage_chain_registry.storage_reference_manager is storage_reference_manager)
         self.storage_locker_manager = storage_locker_manager
         self.storage_reference_manager = storage_reference_manager
         self.host_snapshot_ident = host_snapshot_ident
         self.timestamp = timestamp
+        self.shared_storage_chain_registry = shared_storage_chain_registry
+        self.chain_layout_cache = chain_layout_cache
         self.chain_list = None
         self._uuid_hex = uuid.uuid4().hex  # 对象唯一标识
         self.name = f'{self} {self._uuid_hex}'
@@ -150,12 +159,22 @@ class StorageChainQueryByHostSnapshot(object):
     def _generate_storage_chain(self, storage_root_obj, disk_snapshot_obj, timestamp):
         storage_obj = self._find_storage_obj(disk_snapshot_obj, timestamp)
 
-        storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(storage_root_obj)
-        assert not storage_tree.is_empty()
+        def _generate():
+            if self.chain_layout_cache is None:
+                storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(storage_root_obj)
+                assert not storage_tree.is_empty()
+            else:
+                storage_tree = None  # 未命中缓存时才生成
+
+            return StorageChainQueryByDiskSnapshotStorage(
+                chain.StorageChainForRead, storage_tree, self.storage_reference_manager,
+                storage_obj, timestamp, self.name, self.chain_layout_cache).get_storage_chain()
 
-        storage_chain = StorageChainQueryByDiskSnapshotStorage(
-            chain.StorageChainForRead, storage_tree, self.storage_reference_manager,
-            storage_obj, timestamp, self.name).get_storage_chain()
+        if self.shared_storage_chain_registry is None:
+            storage_chain = _generate()
+        else:  # 已有共用的读取链时，不再生成快照存储树
+            storage_chain = self.shared_storage_chain_registry.create_view(
+                storage_obj.disk_snapshot_storage_ident, timestamp, _generate, self.name)
 
         return storage_chain.acquire()
 
@@ -183,10 +202,10 @@ class StorageChainQueryByDiskSnapshotStorage(object):
 
     def __init__(
             self, storage_chain_class, storage_tree, storage_reference_manager,
-            storage_obj, timestamp: decimal.Decimal = None, caller_name: str = ''):
+            storage_obj, timestamp: decimal.Decimal = None, caller_name: str = '', chain_layout_cache=None):
         """
         :param storage_tree: DiskSnapshotStorageTree
-            快照存储树
+            快照存储树；指定 chain_layout_cache 时可为 None ，未命中缓存时才生成
         :param storage_reference_manager: StorageReferenceManager
             快照存储引用管理器
         :param storage_obj:
@@ -195,17 +214,19 @@ class StorageChainQueryByDiskSnapshotStorage(object):
             CDP型快照存储有效，指定时刻，当为None时，意为该storage的全部区域
         :param caller_name:
             调用者描述
+        :param chain_layout_cache: ChainLayoutCache
+            快照存储链布局缓存，为 None 时不使用缓存
         """
+        assert storage_tree is not None or chain_layout_cache is not None
         self.storage_chain_class = storage_chain_class
         self.storage_tree = storage_tree
         self.storage_reference_manager = storage_reference_manager
         self.storage_obj = storage_obj
         self.timestamp = timestamp if timestamp else self._get_timestamp_from_qcow_storage(storage_obj)
+        self.chain_layout_cache = chain_layout_cache
         self.chain = None
         self._uuid_hex = uuid.uuid4().hex  # 对象唯一标识
         self.name = f'{caller_name} # {self} {self._uuid_hex}' if caller_name else f'{self} {self._uuid_hex}'
-        self.node = self.storage_tree.get_node_by_storage_obj(storage_obj)
-        assert self.node is not None
 
     def __str__(self):
         if self.storage_obj.is_cdp_file:
@@ -250,10 +271,29 @@ class StorageChainQueryByDiskSnapshotStorage(object):
         else:
             pass  # do nothing
 
+    def _get_storage_tree(self):
+        if self.storage_tree is None:
+            self.storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(
+                self.storage_obj.storage_root)
+            assert not self.storage_tree.is_empty()
+        return self.storage_tree
+
     def _generate_storage_chain(self):
         storage_chain = self.storage_chain_class(self.timestamp, self.storage_reference_manager, f'{self.name}')
-
-        for _node in tree.dfs_to_root(self.node):
+        storage_ident = self.storage_obj.disk_snapshot_storage_ident
+
+        if self.chain_layout_cache is not None:
+            layout = self.chain_layout_cache.get(self.storage_obj.storage_root_id, storage_ident, self.timestamp)
+            if layout is not None:
+                storage_chain.set_layout(layout)
+                return storage_chain
+
+        storage_tree = self._get_storage_tree()
+        node = storage_tree.get_node_by_storage_obj(self.storage_obj)
+        assert node is not None
+        for _node in tree.dfs_to_root(node):
             storage_chain.insert_head(_node.storage_obj)
 
+        if self.chain_layout_cache is not None:
+            self.chain_layout_cache.put(storage_tree, storage_ident, self.timestamp, storage_chain.get_layout())
         return storage_chain
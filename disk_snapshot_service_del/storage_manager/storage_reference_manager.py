@@ -5,6 +5,7 @@ from basic_library import rwlock
 from basic_library import xdata
 from basic_library import xfunctions
 from basic_library import xlogging
+from storage_manager import storage_change_tracker as sct
 
 _logger = xlogging.getLogger(__name__)
 
@@ -34,6 +35,8 @@ class StorageReferenceManager(object):
         def __init__(self, storage_info):
             self.storage_ident = storage_info['disk_snapshot_storage_ident']
             self.storage_path = storage_info['image_path']
+            self.storage_id = storage_info.get('id', None)
+            self.storage_root_id = storage_info.get('storage_root', None)
             self.timestamp = xfunctions.current_timestamp()
 
         def __str__(self):
@@ -58,8 +61,11 @@ class StorageReferenceManager(object):
     def remove_reading_record(self, caller_name: str):
         assert caller_name
         with self.rr_locker.gen_wlock():
-            if self.reading_record_dict.pop(caller_name, None):
+            record_list = self.reading_record_dict.pop(caller_name, None)
+            if record_list:
                 self.is_storage_using.cache_clear()
+        if record_list:
+            self._mark_released_storages_dirty(record_list)
 
     def add_writing_record(self, caller_name: str, storage_info: dict):
         assert caller_name
@@ -77,9 +83,20 @@ class StorageReferenceManager(object):
     def remove_writing_record(self, caller_name: str):
         assert caller_name
         with self.wr_locker.gen_wlock():
-            if self.writing_record_dict.pop(caller_name, None):
+            record = self.writing_record_dict.pop(caller_name, None)
+            if record:
                 self.is_storage_using.cache_clear()
                 self.is_storage_writing.cache_clear()
+        if record:
+            self._mark_released_storages_dirty([record, ])
+
+    @staticmethod
+    def _mark_released_storages_dirty(record_list):
+        """引用释放后，快照存储可能变为可回收"""
+        tracker = sct.StorageChangeTracker.get_storage_change_tracker()
+        for record in record_list:
+            if record.storage_root_id:
+                tracker.mark_storages_dirty(record.storage_root_id, (record.storage_id,))
 
     @lru_cache(None)
     def is_storage_using(self, storage_ident):
@@ -24,8 +24,18 @@ class DiskSnapshotStorageTree:
         将关联的快照存储的数据库对象缓存到内存中，提高性能
     """
 
-    def __init__(self, query_set):
+    def __init__(self, query_set, tree_ident=None, generation=None):
+        """
+        :param tree_ident:
+            树标识，为 root 的数据库 id
+        :param generation:
+            读取数据库前 root 的变更代数，参考 DiskSnapshotStorageRoot.storage_generation
+        """
         self.root_node = None
+        self.tree_ident = tree_ident
+        self.generation = generation
+        self._node_dict = dict()
+        self._image_path_nodes = None
         self._init_root(query_set)
 
     def _init_root(self, query_set):
@@ -34,7 +44,7 @@ class DiskSnapshotStorageTree:
         :param query_set:
             QuerySet 有关联的磁盘快照存储的数据库查询对象
         """
-        node_dict = dict()
+        node_dict = self._node_dict
         for db_obj in query_set.all():
             node_dict[db_obj.id] = DiskSnapshotStorageNode(db_obj)
 
@@ -63,15 +73,53 @@ class DiskSnapshotStorageTree:
         for node in LevelOrderIter(self.root_node):  # 广度优先
             yield node
 
+    def get_affected_nodes(self, storage_ids) -> set:
+        """获取受快照存储变更影响的节点
+
+        :remark:
+            节点的可回收性依赖其父节点、兄弟节点与子节点，以及自身与父节点所在文件是否正在写入，所以受影响的节点为：
+            以变更节点的父节点为根的子树，变更节点的所有祖先
+            以及自身或者父节点与变更节点在同一文件中的节点
+        :param storage_ids:
+            发生变更的快照存储数据库 id，不在树中的 id 会被忽略
+        """
+        affected_nodes = set()
+        image_paths = set()
+        for storage_id in storage_ids:
+            node = self._node_dict.get(storage_id, None)
+            if node is None:
+                continue
+            subtree_root = node if node.is_root else node.parent
+            affected_nodes.add(subtree_root)
+            affected_nodes.update(subtree_root.descendants)
+            affected_nodes.update(node.ancestors)
+            image_paths.add(node.storage_obj.image_path)
+
+        for image_path in image_paths:
+            for node in self._get_nodes_by_image_path(image_path):
+                affected_nodes.add(node)
+                affected_nodes.update(node.children)
+        return affected_nodes
+
+    def _get_nodes_by_image_path(self, image_path) -> list:
+        if self._image_path_nodes is None:
+            self._image_path_nodes = dict()
+            for node in self._node_dict.values():
+                self._image_path_nodes.setdefault(node.storage_obj.image_path, list()).append(node)
+        return self._image_path_nodes.get(image_path, list())
+
     def get_node_by_storage_obj(self, storage_obj) -> DiskSnapshotStorageNode:
+        return self.get_node_by_storage_ident(storage_obj.disk_snapshot_storage_ident)
+
+    def get_node_by_storage_ident(self, storage_ident) -> DiskSnapshotStorageNode:
         assert self.root_node is not None
-        return find(
-            self.root_node,
-            lambda node: node.storage_obj.disk_snapshot_storage_ident == storage_obj.disk_snapshot_storage_ident)
+        return find(self.root_node, lambda node: node.storage_obj.disk_snapshot_storage_ident == storage_ident)
 
     @staticmethod
     def create_instance_by_storage_root(storage_root_obj):
-        return DiskSnapshotStorageTree(m.DiskSnapshotStorage.valid_storage_objs(storage_root_obj))
+        generation = m.DiskSnapshotStorageRoot.get_storage_generation(storage_root_obj.id)
+        return DiskSnapshotStorageTree(
+            m.DiskSnapshotStorage.valid_storage_objs(storage_root_obj), storage_root_obj.id, generation)
 
 
 def dfs_to_root(node: DiskSnapshotStorageNode):
@@ -0,0 +1,6 @@
+REM compare chain building with DRF serializer and model_dict converter, data will be rolled back
+
+cd ..
+cd ..
+py -3 manage.py shell -c "from storage_manager.simulation import chain_serialize_benchmark;chain_serialize_benchmark.run()"
+pause
\ No newline at end of file
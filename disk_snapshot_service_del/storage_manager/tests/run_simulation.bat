@@ -0,0 +1,6 @@
+REM run recycling simulation on synthetic trees, data will be rolled back
+
+cd ..
+cd ..
+py -3 manage.py shell -c "from storage_manager.simulation import run;run.run()"
+pause
\ No newline at end of file
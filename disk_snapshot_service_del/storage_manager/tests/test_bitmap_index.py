@@ -0,0 +1,45 @@
+import os
+
+from storage_manager import bitmap_index as bi
+
+
+def test_from_plain_bitmap():
+    data = bytes([0b00000110, 0xff, 0xff, 0b00000001, 0, 0b10000000])
+    bitmap = bi.RunLengthBitmap.from_plain_bitmap(data)
+    assert bitmap.runs == [(1, 2), (8, 17), (47, 1)]
+    assert bitmap.popcount() == 20
+    assert bitmap.to_plain_bitmap(len(data) * 8) == data
+
+
+def test_union_and_intersection():
+    a = bi.RunLengthBitmap([(0, 10), (20, 5)])
+    b = bi.RunLengthBitmap([(5, 10), (25, 5), (100, 1)])
+    c = bi.RunLengthBitmap([(50, 10)])
+
+    assert bi.RunLengthBitmap.union([a, b, c]).runs == [(0, 15), (20, 10), (50, 10), (100, 1)]
+    assert a.intersection(b).runs == [(5, 5)]
+    assert a.intersection(c).popcount() == 0
+
+
+def test_chain_bitmaps(tmp_path):
+    image_path = str(tmp_path / 'a.qcow')
+    with open(f'{image_path}_s1.binmap', 'wb') as f:
+        f.write(bytes([0x0f, 0]))
+    with open(f'{image_path}_s2.binmap', 'wb') as f:
+        f.write(bytes([0x30, 0x01]))
+    with open(f'{image_path}_s3.binmap', 'wb') as f:
+        f.write(bytes([0, 0x03]))
+
+    chain = [{'image_path': image_path, 'disk_snapshot_storage_ident': f's{i}'} for i in range(1, 4)]
+    assert bi.chain_allocated_bytes(chain) == 8 * bi.BITMAP_BLOCK_BYTES
+    assert bi.written_bitmap_since(chain, 's1').runs == [(4, 2), (8, 2)]
+
+    """查询不在镜像旁写入任何文件"""
+    assert sorted(os.listdir(tmp_path)) == [f'a.qcow_s{i}.binmap' for i in range(1, 4)]
+
+    """binmap 被改写后不再使用缓存"""
+    with open(f'{image_path}_s1.binmap', 'wb') as f:
+        f.write(bytes([0xff, 0xff, 0xff]))
+    assert bi.load_snapshot_bitmap(image_path, 's1').runs == [(0, 24)]
+    assert bi.chain_allocated_bytes(chain) == 24 * bi.BITMAP_BLOCK_BYTES
+
@@ -0,0 +1,99 @@
+import pytest
+
+from storage_manager import models as m
+from storage_manager import storage_locker_manager as slm
+from storage_manager import storage_reference_manager as srm
+from storage_manager.api import fetch_hashing_storage as fhs
+from task_manager import task_container as tc
+
+pytestmark = pytest.mark.django_db
+
+
+def _claimer(task_ident):
+    return fhs.FetchHashingStorage(
+        srm.StorageReferenceManager(), slm.StorageLockerManager(), tc.TaskContainer(), task_ident)
+
+
+def _claimed_ids(hashing_tasks):
+    return sorted(
+        m.DiskSnapshotStorage.objects.get(disk_snapshot_storage_ident=hashing_task.storage_ident).id
+        for _, hashing_task in hashing_tasks)
+
+
+def _claim_owner(storage_id):
+    owner = m.DiskSnapshotStorage.objects.get(id=storage_id).hashing_claim_owner
+    if owner is None:
+        return None
+    process_ident, task_ident = owner.split('|')
+    assert process_ident == fhs._PROCESS_CLAIM_IDENT
+    return task_ident
+
+
+def test_claim_lease_between_claimers():
+    """ 不同进程（任务容器）的领取者不会领取到相同的storage """
+    m.DiskSnapshotStorage.objects.filter(id__in=(47, 48,)).update(storage_status=m.DiskSnapshotStorage.HASHING)
+    claimer_a, claimer_b = _claimer('a'), _claimer('b')
+
+    tasks_a = claimer_a._claim_hashing_tasks(2)
+    assert _claimed_ids(tasks_a) == [45, 47]
+    assert (_claim_owner(45), _claim_owner(47), _claim_owner(48)) == ('a', 'a', None)
+
+    tasks_b = claimer_b._claim_hashing_tasks(10)
+    assert _claimed_ids(tasks_b) == [48]
+    assert claimer_b._claim_hashing_tasks(10) == []
+
+    """ 任务释放后，领取记录被清除 """
+    task_ident, _ = tasks_a[0]
+    claimer_a.task_container.remove_task(fhs.HashingTask.TASK_TYPE, task_ident, True)
+    assert _claim_owner(45) is None
+    assert _claimed_ids(claimer_b._claim_hashing_tasks(10)) == [45]
+    assert _claim_owner(45) == 'b'
+
+    """ 领取到期后，可被其他领取者领取；原领取者释放时不会清除新的领取记录 """
+    m.DiskSnapshotStorage.objects.filter(id=47).update(hashing_claim_expire=0)
+    assert _claimed_ids(claimer_b._claim_hashing_tasks(10)) == [47]
+    task_ident, _ = tasks_a[1]
+    claimer_a.task_container.remove_task(fhs.HashingTask.TASK_TYPE, task_ident, True)
+    assert _claim_owner(47) == 'b'
+
+
+def test_claim_owner_unique_per_process(monkeypatch):
+    """ 其他进程中相同 task_ident 的领取者，不会清除本进程的领取记录 """
+    tasks = _claimer('a')._claim_hashing_tasks(1)
+    assert _claimed_ids(tasks) == [45]
+
+    monkeypatch.setattr(fhs, '_PROCESS_CLAIM_IDENT', 'other_process')
+    other = _claimer('a')
+    assert other._claim_hashing_tasks(1) == []
+    hashing_task = fhs.HashingTask(tasks[0][1].storage_ident, None, None, None)
+    hashing_task.claim_owner = other.claim_owner
+    hashing_task.release()
+    assert m.DiskSnapshotStorage.objects.get(id=45).hashing_claim_owner == tasks[0][1].claim_owner
+
+
+def test_fetch_writes_claim(monkeypatch):
+    """ fetch 同样写入领取记录，与 claim 互斥 """
+    monkeypatch.setattr(fhs.HashingTask, 'acquire', lambda self: None)
+    monkeypatch.setattr(fhs.FetchHashingStorage, '_fetch_hashing_and_parent_which_in_same_file',
+                        staticmethod(lambda _chain: {}))
+    fetcher = _claimer('f')
+
+    assert fetcher.fetch() == {}
+    assert _claim_owner(45) == 'f'
+    assert _claimer('c')._claim_hashing_tasks(10) == []
+    assert _claimer('g').fetch() is None
+
+
+def test_renew_claim():
+    claimer = _claimer('a')
+    task_ident, hashing_task = claimer._claim_hashing_tasks(1)[0]
+
+    m.DiskSnapshotStorage.objects.filter(id=45).update(hashing_claim_expire=0)
+    assert claimer.renew_claim(task_ident)
+    assert m.DiskSnapshotStorage.objects.get(id=45).hashing_claim_expire > 0
+    assert claimer._claim_hashing_tasks(1) == []
+
+    """ 领取被其他领取者接管后，续期失败 """
+    m.DiskSnapshotStorage.objects.filter(id=45).update(hashing_claim_owner='other')
+    assert not claimer.renew_claim(task_ident)
+    assert not claimer.renew_claim('not_exist')
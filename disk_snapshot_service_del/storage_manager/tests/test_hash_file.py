@@ -0,0 +1,39 @@
+from storage_manager import hash_file
+
+R = hash_file.HASH_RECORD_BYTES
+B = hash_file.HASH_BLOCK_BYTES
+
+
+def _record(value):
+    return bytes([value]) * R
+
+
+def _write(path, records):
+    with open(path, 'wb') as f:
+        f.write(b''.join(records))
+    return str(path)
+
+
+def test_iter_changed_ranges_by_full_hash(tmp_path):
+    a = _write(tmp_path / 'a.full_hash', [_record(1), _record(2), _record(3), _record(4), _record(5)])
+    b = _write(tmp_path / 'b.full_hash', [_record(1), _record(7), _record(7), _record(4), _record(7)])
+
+    disk_bytes = 4 * B + 100
+    assert list(hash_file.iter_changed_ranges_by_full_hash(a, b, disk_bytes)) == [(B, 2 * B), (4 * B, 100)]
+    assert list(hash_file.iter_changed_ranges_by_full_hash(a, a, disk_bytes)) == []
+
+
+def test_iter_written_ranges(tmp_path):
+    empty = bytes(R)
+    a = _write(tmp_path / 'a.hash', [_record(1), empty, empty, empty])
+    b = _write(tmp_path / 'b.hash', [empty, _record(2), empty])
+    c = _write(tmp_path / 'c.hash', [])
+
+    assert list(hash_file.iter_written_ranges([a, b, c], 4 * B)) == [(0, 2 * B)]
+    assert list(hash_file.iter_written_ranges([c], 4 * B)) == []
+    assert list(hash_file.iter_written_ranges([], 4 * B)) == []
+
+    """跨越多个子段的连续写入被合并为一个区间"""
+    records = 2000
+    d = _write(tmp_path / 'd.hash', [_record(3)] * records)
+    assert list(hash_file.iter_written_ranges([d], records * B)) == [(0, records * B)]
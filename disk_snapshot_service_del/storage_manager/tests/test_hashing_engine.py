@@ -0,0 +1,93 @@
+import os
+import zlib
+
+import pytest
+
+from basic_library import xdata
+from storage_manager import bitmap_index as bi
+from storage_manager import hash_file
+from storage_manager import hashing_engine as he
+
+B = hash_file.HASH_BLOCK_BYTES
+R = hash_file.HASH_RECORD_BYTES
+
+
+def test_md4():
+    for md4 in (he._md4_pure_python, he.md4):
+        assert md4(b'').hex() == '31d6cfe0d16ae931b73c59d7e0c089c0'
+        assert md4(b'abc').hex() == 'a448017aaf21d8525fc10ae87aa6729d'
+        assert md4(b'message digest').hex() == 'd9130a8164549fe818874806e1c7014b'
+        assert md4(b'1234567890' * 8).hex() == 'e33b4ddc9c38f2199c3e7b164fcc0536'
+
+
+def test_block_hash_record():
+    block = os.urandom(B)
+    record = he.block_hash_record(block)
+    assert len(record) == R
+    assert record[16:] == zlib.crc32(block).to_bytes(4, 'little')
+
+
+def _read_records(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return [data[i:i + R] for i in range(0, len(data), R)]
+
+
+def test_hash_storage(tmp_path, monkeypatch):
+    image_path = str(tmp_path / 'a.raw')
+    disk_bytes = 3 * B + 100
+    blocks = [os.urandom(B), os.urandom(B), os.urandom(B), os.urandom(100)]
+    with open(image_path, 'wb') as f:
+        f.write(b''.join(blocks))
+
+    hashing_info = {
+        'disk_bytes': disk_bytes,
+        'storages': [{'image_path': image_path, 'storage_ident': 's1'}],
+        'read_storages': [{'image_path': image_path, 'storage_ident': 's1'}],
+    }
+    reader = he.RawImageReader(image_path, written_bitmap=bi.RunLengthBitmap([(1, 1), (3, 1)]))
+    worker = he.HashingWorker(max_workers=0, batch_bytes=2 * B, allow_slow_md4=True)
+
+    """hash文件布局核对前不可用"""
+    with pytest.raises(xdata.DSSException):
+        worker.hash_storage(hashing_info, reader, True)
+    assert sorted(os.listdir(tmp_path)) == ['a.raw']
+    monkeypatch.setattr(hash_file, 'HASH_FILE_FORMAT_VERIFIED', True)
+
+    full_hash_path = worker.hash_storage(hashing_info, reader, True)
+    assert full_hash_path == f'{image_path}_s1.full_hash'
+    assert _read_records(full_hash_path) == [he.block_hash_record(b) for b in blocks]
+
+    inc_hash_path = worker.hash_storage(hashing_info, reader)
+    assert inc_hash_path == f'{image_path}_s1.hash'
+    assert _read_records(inc_hash_path) == [
+        bytes(R), he.block_hash_record(blocks[1]), bytes(R), he.block_hash_record(blocks[3])]
+
+    """使用进程池计算的结果一致"""
+    pool_hash_path = str(tmp_path / 'pool.full_hash')
+    he.HashingWorker(max_workers=2, batch_bytes=B, allow_slow_md4=True).hash_image(reader, pool_hash_path, True)
+    assert _read_records(pool_hash_path) == _read_records(full_hash_path)
+
+
+def test_hash_image_claim_lost(tmp_path):
+    image_path = str(tmp_path / 'a.raw')
+    with open(image_path, 'wb') as f:
+        f.write(os.urandom(4 * B))
+    reader = he.RawImageReader(image_path)
+    worker = he.HashingWorker(max_workers=0, batch_bytes=B, allow_slow_md4=True)
+    renew_results = [True, True, False]
+
+    with pytest.raises(he.HashingClaimLost):
+        worker.hash_image(reader, str(tmp_path / 'a.hash'), True, lambda: renew_results.pop(0), 0)
+    assert sorted(os.listdir(tmp_path)) == ['a.raw']
+
+    renew_calls = list()
+    worker.hash_image(reader, str(tmp_path / 'a.hash'), True, lambda: renew_calls.append(1) or True, 0)
+    assert len(renew_calls) == 5  # 每个批次一次，替换前一次
+
+
+def test_slow_md4_not_allowed(monkeypatch):
+    monkeypatch.setattr(he, 'md4', he._md4_pure_python)
+    with pytest.raises(xdata.DSSException):
+        he.HashingWorker()
+    he.HashingWorker(allow_slow_md4=True)
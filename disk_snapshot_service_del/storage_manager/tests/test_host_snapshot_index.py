@@ -0,0 +1,58 @@
+from decimal import Decimal
+
+from storage_manager import host_snapshot_index as hsi
+
+
+def _brute_force_overlap(items, begin, end):
+    return any(not (begin > i[2] or end < i[1]) for i in items)
+
+
+def test_empty():
+    index = hsi.HostSnapshotIntervalIndex()
+    assert len(index) == 0
+    assert not index.has_cdp
+    assert not index.is_any_overlap(Decimal('1'), Decimal('2'))
+    assert not index.remove(1)
+
+
+def test_overlap_same_as_brute_force():
+    items = [
+        (1, Decimal('10.5'), Decimal('10.5'), False),
+        (2, Decimal('20'), Decimal('30'), True),
+        (3, Decimal('25'), Decimal('26'), False),
+        (4, Decimal('40'), Decimal('45.000001'), True),
+    ]
+    index = hsi.HostSnapshotIntervalIndex(items)
+    assert len(index) == 4
+    assert index.has_cdp
+
+    points = [Decimal(x) for x in ('0', '10.5', '11', '19.999999', '20', '27', '30', '35', '45.000001', '50')]
+    for begin in points:
+        for end in points:
+            if begin <= end:
+                assert index.is_any_overlap(begin, end) == _brute_force_overlap(items, begin, end), (begin, end)
+
+
+def test_remove_incrementally():
+    index = hsi.HostSnapshotIntervalIndex([
+        (1, Decimal('10'), Decimal('20'), True),
+        (2, Decimal('15'), Decimal('15'), False),
+    ])
+    assert index.is_any_overlap(Decimal('15'), Decimal('15'))
+
+    assert index.remove(1)
+    assert not index.remove(1)
+    assert 1 not in index
+    assert not index.has_cdp
+    assert index.is_any_overlap(Decimal('15'), Decimal('15'))
+    assert not index.is_any_overlap(Decimal('16'), Decimal('20'))
+
+    assert index.remove(2)
+    assert not index.is_any_overlap(Decimal('0'), Decimal('100'))
+
+    index.add(3, Decimal('50'), Decimal('60'), True)
+    index.add(3, Decimal('50'), Decimal('60'), True)
+    assert len(index) == 1
+    assert index.has_cdp
+    assert index.is_any_overlap(Decimal('60'), Decimal('70'))
+    assert not index.is_any_overlap(Decimal('61'), Decimal('70'))
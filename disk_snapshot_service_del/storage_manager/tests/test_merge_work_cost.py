@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from storage_manager import merge_work_cost as mwc
+
+GiB = 1024 ** 3
+
+
+def _storage_obj(inc_raw_data_bytes, disk_bytes=100 * GiB, image_path='/not_exist/a.qcow'):
+    return SimpleNamespace(
+        inc_raw_data_bytes=inc_raw_data_bytes, disk_bytes=disk_bytes, image_path=image_path)
+
+
+def _candidate(name, moving_bytes, reclaimed_bytes, storage_ids, image_paths=()):
+    return mwc.MergeCandidate(
+        name, mwc.MergeWorkCost(moving_bytes, reclaimed_bytes), storage_ids, image_paths, lambda: name)
+
+
+def test_estimate():
+    cost = mwc.estimate_merge_qcow_snapshot_type_a(_storage_obj(GiB))
+    assert cost.moving_bytes == 0
+    assert cost.reclaimed_bytes == GiB
+    assert cost.efficiency == float('inf')
+
+    """未统计数据量时按虚拟磁盘大小估算"""
+    cost = mwc.estimate_merge_qcow_snapshot_type_b(_storage_obj(-1))
+    assert cost.moving_bytes == 100 * GiB
+    assert cost.reclaimed_bytes == 100 * GiB
+
+    """CDP 合并后写入的数据量不超过虚拟磁盘大小"""
+    cost = mwc.estimate_merge_cdp(_storage_obj(0), [_storage_obj(80 * GiB), _storage_obj(120 * GiB)])
+    assert cost.moving_bytes == 100 * GiB
+    assert cost.reclaimed_bytes == 200 * GiB
+    assert cost.efficiency == 2
+
+
+def test_estimate_without_file_io(tmp_path):
+    """估算在锁空间内进行，仅使用数据库字段，不访问文件"""
+    image_path = tmp_path / 'a.qcow'
+    image_path.write_bytes(b'x' * 1024)
+
+    with patch('os.stat', side_effect=AssertionError('file io in lock space')):
+        cost = mwc.estimate_merge_qcow_snapshot_type_b(_storage_obj(GiB, image_path=str(image_path)))
+        assert (cost.moving_bytes, cost.reclaimed_bytes) == (GiB, GiB)
+
+        cost = mwc.estimate_merge_cdp(_storage_obj(0), [_storage_obj(GiB, image_path=str(image_path))])
+        assert (cost.moving_bytes, cost.reclaimed_bytes) == (GiB, GiB)
+
+
+def test_select_by_efficiency_and_budget():
+    candidates = [
+        _candidate('b', 10 * GiB, 10 * GiB, (1, 2, 3)),
+        _candidate('cdp', 10 * GiB, 30 * GiB, (4, 5)),
+        _candidate('a', 0, GiB, (6, 7)),
+        _candidate('big', 100 * GiB, 300 * GiB, (8, 9)),
+    ]
+
+    """预算为 0 时仅选择效率最高的一个"""
+    selected = mwc.MergeWorkScheduler().select(candidates)
+    assert [c.create_work() for c in selected] == ['a']
+
+    selected = mwc.MergeWorkScheduler(25 * GiB).select(candidates)
+    assert [c.create_work() for c in selected] == ['a', 'cdp', 'b']
+
+    """效率最高的候选项总是被选中"""
+    selected = mwc.MergeWorkScheduler(GiB).select(candidates[3:])
+    assert [c.create_work() for c in selected] == ['big']
+
+
+def test_select_skip_conflict():
+    candidates = [
+        _candidate('a1', 0, GiB, (1, 2), ('/x/1.qcow',)),
+        _candidate('a2', 0, GiB, (2, 3), ('/x/2.qcow',)),
+        _candidate('a3', 0, GiB, (4, 5), ('/x/1.qcow',)),
+        _candidate('a4', 0, GiB, (6, 7), ('/x/3.qcow',)),
+    ]
+    selected = mwc.MergeWorkScheduler(GiB).select(candidates)
+    assert [c.create_work() for c in selected] == ['a1', 'a4']
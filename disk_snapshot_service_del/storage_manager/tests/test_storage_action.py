@@ -0,0 +1,59 @@
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from basic_library import xdata
+from storage_manager import models as m
+from storage_manager import storage_action as action
+from storage_manager import valid_storage_directory as vsd
+
+
+def _touch(path):
+    with open(path, 'wb'):
+        pass
+    return str(path)
+
+
+@patch.object(target=vsd, attribute='check_path', new=MagicMock(return_value=True))
+def test_is_all_files_exist_concurrently(tmp_path):
+    files = [_touch(tmp_path / f'{i}.qcow') for i in range(4)]
+
+    assert action.is_all_files_exist_concurrently(files + files[:1], sealed_files={files[0]})
+    assert not action.is_all_files_exist_concurrently(files + [str(tmp_path / 'missing.qcow')])
+    with pytest.raises(xdata.StorageImageFileNotExist):
+        action.is_all_files_exist_concurrently([str(tmp_path / 'missing.qcow')], True)
+
+    os.remove(files[0])
+    assert action.is_all_files_exist_concurrently(files, sealed_files={files[0]})  # 已封存文件的存在结果被缓存
+    assert not action.is_all_files_exist_concurrently(files)
+
+
+@patch.object(target=vsd, attribute='check_path', new=MagicMock(return_value=True))
+def test_is_all_images_in_storage_info_exist(tmp_path):
+    sealed_file, writing_file = _touch(tmp_path / 'sealed.qcow'), _touch(tmp_path / 'writing.qcow')
+    storage_info_list = [
+        {'image_path': sealed_file, 'storage_status': m.DiskSnapshotStorage.STORAGE},
+        {'image_path': writing_file, 'storage_status': m.DiskSnapshotStorage.DATA_WRITING},
+    ]
+
+    assert action.is_all_images_in_storage_info_exist(storage_info_list)
+    os.remove(sealed_file)
+    os.remove(writing_file)
+    assert action.is_all_images_in_storage_info_exist(storage_info_list[:1])
+    assert not action.is_all_images_in_storage_info_exist(storage_info_list)
+
+
+def _hash_storage(inc_hash_path, full_hash_path=None):
+    return MagicMock(is_cdp_file=False, inc_hash_path=inc_hash_path, full_hash_path=full_hash_path, disk_bytes=1024)
+
+
+def test_merge_qcow_snapshot_type_a():
+    merge_storage_obj = _hash_storage('merge.hash')
+    children = [_hash_storage('c1.hash'), _hash_storage('c2.hash', 'c2.full_hash')]
+    logic_service = MagicMock()
+
+    with patch.object(action.service.LogicService, 'get_logic_service', return_value=logic_service):
+        action.merge_qcow_snapshot_type_a(m.DiskSnapshotStorageRoot.ROOT_HASH_TYPE_MD4_CRC32, children, merge_storage_obj)
+
+    logic_service.merge_qcow_hash_file.assert_called_once_with('merge.hash', 'c1.hash', 1024)
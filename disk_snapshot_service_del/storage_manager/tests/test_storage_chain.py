@@ -1,8 +1,10 @@
 import pytest
+from storage_manager import model_dict
 from storage_manager import storage_chain as sc
 from storage_manager import storage_reference_manager as srm
 from storage_manager import storage_tree as tree
 from storage_manager import models as m
+from storage_manager.simulation import chain_serialize_benchmark
 
 pytestmark = pytest.mark.django_db
 
@@ -136,3 +138,31 @@ def test_storage_chain_for_write_exception():
             assert_result_storage_id_list=[92],  # storage 92 被写入
             set_storage_status_recycled=True
         )
+
+
+def test_model_dict_same_as_serializer():
+    for storage_obj in m.DiskSnapshotStorage.objects.all():
+        assert model_dict.to_dict(storage_obj) == dict(
+            chain_serialize_benchmark.DiskSnapshotStorageSerializer(storage_obj).data)
+
+
+def test_insert_tail_to_layout():
+    """追加末端节点后，增量计算的关键storage与完整计算一致"""
+    for storage_obj in m.DiskSnapshotStorage.objects.exclude(parent_snapshot=None).exclude(
+            storage_status=m.DiskSnapshotStorage.RECYCLED):
+        storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(storage_obj.storage_root)
+        nodes = list(tree.dfs_to_root(storage_tree.get_node_by_storage_obj(storage_obj)))
+
+        full_chain = sc.StorageChainForRead(None, srm.StorageReferenceManager(), 'full')
+        incremental_chain = sc.StorageChainForRead(None, srm.StorageReferenceManager(), 'incremental')
+        for node in nodes:
+            full_chain.insert_head(node.storage_obj)
+        for node in nodes[1:]:
+            incremental_chain.insert_head(node.storage_obj)
+        incremental_chain.get_layout()
+        incremental_chain.insert_tail(nodes[0].storage_obj)
+
+        assert ([info['id'] for info in incremental_chain.get_layout().key_storage_info_list]
+                == [info['id'] for info in full_chain.get_layout().key_storage_info_list])
+        assert ([info['id'] for info in incremental_chain.get_layout().storage_info_list]
+                == [info['id'] for info in full_chain.get_layout().storage_info_list])
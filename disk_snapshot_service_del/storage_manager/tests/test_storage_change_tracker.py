@@ -0,0 +1,36 @@
+from storage_manager import storage_change_tracker as sct
+
+
+def test_normal_one():
+    tracker = sct.StorageChangeTracker()
+    storage_root_id = 1
+
+    """未被分析过的 root 视为全部变更"""
+    assert tracker.is_root_dirty(storage_root_id)
+    tracker.mark_storages_dirty(storage_root_id, (1, None,))
+    assert tracker.pop_dirty_storage_ids(storage_root_id) is None
+    assert not tracker.is_root_dirty(storage_root_id)
+    assert tracker.pop_dirty_storage_ids(storage_root_id) == set()
+
+    tracker.mark_storages_dirty(storage_root_id, (1, None,))
+    tracker.mark_storages_dirty(storage_root_id, (2, 1,))
+    assert tracker.is_root_dirty(storage_root_id)
+    assert tracker.pop_dirty_storage_ids(storage_root_id) == {1, 2}
+    assert not tracker.is_root_dirty(storage_root_id)
+
+    tracker.mark_root_dirty(storage_root_id)
+    tracker.mark_storages_dirty(storage_root_id, (3,))
+    assert tracker.is_root_dirty(storage_root_id)
+    assert tracker.pop_dirty_storage_ids(storage_root_id) is None
+    assert not tracker.is_root_dirty(storage_root_id)
+
+
+
+def test_reset():
+    tracker = sct.StorageChangeTracker()
+    tracker.pop_dirty_storage_ids(1)
+    tracker.mark_storages_dirty(2, (1,))
+
+    tracker.reset()
+    assert tracker.is_root_dirty(1)
+    assert tracker.pop_dirty_storage_ids(2) is None
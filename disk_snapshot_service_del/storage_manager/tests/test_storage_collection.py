@@ -5,9 +5,12 @@ import pytest
 
 from storage_manager import models as m
 from storage_manager import storage_action as action
+from storage_manager import storage_change_tracker as sct
 from storage_manager import storage_collection as sc
 from storage_manager import storage_locker_manager as slm
 from storage_manager import storage_reference_manager as srm
+from storage_manager.simulation import simulator
+from storage_manager.simulation import tree_generator
 
 pytestmark = pytest.mark.django_db
 
@@ -1246,3 +1249,147 @@ def test_599c274bd17d4aae82d855f28883ad74_cdp_storage():
     _assert_call_count(s, action_remove_cdp_file=0, action_remove_qcow_file=1,
                        action_delete_qcow_snapshot=0, action_merge_cdp_to_qcow=0,
                        action_merge_qcow_snapshot_type_a=0, action_merge_qcow_snapshot_type_b=0)
+
+
+def test_00001_root_create_delete_works_with_one_query(django_assert_num_queries):
+    """生成删除作业时，仅使用一次分组查询统计文件中未回收的快照存储数量"""
+
+    storage_root_obj = m.DiskSnapshotStorageRoot.objects.get(root_uuid=m.DiskSnapshotStorageRoot.RECYCLE_ROOT_UUID)
+    storage_objs = list(m.DiskSnapshotStorage.valid_storage_objs(storage_root_obj).order_by('id'))
+    assert storage_objs
+
+    with django_assert_num_queries(1):
+        works = sc.StorageCollection._create_delete_works(storage_objs)
+
+    """与 test_00001_root_set_invalid 一致：删除两个文件，删除一个快照点"""
+    assert len([w for w in works if isinstance(w, sc.DeleteFileWork)]) == 2
+    assert len([w for w in works if isinstance(w, sc.DeleteQcowSnapshotWork)]) == 1
+
+
+def test_579734322ea14ff3a9dfcf6df9c4716c_prefetch_host_snapshots(django_assert_num_queries):
+    """进入上下文时一次性预取所有 locator 的主机快照，之后的查询不再访问数据库"""
+
+    root_uuid = '579734322ea14ff3a9dfcf6df9c4716c'  # root_id = 5
+    storage_root_obj = m.DiskSnapshotStorageRoot.objects.get(root_uuid=root_uuid)
+    storage_objs = list(m.DiskSnapshotStorage.valid_storage_objs(storage_root_obj).exclude(locator=None))
+    assert storage_objs
+
+    with django_assert_num_queries(1):
+        with sc.QueryHostSnapshotObjsByLocatorWithCache(storage_root_obj.root_ident) as query_host_snapshots:
+            for storage_obj in storage_objs:
+                assert query_host_snapshots.query(storage_obj.locator_id)
+
+
+def test_579734322ea14ff3a9dfcf6df9c4716c_invalidate_host_snapshot_in_cache():
+    """上下文有效期间主机快照失效，缓存的时间范围索引被增量更新"""
+
+    root_uuid = '579734322ea14ff3a9dfcf6df9c4716c'  # root_id = 5
+    storage_root_obj = m.DiskSnapshotStorageRoot.objects.get(root_uuid=root_uuid)
+    storage_obj = m.DiskSnapshotStorage.valid_storage_objs(storage_root_obj).exclude(locator=None).first()
+
+    with sc.QueryHostSnapshotObjsByLocatorWithCache(storage_root_obj.root_ident) as query_host_snapshots:
+        locator_host_snapshots = query_host_snapshots.get(storage_obj.locator_id)
+        for host_snapshot_obj in m.HostSnapshot.objects.filter(disk_snapshots__locator_id=storage_obj.locator_id):
+            host_snapshot_obj.set_invalid()
+
+        assert not locator_host_snapshots.has_valid_cdp
+        assert not locator_host_snapshots.is_any_valid_overlap(
+            storage_obj.storage_begin_timestamp, storage_obj.storage_end_timestamp)
+
+
+def test_579734322ea14ff3a9dfcf6df9c4716c_skip_idle_root():
+    """使用变更跟踪器时，没有变更的 root 不再分析；主机快照失效后重新分析"""
+
+    root_uuid = '579734322ea14ff3a9dfcf6df9c4716c'  # root_id = 5
+    storage_root_obj = m.DiskSnapshotStorageRoot.objects.get(root_uuid=root_uuid)
+    tracker = sct.StorageChangeTracker.get_storage_change_tracker()
+    tracker.reset()
+    collection = sc.StorageCollection(storage_root_obj, srm.StorageReferenceManager(),
+                                      slm.StorageLockerManager(), track_changes=True)
+
+    """第一轮分析整棵树，无可回收"""
+    r, s = run_collect(collection)
+    _assert_do_nothing(r, s)
+    assert not tracker.is_root_dirty(storage_root_obj.id)
+
+    """将 host_snapshot 1 2 3 置为 invalid，root 被标记为有变更"""
+    for host_snapshot_obj in m.HostSnapshot.objects.filter(id__in=[1, 2, 3]):
+        host_snapshot_obj.set_invalid()
+    assert tracker.is_root_dirty(storage_root_obj.id)
+
+    r, s = run_collect(collection)
+    assert r
+    _assert_call_count(s, action_remove_cdp_file=4, action_remove_qcow_file=2,
+                       action_delete_qcow_snapshot=0, action_merge_cdp_to_qcow=0,
+                       action_merge_qcow_snapshot_type_a=0, action_merge_qcow_snapshot_type_b=0)
+
+
+def test_sibling_of_writing_file_reanalyzed_with_global_tracker():
+    """文件结束写入后，父节点在该文件中的兄弟分支节点重新分析
+
+    R(f0) ─ P1(F) ┬ P2(F) ─ W(F)
+                  └ X(f1) ─ Y(f2)
+    X 可跨文件合并到 P1，但文件 F 正在写入；W 结束写入后，X 应被重新分析
+    """
+    generator = tree_generator.SyntheticTreeGenerator(seed=4)
+    storage_root_obj = generator.create_root()
+    writing_image_path = generator.new_image_path(storage_root_obj)
+
+    def _create_storage(parent_storage_obj, image_path, valid):
+        return generator.create_qcow_snapshot(storage_root_obj, parent_storage_obj, image_path, valid)
+
+    r = _create_storage(None, generator.new_image_path(storage_root_obj), True)
+    p1 = _create_storage(r, writing_image_path, True)
+    p2 = _create_storage(p1, writing_image_path, True)
+    w = _create_storage(p2, writing_image_path, True)
+    x = _create_storage(p1, generator.new_image_path(storage_root_obj), False)
+    _create_storage(x, generator.new_image_path(storage_root_obj), True)
+
+    tracker = sct.StorageChangeTracker.get_storage_change_tracker()
+    tracker.reset()
+    collection = sc.StorageCollection(storage_root_obj, srm.StorageReferenceManager(),
+                                      slm.StorageLockerManager(), track_changes=True)
+
+    """第一轮分析整棵树，文件 F 正在写入，X 不可合并"""
+    r, s = run_collect(collection, _get_mock_setting({'srm_is_storage_writing': {
+        'target': srm.StorageReferenceManager,
+        'attribute': 'is_storage_writing',
+        'new': MagicMock(side_effect=lambda image_path: image_path == writing_image_path),
+    }}))
+    _assert_do_nothing(r, s)
+    assert not tracker.is_root_dirty(storage_root_obj.id)
+
+    """W 结束写入，释放写入引用时仅标记 W"""
+    tracker.mark_storages_dirty(storage_root_obj.id, (w.id,))
+
+    r, s = run_collect(collection)
+    assert r
+    _assert_call_count(s, action_remove_cdp_file=0, action_remove_qcow_file=0,
+                       action_delete_qcow_snapshot=0, action_merge_cdp_to_qcow=0,
+                       action_merge_qcow_snapshot_type_a=0, action_merge_qcow_snapshot_type_b=1)
+
+
+def test_simulation_converge():
+    storage_root_objs = [
+        tree_generator.SyntheticTreeGenerator(seed=1).create_qcow_chain_root(10),
+        tree_generator.SyntheticTreeGenerator(seed=2).create_shared_file_root(16, 4),
+        tree_generator.SyntheticTreeGenerator(seed=3).create_cdp_root(3),
+    ]
+    report = simulator.RecyclingSimulator(storage_root_objs, max_passes=200).run()
+    assert report.converged
+    assert report.queries > 0
+    assert sum(report.action_count_dict.values()) > 0
+
+
+def test_simulation_converge_with_change_tracker():
+    """使用变更跟踪器时，与每轮分析整棵树的回收结果一致"""
+    live_storage_counts = list()
+    for track_changes in (False, True,):
+        storage_root_objs = [
+            tree_generator.SyntheticTreeGenerator(seed=1).create_qcow_chain_root(10),
+            tree_generator.SyntheticTreeGenerator(seed=2).create_shared_file_root(16, 4),
+        ]
+        report = simulator.RecyclingSimulator(storage_root_objs, max_passes=200, track_changes=track_changes).run()
+        assert report.converged
+        live_storage_counts.append(simulator.RecyclingSimulator.live_storage_count(storage_root_objs))
+    assert live_storage_counts[0] == live_storage_counts[1]
@@ -0,0 +1,139 @@
+import pytest
+
+from basic_library import xdata
+from storage_manager import hash_file
+from storage_manager import models as m
+from storage_manager import storage_diff as sd
+from storage_manager import storage_locker_manager as slm
+from storage_manager import storage_reference_manager as srm
+from storage_manager import storage_tree as tree
+from storage_manager.simulation import tree_generator
+
+pytestmark = pytest.mark.django_db
+
+R = hash_file.HASH_RECORD_BYTES
+B = hash_file.HASH_BLOCK_BYTES
+
+
+def _write_hash(path, written_indexes, records=4):
+    with open(path, 'wb') as f:
+        f.write(b''.join(b'\x01' * R if i in written_indexes else bytes(R) for i in range(records)))
+    return str(path)
+
+
+@pytest.fixture
+def format_verified(monkeypatch):
+    monkeypatch.setattr(hash_file, 'HASH_FILE_FORMAT_VERIFIED', True)
+
+
+@pytest.fixture
+def diff_tree(tmp_path):
+    """
+    A(f0) ┬ B(f0) ─ C(f1)
+          └ D(f2)
+    每个快照存储的增量hash仅写入一个数据块：A-0、B-1、C-2、D-3
+    """
+    generator = tree_generator.SyntheticTreeGenerator(seed=5, disk_bytes=4 * B)
+    storage_root_obj = generator.create_root(m.DiskSnapshotStorageRoot.ROOT_HASH_TYPE_MD4_CRC32)
+
+    def _create_storage(name, parent_storage_obj, image_path, written_index):
+        storage_obj = generator.create_qcow_snapshot(storage_root_obj, parent_storage_obj, image_path)
+        storage_obj.inc_hash_path = _write_hash(tmp_path / f'{name}.hash', {written_index, })
+        storage_obj.save(update_fields=['inc_hash_path', ])
+        return storage_obj
+
+    f0 = generator.new_image_path(storage_root_obj)
+    a = _create_storage('a', None, f0, 0)
+    b = _create_storage('b', a, f0, 1)
+    c = _create_storage('c', b, generator.new_image_path(storage_root_obj), 2)
+    d = _create_storage('d', a, generator.new_image_path(storage_root_obj), 3)
+    return storage_root_obj, {'a': a, 'b': b, 'c': c, 'd': d}
+
+
+def _diff_query(reference_manager, src_storage_obj, dst_storage_obj):
+    return sd.StorageBlockDiffQuery(
+        slm.StorageLockerManager(), reference_manager,
+        src_storage_obj.disk_snapshot_storage_ident, dst_storage_obj.disk_snapshot_storage_ident)
+
+
+@pytest.mark.parametrize('src, dst, expected', [
+    ('a', 'b', [(B, B)]),  # 同一文件中的父子
+    ('b', 'c', [(2 * B, B)]),  # 跨文件的父子
+    ('c', 'd', [(B, 3 * B)]),  # 不同分支，合并到最近公共祖先 A 的路径
+    ('d', 'c', [(B, 3 * B)]),
+    ('c', 'c', []),
+])
+def test_iter_changed_ranges(format_verified, diff_tree, src, dst, expected):
+    _, storage_objs = diff_tree
+    reference_manager = srm.StorageReferenceManager()
+
+    diff_query = _diff_query(reference_manager, storage_objs[src], storage_objs[dst])
+    assert list(diff_query.iter_changed_ranges()) == expected
+    assert not reference_manager.reading_record_dict
+
+
+def test_iter_changed_ranges_by_full_hash(format_verified, diff_tree, tmp_path):
+    _, storage_objs = diff_tree
+    for name, records in (('b', {0, 1}), ('d', {0, 3}),):
+        storage_objs[name].full_hash_path = _write_hash(tmp_path / f'{name}.full_hash', records)
+        storage_objs[name].save(update_fields=['full_hash_path', ])
+
+    diff_query = _diff_query(srm.StorageReferenceManager(), storage_objs['b'], storage_objs['d'])
+    assert list(diff_query.iter_changed_ranges()) == [(B, B), (3 * B, B)]
+
+
+def test_get_inc_hash_paths_between(diff_tree):
+    storage_root_obj, storage_objs = diff_tree
+    storage_tree = tree.DiskSnapshotStorageTree.create_instance_by_storage_root(storage_root_obj)
+    diff_query = _diff_query(srm.StorageReferenceManager(), storage_objs['c'], storage_objs['d'])
+
+    def _paths(src, dst):
+        return diff_query._get_inc_hash_paths_between(
+            storage_tree.get_node_by_storage_obj(storage_objs[src]),
+            storage_tree.get_node_by_storage_obj(storage_objs[dst]))
+
+    """最近公共祖先及其以上的节点不参与合并"""
+    assert _paths('c', 'd') == [storage_objs[name].inc_hash_path for name in ('c', 'b', 'd',)]
+    assert _paths('a', 'c') == [storage_objs[name].inc_hash_path for name in ('c', 'b',)]
+    assert _paths('b', 'b') == []
+
+
+def test_chains_released_on_error(format_verified, diff_tree, tmp_path):
+    _, storage_objs = diff_tree
+    reference_manager = srm.StorageReferenceManager()
+
+    """路径上的快照存储没有增量hash"""
+    storage_objs['b'].inc_hash_path = None
+    storage_objs['b'].save(update_fields=['inc_hash_path', ])
+    diff_query = _diff_query(reference_manager, storage_objs['c'], storage_objs['d'])
+    with pytest.raises(xdata.DiskSnapshotStorageInvalid):
+        list(diff_query.iter_changed_ranges())
+    assert not reference_manager.reading_record_dict
+
+    """读取hash文件失败"""
+    storage_objs['b'].inc_hash_path = str(tmp_path / 'missing.hash')
+    storage_objs['b'].save(update_fields=['inc_hash_path', ])
+    diff_query = _diff_query(reference_manager, storage_objs['c'], storage_objs['d'])
+    with pytest.raises(OSError):
+        list(diff_query.iter_changed_ranges())
+    assert not reference_manager.reading_record_dict
+
+    """中途停止迭代"""
+    storage_objs['b'].inc_hash_path = _write_hash(tmp_path / 'b.hash', {1, })
+    storage_objs['b'].save(update_fields=['inc_hash_path', ])
+    ranges = _diff_query(reference_manager, storage_objs['a'], storage_objs['c']).iter_changed_ranges()
+    assert next(ranges) == (B, 2 * B)
+    assert reference_manager.reading_record_dict
+    ranges.close()
+    assert not reference_manager.reading_record_dict
+
+
+def test_format_not_verified(diff_tree):
+    """hash文件布局核对前不返回任何区间"""
+    _, storage_objs = diff_tree
+    reference_manager = srm.StorageReferenceManager()
+
+    diff_query = _diff_query(reference_manager, storage_objs['a'], storage_objs['b'])
+    with pytest.raises(xdata.DiskSnapshotStorageInvalid):
+        list(diff_query.iter_changed_ranges())
+    assert not reference_manager.reading_record_dict
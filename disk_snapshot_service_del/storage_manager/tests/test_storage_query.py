@@ -1,6 +1,13 @@
+import collections
+import concurrent.futures
 import decimal
+import threading
+from unittest.mock import MagicMock, patch
+
 import pytest
 from basic_library import xdata
+from storage_manager import chain_layout_cache as clc
+from storage_manager import shared_storage_chain as ssc
 from storage_manager import storage_query as sq
 from storage_manager import storage_locker_manager as slm
 from storage_manager import storage_reference_manager as srm
@@ -199,3 +206,107 @@ def test_():
         storage_obj.storage_status = m.DiskSnapshotStorage.RECYCLED
         storage_obj.save(update_fields=('storage_status',))
         storage_chain_query_by_disk_snapshot_storage_obj.get_storage_chain()
+
+
+def test_shared_storage_chain():
+    """ 多次打开同一主机快照，共用一个读取链 """
+    reference_manager = srm.StorageReferenceManager()
+    registry = ssc.SharedStorageChainRegistry(reference_manager)
+    locker_manager = slm.StorageLockerManager()
+
+    chain_lists = [sq.StorageChainQueryByHostSnapshot(
+        locker_manager, reference_manager, 'host_snapshot_ident_1', None, registry).get_storage_chain_list()
+                   for _ in range(3)]
+
+    storage_chains = [chain_list[0]['storage_chain'] for chain_list in chain_lists]
+    assert [[s['id'] for s in c.storage_info_list] for c in storage_chains] == [[7], [7], [7]]
+    assert len(reference_manager.reading_record_dict) == 1
+    assert registry.ref_count(storage_chains[0].key[0], storage_chains[0].timestamp) == 3
+
+    for storage_chain in storage_chains:
+        assert reference_manager.is_storage_using(storage_chain.storages[-1]['disk_snapshot_storage_ident'])
+        storage_chain.release()
+    assert not reference_manager.reading_record_dict
+    assert not registry.entries
+
+
+def test_shared_storage_chain_generate_outside_lock():
+    """ 生成规范链时不阻塞其他快照存储的打开，同一快照存储的并发打开等待并共用同一规范链 """
+    reference_manager = srm.StorageReferenceManager()
+    registry = ssc.SharedStorageChainRegistry(reference_manager)
+    generating = threading.Event()
+    gate = threading.Event()
+    generate_count = collections.Counter()
+
+    def _generate(name, wait_gate):
+        def _inner():
+            generate_count[name] += 1
+            if wait_gate:
+                generating.set()
+                assert gate.wait(10)
+            return MagicMock(storage_reference_manager=reference_manager)
+        return _inner
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        slow = executor.submit(registry.acquire, ('a', None), _generate('a', True))
+        assert generating.wait(10)
+        same = executor.submit(registry.acquire, ('a', None), _generate('a', False))
+
+        other = registry.acquire(('b', None), _generate('b', False))  # 'a' 生成中，不阻塞 'b'
+        assert not slow.done()
+
+        gate.set()
+        assert slow.result(10) is same.result(10)
+
+    assert generate_count == {'a': 1, 'b': 1}
+    assert registry.ref_count('a', None) == 2
+    assert not registry.pendings
+    registry.release(('b', None))
+    other.release.assert_called_once()
+
+
+def test_shared_storage_chain_generate_failed():
+    """ 生成规范链失败后，下一次打开重新生成 """
+    reference_manager = srm.StorageReferenceManager()
+    registry = ssc.SharedStorageChainRegistry(reference_manager)
+
+    with pytest.raises(xdata.StorageLockerNotExist):
+        registry.acquire(('a', None), MagicMock(side_effect=xdata.StorageLockerNotExist('f', 'm', 'd', 0, 555)))
+    assert not registry.pendings and not registry.entries
+
+    storage_chain = registry.acquire(('a', None), lambda: MagicMock(storage_reference_manager=reference_manager))
+    storage_chain.acquire.assert_called_once()
+    assert registry.ref_count('a', None) == 1
+
+
+@patch('storage_manager.chain_layout_cache.transaction.get_connection',
+       new=MagicMock(return_value=MagicMock(in_atomic_block=False)))
+def test_chain_layout_cache():
+    """ 树没有变更时复用快照存储链布局 """
+    cache = clc.ChainLayoutCache()
+
+    def _open():
+        chain_list = sq.StorageChainQueryByHostSnapshot(
+            slm.StorageLockerManager(), srm.StorageReferenceManager(), 'host_snapshot_ident_1',
+            chain_layout_cache=cache).get_storage_chain_list()
+        storage_chain = chain_list[0]['storage_chain']
+        storage_id_list = [s['id'] for s in storage_chain.storages]
+        storage_chain.release()
+        return storage_id_list
+
+    assert _open() == [7]
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert _open() == [7]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    storage_obj = m.DiskSnapshotStorage.objects.get(id=7)
+    generation = m.DiskSnapshotStorageRoot.get_storage_generation(storage_obj.storage_root_id)
+    storage_obj.save()
+    assert m.DiskSnapshotStorageRoot.get_storage_generation(storage_obj.storage_root_id) == generation + 1
+    assert _open() == [7]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    """ 其他进程的变更同样使缓存失效 """
+    m.DiskSnapshotStorageRoot.objects.filter(id=storage_obj.storage_root_id).update(storage_generation=generation + 5)
+    assert _open() == [7]
+    assert (cache.hits, cache.misses) == (1, 3)
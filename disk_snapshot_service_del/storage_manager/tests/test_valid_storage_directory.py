@@ -29,3 +29,23 @@ def test_normal_one():
     with pytest.raises(xdata.StorageDirectoryInvalid):
         vsd.check_path(file_path)
     assert not vsd.check_path(file_path, False)
+
+
+@patch.object(target=os.path, attribute='isdir', new=MagicMock(return_value=True))
+def test_nested_and_similar_directory():
+    """嵌套目录与名称前缀相同的目录"""
+
+    vsd.add_directory(r'/mnt/nodes/disk1')
+    vsd.add_directory(r'/mnt/nodes/disk1/sub')
+
+    assert vsd.check_path(r'/mnt/nodes/disk1', False)
+    assert vsd.check_path(r'/mnt/nodes//disk1/./a/b.qcow', False)
+    assert not vsd.check_path(r'/mnt/nodes/disk10/a.qcow', False)
+    assert not vsd.check_path(r'/mnt/nodes', False)
+
+    vsd.remove_directory(r'/mnt/nodes/disk1')
+    assert vsd.check_path(r'/mnt/nodes/disk1/sub/a.qcow', False)
+    assert not vsd.check_path(r'/mnt/nodes/disk1/a.qcow', False)
+
+    vsd.remove_directory(r'/mnt/nodes/disk1/sub')
+    assert not vsd.check_path(r'/mnt/nodes/disk1/sub/a.qcow', False)
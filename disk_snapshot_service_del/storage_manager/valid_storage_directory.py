@@ -1,16 +1,29 @@
 import os
-from functools import lru_cache
+import threading
 from pathlib import Path
 
-from basic_library import rwlock
 from basic_library import xdata
-from basic_library import xfunctions
 from basic_library import xlogging
 
 _logger = xlogging.getLogger(__name__)
 
 _valid_storage_directory_cache = set()
-_valid_storage_directory_locker = rwlock.RWLockWrite()
+_valid_storage_directory_locker = threading.Lock()
+
+_DIRECTORY_END = None
+"""前缀树节点中的标记键，存在时意为该节点对应一个有效的快照存储目录"""
+
+_valid_storage_directory_trie = dict()
+"""有效的快照存储目录前缀树，节点为 dict ，其key为路径分量
+
+:remark:
+    前缀树不可修改，变更时生成新的前缀树后整体替换，读取时无需加锁
+"""
+
+
+def _split_path(path):
+    """将路径拆分为路径分量，与 os.path.commonpath 的比较方式一致"""
+    return [component for component in path.split(os.sep) if component and component != os.curdir]
 
 
 class ValidStorageDirectory(object):
@@ -23,7 +36,6 @@ class ValidStorageDirectory(object):
 
     def __init__(self, storage_directory):
         self.storage_directory = storage_directory
-        self._storage_directory_str_len = len(storage_directory)
         assert os.path.isdir(storage_directory)
         assert len(Path(storage_directory).parents) > 2
 
@@ -39,10 +51,31 @@ class ValidStorageDirectory(object):
     def __eq__(self, other):
         return self.storage_directory == other.storage_directory
 
-    @lru_cache(maxsize=1024 * 100)  # 按照一个缓存数据0.5K计算，最大缓存50M的数据
-    @xfunctions.convert_exception_to_value(False, _logger.debug)
-    def is_include(self, file_path):
-        return self._storage_directory_str_len == len(os.path.commonpath([self.storage_directory, file_path, ]))
+    @property
+    def components(self):
+        return _split_path(self.storage_directory)
+
+
+def _build_trie(directories) -> dict:
+    trie = dict()
+    for directory in directories:
+        node = trie
+        for component in directory.components:
+            node = node.setdefault(component, dict())
+        node[_DIRECTORY_END] = directory
+    return trie
+
+
+def _is_include(trie, file_path):
+    """路径或其任意一级父目录为有效的快照存储目录时返回 True ，耗时仅与路径深度相关"""
+    node = trie
+    for component in _split_path(file_path):
+        if _DIRECTORY_END in node:
+            return True
+        node = node.get(component, None)
+        if node is None:
+            return False
+    return _DIRECTORY_END in node
 
 
 def check_path(file_path, raise_exception=True):
@@ -53,10 +86,8 @@ def check_path(file_path, raise_exception=True):
     """
     assert os.path.isabs(file_path)
 
-    with _valid_storage_directory_locker.gen_rlock():
-        for valid in _valid_storage_directory_cache:
-            if valid.is_include(file_path):
-                return True
+    if _is_include(_valid_storage_directory_trie, file_path):
+        return True
 
     if raise_exception:
         xlogging.raise_and_logging_error('数据存储目录未挂载', f'{file_path} not in "valid storage directory"',
@@ -65,13 +96,20 @@ def check_path(file_path, raise_exception=True):
         return False
 
 
+def _update_trie():
+    global _valid_storage_directory_trie
+    _valid_storage_directory_trie = _build_trie(_valid_storage_directory_cache)
+
+
 def add_directory(directory_path):
-    with _valid_storage_directory_locker.gen_wlock():
+    with _valid_storage_directory_locker:
         directory = ValidStorageDirectory(directory_path)
         _valid_storage_directory_cache.add(directory)
+        _update_trie()
 
 
 def remove_directory(directory_path):
-    with _valid_storage_directory_locker.gen_wlock():
+    with _valid_storage_directory_locker:
         directory = ValidStorageDirectory(directory_path)
         _valid_storage_directory_cache.discard(directory)
+        _update_trie()
@@ -1,3 +1,4 @@
+import bisect
 import threading
 
 from basic_library import rwlock
@@ -32,34 +33,106 @@ class TaskContainer(object):
             存放所有的任务
                 key为任务类型
                 value为dict，其key为任务标识符
+        :var self.identity_indexes
+            任务身份索引，用于查找重复任务
+                key为任务类型
+                value为dict，其key为 task_item.identity_key ，value为具有该身份的任务标识符列表
+        :var self.sorted_task_idents
+            按任务类型分组的有序任务标识符，用于按前缀查找
         :var self.locker
-            锁对象，访问/修改self.tasks前必须进入该锁的临界区
+            锁对象，访问/修改以上成员前必须进入该锁的临界区
         """
         self.tasks = dict()
+        self.identity_indexes = dict()
+        self.sorted_task_idents = dict()
         self.locker = rwlock.RWLockWrite()
 
+    @staticmethod
+    def _get_identity_key(task_item):
+        return getattr(task_item, 'identity_key', None)
+
+    def _find_dup_task_ident(self, task_type: str, task_item):
+        identity_key = self._get_identity_key(task_item)
+        if identity_key is not None:
+            task_idents = self.identity_indexes[task_type].get(identity_key, None)
+            return task_idents[0] if task_idents else None
+
+        for task_ident, _item in self.tasks[task_type].items():  # 没有身份标识的任务，只能逐一比较
+            if _item == task_item:
+                return task_ident
+        return None
+
     def add_task(self, task_type: str, task_ident: str, task_item, item_can_dup=False):
+        """添加任务
+
+        :remark:
+            task_item 具有 identity_key 属性时，通过哈希索引查找重复任务；否则逐一调用 __eq__ 比较
+        :return:
+            存在重复任务时返回 False
+        """
         with self.locker.gen_wlock():
             if task_type not in self.tasks:
                 self.tasks[task_type] = dict()
+                self.identity_indexes[task_type] = dict()
+                self.sorted_task_idents[task_type] = list()
 
             assert task_ident not in self.tasks[task_type]
 
-            if not item_can_dup:
-                for _item in self.tasks[task_type].values():
-                    if _item == task_item:
-                        return False
+            if (not item_can_dup) and (self._find_dup_task_ident(task_type, task_item) is not None):
+                return False
 
             self.tasks[task_type][task_ident] = task_item
+            identity_key = self._get_identity_key(task_item)
+            if identity_key is not None:
+                self.identity_indexes[task_type].setdefault(identity_key, list()).append(task_ident)
+            bisect.insort(self.sorted_task_idents[task_type], task_ident)
             return True
 
+    def _pop_task(self, task_type: str, task_ident: str):
+        task_item = self.tasks[task_type].pop(task_ident, None)
+        if task_item is None:
+            return None
+
+        identity_key = self._get_identity_key(task_item)
+        if identity_key is not None:
+            identity_index = self.identity_indexes[task_type]
+            task_idents = identity_index[identity_key]
+            task_idents.remove(task_ident)
+            if not task_idents:
+                identity_index.pop(identity_key)
+
+        sorted_task_idents = self.sorted_task_idents[task_type]
+        del sorted_task_idents[bisect.bisect_left(sorted_task_idents, task_ident)]
+        return task_item
+
+    def get_task_items(self, task_type: str) -> list:
+        with self.locker.gen_rlock():
+            return list(self.tasks.get(task_type, dict()).values())
+
+    def get_task(self, task_type: str, task_ident: str):
+        with self.locker.gen_rlock():
+            return self.tasks.get(task_type, dict()).get(task_ident, None)
+
+    def get_task_by_identity_key(self, task_type: str, identity_key):
+        with self.locker.gen_rlock():
+            task_idents = self.identity_indexes.get(task_type, dict()).get(identity_key, None)
+            return self.tasks[task_type][task_idents[0]] if task_idents else None
+
+    def count(self, task_type: str) -> int:
+        with self.locker.gen_rlock():
+            return len(self.tasks.get(task_type, dict()))
+
+    def counts(self) -> dict:
+        with self.locker.gen_rlock():
+            return {task_type: len(tasks) for task_type, tasks in self.tasks.items()}
+
     def remove_task(self, task_type: str, task_ident: str, release_item=False):
         with self.locker.gen_wlock():
             if task_type not in self.tasks:
                 _logger.warning(f'not exist task_type : {task_type}')
                 return None
 
-            task_item = self.tasks[task_type].pop(task_ident, None)
+            task_item = self._pop_task(task_type, task_ident)
             if not task_item:
                 _logger.warning(f'not exist task_type : {task_type}')
                 return None
@@ -75,12 +148,14 @@ class TaskContainer(object):
                 _logger.warning(f'not exist task_type : {task_type}')
                 return None
 
-            need_remove_task = [
-                (task_ident, task_item) for task_ident, task_item in self.tasks[task_type].items()
-                if task_ident.startswith(task_prefix_ident)]
+            sorted_task_idents = self.sorted_task_idents[task_type]
+            begin = bisect.bisect_left(sorted_task_idents, task_prefix_ident)
+            end = begin
+            while end < len(sorted_task_idents) and sorted_task_idents[end].startswith(task_prefix_ident):
+                end += 1
 
-            for task_ident, _ in need_remove_task:
-                self.tasks.pop(task_ident)
+            need_remove_task = [
+                (task_ident, self._pop_task(task_type, task_ident)) for task_ident in sorted_task_idents[begin:end]]
 
         if release_item:
             for _, task_item in need_remove_task:
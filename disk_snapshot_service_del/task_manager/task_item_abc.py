@@ -16,11 +16,20 @@ class TaskItem(abc.ABC):
     def __init__(self):
         self._valid = False
 
-    @abc.abstractmethod
     @property
+    @abc.abstractmethod
     def name(self):
         raise NotImplementedError()
 
+    @property
+    def identity_key(self):
+        """任务身份，相同身份的任务视为重复任务，TaskContainer 使用该值建立哈希索引
+
+        :remark:
+            返回 None 时，TaskContainer 使用 __eq__ 逐一比较
+        """
+        return None
+
     def __del__(self):
         if self._valid:
             _logger.warning(f'{self.name} NOT call release')
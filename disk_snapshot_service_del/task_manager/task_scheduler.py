@@ -0,0 +1,333 @@
+import collections
+import concurrent.futures
+import threading
+import time
+
+from basic_library import xlogging
+from task_manager import task_container as tc
+from task_manager import task_item_abc
+
+_logger = xlogging.getLogger(__name__)
+
+_task_scheduler = None
+_task_scheduler_locker = threading.Lock()
+
+TASK_TYPE_OPEN = 'open'
+TASK_TYPE_HASHING = 'hashing'
+TASK_TYPE_VERIFICATION = 'verification'
+TASK_TYPE_RECYCLING = 'recycling'
+
+DEFAULT_PRIORITIES = {
+    TASK_TYPE_OPEN: 0,
+    TASK_TYPE_HASHING: 10,
+    TASK_TYPE_VERIFICATION: 20,
+    TASK_TYPE_RECYCLING: 30,
+}
+"""任务类型的优先级，值越小越优先；未配置的任务类型优先级最低"""
+
+DEFAULT_CONCURRENCY_LIMITS = {
+    TASK_TYPE_OPEN: 16,
+    TASK_TYPE_HASHING: 4,
+    TASK_TYPE_VERIFICATION: 2,
+    TASK_TYPE_RECYCLING: 1,
+}
+"""任务类型的最大并发数；未配置的任务类型仅受执行器大小限制"""
+
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+
+DEFAULT_EXECUTOR_WORKERS = {
+    EXECUTOR_THREAD: 16,
+    EXECUTOR_PROCESS: 4,
+}
+
+
+class ScheduledTask(task_item_abc.TaskItem):
+    """调度中的任务
+
+    remark：
+        提交后存放于 TaskContainer 中，直到执行结束或者被取消
+        identity_key 相同的任务视为重复任务，不会重复提交
+    """
+
+    def __init__(self, task_type, task_ident, fn, args, kwargs, root_ident, executor, identity_key):
+        super(ScheduledTask, self).__init__()
+        self.task_type = task_type
+        self.task_ident = task_ident
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.root_ident = root_ident
+        self.executor = executor
+        self._identity_key = identity_key
+        self.future = concurrent.futures.Future()
+        self.submit_time = time.monotonic()
+        self.start_time = None
+
+    @property
+    def name(self):
+        return f'{self}'
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        return f'scheduled task {self.task_type} {self.task_ident}'
+
+    @property
+    def identity_key(self):
+        return self._identity_key
+
+    def acquire(self):
+        super(ScheduledTask, self).acquire()
+        self.start_time = time.monotonic()
+
+    def release(self):
+        return super(ScheduledTask, self).release()
+
+
+class _LatencyStatistics(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'avg_seconds': self.total / self.count if self.count else 0.0,
+            'max_seconds': self.max,
+        }
+
+
+class TaskScheduler(object):
+    """任务调度器
+
+    :remark:
+        按任务类型分队列，优先调度高优先级的任务类型
+        同一任务类型内，按快照存储根轮转调度，避免单个根的大量任务阻塞其他根
+        仅在执行器与任务类型都有空闲并发时才将任务交给执行器，保证执行器内部不堆积任务，优先级始终生效
+        调度在提交与任务结束时进行，不需要额外的调度线程
+    """
+
+    @staticmethod
+    def get_task_scheduler():
+        global _task_scheduler
+
+        if _task_scheduler is None:
+            with _task_scheduler_locker:
+                if _task_scheduler is None:
+                    # 使用独立的任务容器：任务类型与业务任务（如 HashingTask.TASK_TYPE）同名，不可混用
+                    _task_scheduler = TaskScheduler(tc.TaskContainer())
+        return _task_scheduler
+
+    def __init__(self, task_container, priorities=None, concurrency_limits=None, executor_workers=None):
+        """
+        :param task_container: TaskContainer
+            存放调度中的任务，元素为 ScheduledTask ；不可与存放业务任务的容器共用
+        :param priorities:
+            参考 DEFAULT_PRIORITIES
+        :param concurrency_limits:
+            参考 DEFAULT_CONCURRENCY_LIMITS
+        :param executor_workers:
+            执行器大小，参考 DEFAULT_EXECUTOR_WORKERS ；执行器在首次使用时创建
+        :var self.queues
+            等待中的任务
+                key为任务类型
+                value为OrderedDict，其key为快照存储根标识，value为该根等待中的任务队列
+        :var self.locker
+            锁对象，访问/修改调度状态前必须进入该锁的临界区
+        """
+        self.task_container = task_container
+        self.priorities = DEFAULT_PRIORITIES if priorities is None else priorities
+        self.concurrency_limits = DEFAULT_CONCURRENCY_LIMITS if concurrency_limits is None else concurrency_limits
+        self.executor_workers = DEFAULT_EXECUTOR_WORKERS if executor_workers is None else executor_workers
+        self.queues = dict()
+        self.running_counts = collections.Counter()
+        self.executor_running_counts = collections.Counter()
+        self.executors = dict()
+        self.wait_latencies = collections.defaultdict(_LatencyStatistics)
+        self.run_latencies = collections.defaultdict(_LatencyStatistics)
+        self.is_shutdown = False
+        self.locker = threading.Lock()
+
+    def submit(self, task_type: str, task_ident: str, fn, *args, root_ident=None, executor=EXECUTOR_THREAD,
+               identity_key=None, **kwargs):
+        """提交任务
+
+        :param task_ident:
+            任务标识符，同一任务类型中唯一
+        :param fn:
+            任务函数，使用进程池执行时，函数与参数需要支持序列化
+        :param root_ident:
+            任务所属的快照存储根，用于在根之间公平调度
+        :param identity_key:
+            任务身份，与调度中的任务身份相同时不提交
+        :return:
+            concurrent.futures.Future ；存在重复任务时返回 None
+        """
+        assert executor in self.executor_workers, f'unknown executor {executor}'
+        task = ScheduledTask(task_type, task_ident, fn, args, kwargs, root_ident, executor, identity_key)
+
+        with self.locker:
+            if self.is_shutdown:
+                xlogging.raise_and_logging_error(
+                    '任务调度器已关闭', f'submit {task} after shutdown', print_args=False)
+            if (self.task_container.get_task(task_type, task_ident) is not None
+                    or not self.task_container.add_task(task_type, task_ident, task)):
+                _logger.info(f'{task} is dup, skip')
+                return None
+            self.queues.setdefault(task_type, collections.OrderedDict()).setdefault(
+                root_ident, collections.deque()).append(task)
+
+        self._dispatch()
+        return task.future
+
+    def cancel(self, task_type: str, task_ident: str) -> bool:
+        """取消等待中的任务
+
+        :return:
+            任务已开始执行或者不存在时返回 False
+        """
+        with self.locker:
+            task = self.task_container.get_task(task_type, task_ident)
+            if not isinstance(task, ScheduledTask) or task.start_time is not None:
+                return False
+            self._remove_from_queue(task)
+            self.task_container.remove_task(task_type, task_ident)
+
+        task.future.cancel()
+        _logger.info(f'{task} cancelled')
+        return True
+
+    def _remove_from_queue(self, task):
+        root_queues = self.queues[task.task_type]
+        root_queue = root_queues[task.root_ident]
+        root_queue.remove(task)
+        if not root_queue:
+            root_queues.pop(task.root_ident)
+
+    def _get_type_limit(self, task_type):
+        return self.concurrency_limits.get(task_type, None)
+
+    def _pop_next_task(self, task_type):
+        """从等待中的任务中，取出执行器有空闲的第一个根的任务，并将该根移至队尾"""
+        root_queues = self.queues.get(task_type, None)
+        if not root_queues:
+            return None
+
+        for root_ident, root_queue in root_queues.items():
+            task = root_queue[0]
+            if self.executor_running_counts[task.executor] >= self.executor_workers[task.executor]:
+                continue
+            root_queue.popleft()
+            if root_queue:
+                root_queues.move_to_end(root_ident)
+            else:
+                root_queues.pop(root_ident)
+            return task
+        return None
+
+    def _pop_dispatchable_tasks(self) -> list:
+        tasks = list()
+        task_types = sorted(self.queues, key=lambda t: (self.priorities.get(t, float('inf')), t))
+        for task_type in task_types:
+            while True:
+                limit = self._get_type_limit(task_type)
+                if limit is not None and self.running_counts[task_type] >= limit:
+                    break
+                task = self._pop_next_task(task_type)
+                if task is None:
+                    break
+                task.acquire()
+                self.running_counts[task_type] += 1
+                self.executor_running_counts[task.executor] += 1
+                self.wait_latencies[task_type].add(task.start_time - task.submit_time)
+                tasks.append(task)
+        return tasks
+
+    def _get_executor(self, name):
+        executor = self.executors.get(name, None)
+        if executor is None:
+            if name == EXECUTOR_PROCESS:
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.executor_workers[name])
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.executor_workers[name], thread_name_prefix=f'task_scheduler_{name}')
+            self.executors[name] = executor
+        return executor
+
+    def _dispatch(self):
+        with self.locker:
+            tasks = self._pop_dispatchable_tasks()
+            executors = [self._get_executor(task.executor) for task in tasks]
+
+        for task, executor in zip(tasks, executors):
+            if not task.future.set_running_or_notify_cancel():
+                _logger.info(f'{task} future cancelled, skip')
+                self._finish(task, None, None)
+                continue
+            try:
+                executor_future = executor.submit(task.fn, *task.args, **task.kwargs)
+            except Exception as e:
+                self._finish(task, None, e)
+                continue
+            executor_future.add_done_callback(lambda f, _task=task: self._finish(_task, f, None))
+
+    def _finish(self, task, executor_future, submit_exception):
+        with self.locker:
+            self.running_counts[task.task_type] -= 1
+            self.executor_running_counts[task.executor] -= 1
+            if not task.future.cancelled():
+                self.run_latencies[task.task_type].add(time.monotonic() - task.start_time)
+            self.task_container.remove_task(task.task_type, task.task_ident, release_item=True)
+
+        try:
+            if task.future.cancelled():
+                return
+            exception = submit_exception if executor_future is None else executor_future.exception()
+            if exception is not None:
+                _logger.warning(f'{task} failed : {exception}')
+                task.future.set_exception(exception)
+            else:
+                task.future.set_result(executor_future.result())
+        finally:
+            if not self.is_shutdown:
+                self._dispatch()
+
+    def metrics(self) -> dict:
+        """调度统计
+
+        :return:
+            key为任务类型，value包含等待中与执行中的任务数，以及等待与执行耗时
+        """
+        with self.locker:
+            task_types = set(self.queues) | set(self.running_counts) | set(self.wait_latencies)
+            return {task_type: {
+                'queue_depth': sum(len(q) for q in self.queues.get(task_type, dict()).values()),
+                'running': self.running_counts[task_type],
+                'wait_latency': self.wait_latencies[task_type].to_dict(),
+                'run_latency': self.run_latencies[task_type].to_dict(),
+            } for task_type in task_types}
+
+    def shutdown(self, wait=True):
+        """取消所有等待中的任务并关闭执行器"""
+        with self.locker:
+            self.is_shutdown = True
+            pending_tasks = [task for root_queues in self.queues.values()
+                             for root_queue in root_queues.values() for task in root_queue]
+            self.queues.clear()
+            for task in pending_tasks:
+                self.task_container.remove_task(task.task_type, task.task_ident)
+            executors = list(self.executors.values())
+
+        for task in pending_tasks:
+            task.future.cancel()
+        for executor in executors:
+            executor.shutdown(wait=wait)
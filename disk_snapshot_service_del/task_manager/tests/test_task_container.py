@@ -0,0 +1,63 @@
+from task_manager import task_container as tc
+from task_manager import task_item_abc
+
+
+class _Item(task_item_abc.TaskItem):
+
+    def __init__(self, key, keyed=True):
+        super(_Item, self).__init__()
+        self.key = key
+        self.keyed = keyed
+        self.release_count = 0
+
+    @property
+    def name(self):
+        return f'item {self.key}'
+
+    @property
+    def identity_key(self):
+        return self.key if self.keyed else None
+
+    def __eq__(self, other):
+        return isinstance(other, _Item) and self.key == other.key
+
+    def acquire(self):
+        super(_Item, self).acquire()
+
+    def release(self):
+        self.release_count += 1
+        return super(_Item, self).release()
+
+
+def test_add_and_remove_task():
+    container = tc.TaskContainer()
+
+    assert container.add_task('hashing', 'w1|a', _Item('a'))
+    assert not container.add_task('hashing', 'w2|a', _Item('a'))
+    assert container.add_task('hashing', 'w2|a', _Item('a'), item_can_dup=True)
+    assert container.add_task('hashing', 'w1|b', _Item('b'))
+    assert container.add_task('hashing', 'w10|c', _Item('c'))
+    assert container.count('hashing') == 4
+    assert container.counts() == {'hashing': 4}
+    assert container.get_task_by_identity_key('hashing', 'b').key == 'b'
+
+    assert container.remove_task('hashing', 'w1|a').key == 'a'  # 重复任务移除其一后，另一个仍然可以被查找
+    assert container.get_task('hashing', 'w2|a').key == 'a'
+    assert not container.add_task('hashing', 'w3|a', _Item('a'))
+
+    removed = container.remove_task_with_prefix_ident('hashing', 'w1|', release_item=True)
+    assert [item.key for item in removed] == ['b']
+    assert removed[0].release_count == 1
+    assert container.get_task_by_identity_key('hashing', 'b') is None
+    assert container.add_task('hashing', 'w3|b', _Item('b'))
+    assert sorted(item.key for item in container.get_task_items('hashing')) == ['a', 'b', 'c']
+
+
+def test_task_without_identity_key():
+    container = tc.TaskContainer()
+
+    assert container.add_task('open', '1', _Item('a', keyed=False))
+    assert not container.add_task('open', '2', _Item('a', keyed=False))
+    assert container.remove_task('open', '1').key == 'a'
+    assert container.add_task('open', '2', _Item('a', keyed=False))
+    assert container.remove_task('open', 'x') is None
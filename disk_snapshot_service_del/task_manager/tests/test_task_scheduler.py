@@ -0,0 +1,100 @@
+import threading
+
+from task_manager import task_container as tc
+from task_manager import task_scheduler as ts
+
+
+def _record(records, name):
+    records.append(name)
+    return name
+
+
+def _wait(event):
+    event.wait(10)
+
+
+def test_priority_and_fair_sharing():
+    scheduler = ts.TaskScheduler(tc.TaskContainer(), executor_workers={ts.EXECUTOR_THREAD: 1})
+    records = list()
+    gate = threading.Event()
+
+    blocker = scheduler.submit('open', 'blocker', _wait, gate)
+    futures = [
+        scheduler.submit(ts.TASK_TYPE_RECYCLING, 'r1', _record, records, 'r1'),
+        scheduler.submit(ts.TASK_TYPE_HASHING, 'a1', _record, records, 'a1', root_ident='a', identity_key='s1'),
+        scheduler.submit(ts.TASK_TYPE_HASHING, 'a2', _record, records, 'a2', root_ident='a'),
+        scheduler.submit(ts.TASK_TYPE_HASHING, 'b1', _record, records, 'b1', root_ident='b'),
+        scheduler.submit(ts.TASK_TYPE_OPEN, 'o1', _record, records, 'o1'),
+    ]
+    assert scheduler.submit(ts.TASK_TYPE_HASHING, 'a1', _record, records, 'dup') is None
+    assert scheduler.submit(ts.TASK_TYPE_HASHING, 'a3', _record, records, 'dup', identity_key='s1') is None
+    assert scheduler.metrics()[ts.TASK_TYPE_HASHING]['queue_depth'] == 3
+
+    assert scheduler.cancel(ts.TASK_TYPE_RECYCLING, 'r1')
+    assert not scheduler.cancel('open', 'blocker')
+
+    gate.set()
+    blocker.result(10)
+    for future in futures[1:]:
+        future.result(10)
+
+    assert futures[0].cancelled()
+    assert records == ['o1', 'a1', 'b1', 'a2']
+    metrics = scheduler.metrics()
+    assert metrics[ts.TASK_TYPE_HASHING]['run_latency']['count'] == 3
+    assert metrics[ts.TASK_TYPE_HASHING]['queue_depth'] == 0
+    assert scheduler.task_container.counts() == {'open': 0, 'recycling': 0, 'hashing': 0}
+    scheduler.shutdown()
+
+
+def test_concurrency_limit():
+    scheduler = ts.TaskScheduler(
+        tc.TaskContainer(), concurrency_limits={ts.TASK_TYPE_HASHING: 1}, executor_workers={ts.EXECUTOR_THREAD: 4})
+    gate = threading.Event()
+
+    futures = [scheduler.submit(ts.TASK_TYPE_HASHING, str(i), _wait, gate) for i in range(3)]
+    metrics = scheduler.metrics()[ts.TASK_TYPE_HASHING]
+    assert (metrics['running'], metrics['queue_depth']) == (1, 2)
+
+    gate.set()
+    for future in futures:
+        future.result(10)
+    scheduler.shutdown()
+
+
+def test_exception_and_process_executor():
+    scheduler = ts.TaskScheduler(tc.TaskContainer(), executor_workers={ts.EXECUTOR_PROCESS: 1})
+
+    assert scheduler.submit('verification', '1', pow, 2, 10, executor=ts.EXECUTOR_PROCESS).result(60) == 1024
+    future = scheduler.submit('verification', '2', int, 'x', executor=ts.EXECUTOR_PROCESS)
+    assert isinstance(future.exception(60), ValueError)
+    scheduler.shutdown()
+
+
+def test_cancelled_future_is_skipped():
+    scheduler = ts.TaskScheduler(
+        tc.TaskContainer(), concurrency_limits={ts.TASK_TYPE_HASHING: 1}, executor_workers={ts.EXECUTOR_THREAD: 4})
+    records = list()
+    gate = threading.Event()
+
+    blocker = scheduler.submit(ts.TASK_TYPE_HASHING, 'h0', _wait, gate)
+    cancelled = scheduler.submit(ts.TASK_TYPE_HASHING, 'h1', _record, records, 'h1')
+    waiting = scheduler.submit(ts.TASK_TYPE_HASHING, 'h2', _record, records, 'h2')
+    assert cancelled.cancel()
+
+    gate.set()
+    blocker.result(10)
+    assert waiting.result(10) == 'h2'
+
+    assert records == ['h2']
+    metrics = scheduler.metrics()[ts.TASK_TYPE_HASHING]
+    assert (metrics['running'], metrics['queue_depth']) == (0, 0)
+    assert metrics['run_latency']['count'] == 2
+    assert scheduler.task_container.count(ts.TASK_TYPE_HASHING) == 0
+    scheduler.shutdown()
+
+
+def test_global_scheduler_uses_own_container():
+    """调度器的任务类型与业务任务同名，不可写入全局任务容器"""
+    scheduler = ts.TaskScheduler.get_task_scheduler()
+    assert scheduler.task_container is not tc.TaskContainer.get_task_container()